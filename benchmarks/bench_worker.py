@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+"""Measures how a quota enforcement cycle scales with the number of users.
+
+Runs the real ``worker._run_cycle`` against in-process fakes (see ``fakes.py``)
+of vCenter, LDAP (an ldap3 MOCK server), SMTP and the vLab APIs, and reports
+the cycle time, the time spent in each backend, and memory use, for each
+number of users.
+
+Usage::
+
+    python benchmarks/bench_worker.py --users 100,1000,10000,50000
+
+To catch regressions, save a run with ``--save baseline.json``, then compare
+later runs with ``--baseline baseline.json``; the exit code is 1 if any cycle
+got slower by more than ``--tolerance``.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import socket
+import resource
+import tempfile
+import tracemalloc
+
+
+def free_port():
+    """Find a TCP port nothing is listening on.
+
+    :Returns: Integer
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+_KEY_FILE = tempfile.NamedTemporaryFile(mode='w', prefix='bench-auth-', delete=False)
+_KEY_FILE.write('benchmarking-the-vlab-quota-worker')
+_KEY_FILE.close()
+SMTP_PORT = free_port()
+# The config is read when vlab_quota is imported
+os.environ.setdefault('QUOTA_LOG_LEVEL', 'ERROR')
+os.environ.update({'AUTH_PRIVATE_KEY_LOCATION': _KEY_FILE.name,
+                   'AUTH_SEARCH_BASE': 'dc=vlab,dc=local',
+                   'QUOTA_EMAIL_SERVER': '127.0.0.1:{}'.format(SMTP_PORT),
+                   'QUOTA_EMAIL_SSL': '',
+                   'QUOTA_EMAIL_USERNAME': '',
+                   'QUOTA_EMAIL_DELIVERY': 'direct',
+                   'QUOTA_TRACE_FILE': ''})
+
+from vlab_quota import worker
+from vlab_quota.libs import const, metrics, sessions
+from vlab_quota.libs.tasks import TaskTracker
+from vlab_quota.libs.ldap_pool import LdapPool
+
+import fakes
+
+STAGES = ('vcenter', 'db', 'ldap', 'smtp', 'vlab_api')
+
+
+def _stage_totals():
+    """Read the total seconds spent in each backend from the worker's metrics.
+
+    :Returns: Dictionary
+    """
+    totals = dict.fromkeys(STAGES, 0.0)
+    prefix = '{}_sum{{stage="'.format(metrics.STAGE_SECONDS.name)
+    for line in metrics.STAGE_SECONDS.render().splitlines():
+        if line.startswith(prefix):
+            labels, value = line.rsplit(' ', 1)
+            totals[labels[len(prefix):-2]] = float(value)
+    return totals
+
+
+def _max_rss():
+    """The peak resident memory of the process, in MiB.
+
+    :Returns: Float
+    """
+    # Linux reports KiB, macOS reports bytes
+    scale = 1024 if sys.platform != 'darwin' else 1024 * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run(users, args, smtp):
+    """Benchmark enforcement cycles for a vLab with a given number of users.
+
+    :Returns: Dictionary
+
+    :param users: How many users the vLab has
+    :type users: Integer
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+
+    :param smtp: The fake SMTP server
+    :type smtp: fakes.SmtpSink
+    """
+    inventory = fakes.Inventory(users, const.VLAB_QUOTA_LIMIT, violators=args.violators)
+    vcenter = fakes.FakeVCenter(inventory, latency=args.vcenter_latency)
+    db = fakes.FakeDatabase(latency=args.db_latency)
+    # Some violators are past their grace period, so VMs get deleted too
+    expired = int(time.time()) - const.QUOTA_GRACE_PERIOD - 1
+    for idx, user in enumerate(sorted(inventory.violators)):
+        if idx % 2:
+            db.rows[user] = (expired, expired)
+    ldap_pool = LdapPool(fakes.make_ldap_factory(inventory.violators))
+    api = fakes.VlabApiServer(inventory, latency=args.api_latency, task_polls=args.task_polls)
+    api.start()
+    sessions.close()
+    sessions.get_session().mount('https://', fakes.RoutedAdapter(api.server_address,
+                                                                 pool_connections=const.QUOTA_HTTP_POOL_HOSTS,
+                                                                 pool_maxsize=const.QUOTA_HTTP_POOL_SIZE))
+    worker._EMAIL_CACHE.clear()
+    worker._NO_EMAIL_CACHE.clear()
+    # poll delete tasks every cycle, instead of backing off
+    task_tracker = TaskTracker(min_backoff=0, max_backoff=0)
+    smtp.delivered = 0
+    if args.tracemalloc:
+        tracemalloc.start()
+    cycles = []
+    stages_before = _stage_totals()
+    try:
+        for _ in range(args.cycles):
+            start = time.monotonic()
+            worker._run_cycle(vcenter, db, ldap_pool, None, task_tracker)
+            cycles.append(time.monotonic() - start)
+        stages_after = _stage_totals()
+        heap_peak = tracemalloc.get_traced_memory()[1] / 2**20 if args.tracemalloc else None
+    finally:
+        if args.tracemalloc:
+            tracemalloc.stop()
+        ldap_pool.close()
+        api.shutdown()
+        api.server_close()
+        sessions.close()
+    return {'users': users,
+            'violators': len(inventory.violators),
+            'cycles': cycles,
+            'stages': {x: stages_after[x] - stages_before[x] for x in STAGES},
+            'emails': smtp.delivered,
+            'max_rss_mib': _max_rss(),
+            'heap_peak_mib': heap_peak}
+
+
+def _report(result):
+    """Print the results for a number of users.
+
+    :Returns: None
+    """
+    cycles = ' '.join('{:.3f}'.format(x) for x in result['cycles'])
+    stages = ' '.join('{}={:.3f}'.format(k, v) for k, v in result['stages'].items())
+    memory = 'rss={:.1f}MiB'.format(result['max_rss_mib'])
+    if result['heap_peak_mib'] is not None:
+        memory += ' heap_peak={:.1f}MiB'.format(result['heap_peak_mib'])
+    print('users={users} violators={violators} emails={emails}'.format(**result))
+    print('  cycles(s): {}'.format(cycles))
+    print('  stages(s): {}'.format(stages))
+    print('  memory:    {}'.format(memory))
+
+
+def _regressions(results, baseline, tolerance, min_delta):
+    """Find every cycle that got slower than the baseline by more than the
+    tolerance; differences under ``min_delta`` seconds are noise.
+
+    :Returns: List of Strings
+    """
+    previous = {x['users']: x for x in baseline}
+    found = []
+    for result in results:
+        before = previous.get(result['users'])
+        if before is None:
+            continue
+        for idx, (now, then) in enumerate(zip(result['cycles'], before['cycles'])):
+            if now > then * (1 + tolerance) and now - then > min_delta:
+                found.append('users={} cycle {}: {:.3f}s vs {:.3f}s'.format(result['users'], idx, now, then))
+    return found
+
+
+def main():
+    """Entry point for the worker benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', default='100,1000,10000,50000',
+                        help='Comma separated numbers of users to benchmark')
+    parser.add_argument('--cycles', type=int, default=3,
+                        help='Enforcement cycles per number of users; the first one warns, later ones are steady state')
+    parser.add_argument('--violators', type=float, default=0.02,
+                        help='Fraction of users exceeding their quota')
+    parser.add_argument('--vcenter-latency', type=float, default=0.0, help='Seconds per vCenter round-trip')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Seconds per database query')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='Seconds per vLab API request')
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='Seconds per email')
+    parser.add_argument('--task-polls', type=int, default=0,
+                        help='Times a delete task reports 202 before it finishes')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='Also report the peak Python heap; slows everything down')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower (as a fraction) a cycle can get before it is a regression')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='Seconds a cycle must slow down by to be a regression; smaller changes are noise')
+    args = parser.parse_args()
+
+    smtp = fakes.SmtpSink(SMTP_PORT, latency=args.smtp_latency)
+    smtp.start()
+    results = []
+    try:
+        for users in [int(x) for x in args.users.split(',')]:
+            result = run(users, args, smtp)
+            _report(result)
+            results.append(result)
+    finally:
+        smtp.shutdown()
+        os.remove(_KEY_FILE.name)
+    if args.save:
+        with open(args.save, 'w') as the_file:
+            json.dump(results, the_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as the_file:
+            regressions = _regressions(results, json.load(the_file), args.tolerance, args.min_delta)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+# -*- coding: UTF-8 -*-
+"""In-process stand-ins for the services the quota worker talks to.
+
+Unlike the unit tests, these fakes sit *behind* the real client code: the
+worker's PropertyCollector parsing, LDAP filters, smtplib sessions and HTTP
+connection pool all run for real, against a synthetic inventory.
+"""
+import json
+import time
+import uuid
+import random
+import threading
+import socketserver
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlunsplit
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import jwt
+import ldap3
+from pyVmomi import vim
+from requests.adapters import HTTPAdapter
+
+from vlab_quota.libs import metrics
+
+LDAP_BASE = 'dc=vlab,dc=local'
+LDAP_BIND_USER = 'cn=quota,{}'.format(LDAP_BASE)
+LDAP_BIND_PASSWORD = 'a'
+
+
+class Inventory:
+    """A synthetic vLab: N user folders, where some users own more VMs than
+    the quota allows. Shared by the fake vCenter and the fake vLab API, so a
+    VM deleted via the API is gone from the next inventory scan.
+
+    :param users: How many users (i.e. user folders) to create
+    :type users: Integer
+
+    :param quota: The VM quota limit, excluding the defaultGateway
+    :type quota: Integer
+
+    :param violators: The fraction of users that exceed the quota
+    :type violators: Float
+
+    :param excess: How many VMs over the quota each violator owns
+    :type excess: Integer
+    """
+    def __init__(self, users, quota, violators=0.02, excess=3, seed=42):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.vms = {}
+        names = ['user{}'.format(x) for x in range(users)]
+        self.violators = set(rng.sample(names, int(users * violators)))
+        now = int(time.time())
+        for name in names:
+            count = quota + excess if name in self.violators else rng.randint(0, quota)
+            vms = [{'name': 'defaultGateway',
+                    'config.annotation': json.dumps({'component': 'defaultGateway', 'created': now}),
+                    'runtime.powerState': 'poweredOn',
+                    'summary.storage.committed': 1024}]
+            for idx in range(count):
+                vms.append({'name': 'vm{}'.format(idx),
+                            'config.annotation': json.dumps({'component': 'CentOS', 'created': now - idx}),
+                            'runtime.powerState': rng.choice(['poweredOn', 'poweredOff']),
+                            'summary.storage.committed': rng.randint(1, 100) * 2**30})
+            self.vms[name] = vms
+
+    def delete(self, user, vm_name):
+        """Remove a VM from the inventory
+
+        :Returns: None
+        """
+        with self.lock:
+            self.vms[user] = [x for x in self.vms.get(user, []) if x['name'] != vm_name]
+
+    def port_map(self, user):
+        """The portmapping rules of a user's defaultGateway; one rule per VM.
+
+        :Returns: Dictionary
+        """
+        with self.lock:
+            vms = list(self.vms.get(user, []))
+        return {str(50000 + idx): {'name': x['name']} for idx, x in enumerate(vms) if x['name'] != 'defaultGateway'}
+
+
+class _FakeCollector:
+    """Answers the PropertyCollector queries made by ``vlab_quota.libs.inventory``,
+    paging the results like vCenter does.
+    """
+    def __init__(self, inventory, latency, page_size):
+        self._inventory = inventory
+        self._latency = latency
+        self._page_size = page_size
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _page(self, objects):
+        time.sleep(self._latency)
+        page, rest = objects[:self._page_size], objects[self._page_size:]
+        token = None
+        if rest:
+            token = uuid.uuid4().hex
+            with self._lock:
+                self._pages[token] = rest
+        props = [SimpleNamespace(propSet=[SimpleNamespace(name=k, val=v) for k, v in x.items()]) for x in page]
+        return SimpleNamespace(objects=props, token=token)
+
+    def RetrievePropertiesEx(self, specSet, options):
+        spec = specSet[0]
+        parent = spec.objectSet[0].obj._moId
+        with self._inventory.lock:
+            if spec.propSet[0].type is vim.Folder:
+                objects = [{'name': user, 'childEntity': [None] * len(vms)} for user, vms in self._inventory.vms.items()]
+            else:
+                user = parent[len('user-'):]
+                objects = [dict(x) for x in self._inventory.vms.get(user, [])]
+        return self._page(objects)
+
+    def ContinueRetrievePropertiesEx(self, token):
+        with self._lock:
+            objects = self._pages.pop(token)
+        return self._page(objects)
+
+
+class FakeVCenter:
+    """Stands in for ``vlab_inf_common.vmware.vCenter``
+
+    :param inventory: The synthetic vLab
+    :type inventory: Inventory
+
+    :param latency: Seconds each PropertyCollector round-trip takes
+    :type latency: Float
+
+    :param page_size: The most objects per page of results
+    :type page_size: Integer
+    """
+    def __init__(self, inventory, latency=0, page_size=1000):
+        self.content = SimpleNamespace(propertyCollector=_FakeCollector(inventory, latency, page_size))
+
+    def get_vm_folder(self, path):
+        return vim.Folder('group-top')
+
+    def get_by_name(self, name, vimtype):
+        return vim.Folder('user-{}'.format(name))
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    """An in-memory stand-in for ``vlab_quota.libs.database.Database``, with
+    the methods the worker uses. Each call counts toward the ``db`` stage
+    metric, like the real one.
+
+    :param latency: Seconds each query takes, i.e. the network round-trip
+    :type latency: Float
+    """
+    def __init__(self, latency=0):
+        self._latency = latency
+        self._lock = threading.Lock()
+        self.rows = {}
+        self.events = []
+
+    def _query(self):
+        time.sleep(self._latency)
+
+    def users_info(self, usernames):
+        with metrics.STAGE_SECONDS.time(stage='db'), self._lock:
+            self._query()
+            return {x: self.rows.get(x, (0, 0)) for x in usernames}
+
+    def upsert_users(self, users):
+        with metrics.STAGE_SECONDS.time(stage='db'), self._lock:
+            self._query()
+            for username, violation_date, last_time_notified in users:
+                self.rows[username] = (violation_date, last_time_notified)
+
+    def remove_user(self, username):
+        self.remove_users([username])
+
+    def remove_users(self, usernames):
+        with metrics.STAGE_SECONDS.time(stage='db'), self._lock:
+            self._query()
+            return [x for x in usernames if self.rows.pop(x, None) is not None]
+
+    def reconcile_users(self, usernames):
+        with metrics.STAGE_SECONDS.time(stage='db'), self._lock:
+            self._query()
+            removed = list(set(self.rows) - set(usernames))
+            for username in removed:
+                self.rows.pop(username)
+            return removed
+
+    def record_events(self, events):
+        events = list(events)
+        if not events:
+            return
+        with metrics.STAGE_SECONDS.time(stage='db'), self._lock:
+            self._query()
+            self.events.extend(events)
+
+    def close(self):
+        pass
+
+
+def make_ldap_factory(users, domain='vlab.local'):
+    """Create an ldap3 MOCK server holding a User entry (with an email) for
+    every user, and return a factory of bound connections to it.
+
+    :Returns: Function
+    """
+    server = ldap3.Server('fake-ldap')
+    conn = ldap3.Connection(server, user=LDAP_BIND_USER, password=LDAP_BIND_PASSWORD,
+                            client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(LDAP_BIND_USER, {'userPassword': LDAP_BIND_PASSWORD, 'sn': 'quota'})
+    for user in users:
+        conn.strategy.add_entry('cn={},{}'.format(user, LDAP_BASE),
+                                {'objectClass': 'User',
+                                 'sAMAccountName': user,
+                                 'mail': '{}@{}'.format(user, domain)})
+
+    def factory():
+        # the DIT lives on the Server object, so every connection sees it
+        conn = ldap3.Connection(server, user=LDAP_BIND_USER, password=LDAP_BIND_PASSWORD,
+                                client_strategy=ldap3.MOCK_SYNC)
+        # auto_bind is a no-op with the MOCK strategies
+        conn.bind()
+        return conn
+    return factory
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib to deliver mail"""
+    disable_nagle_algorithm = True
+
+    def _reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        self._reply(b'220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line[:4].upper()
+            if verb in (b'EHLO', b'HELO'):
+                self._reply(b'250 sink')
+            elif verb in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self._reply(b'250 OK')
+            elif verb == b'DATA':
+                self._reply(b'354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(self.server.latency)
+                with self.server.lock:
+                    self.server.delivered += 1
+                self._reply(b'250 OK')
+            elif verb == b'QUIT':
+                self._reply(b'221 Bye')
+                return
+            else:
+                self._reply(b'502 Command not implemented')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """An SMTP server that accepts, counts and discards every email.
+
+    :param port: The TCP port to listen on
+    :type port: Integer
+
+    :param latency: Seconds the server takes to accept each email
+    :type latency: Float
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, latency=0):
+        super().__init__(('127.0.0.1', port), _SmtpHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.delivered = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True).start()
+
+
+class _VlabApiHandler(BaseHTTPRequestHandler):
+    """Emulates the vLab APIs the worker calls: deleting a VM (202 and a task
+    to poll), and listing/deleting a user's portmapping rules.
+    """
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real servers
+    # headers and body are separate writes; don't let Nagle + delayed ACKs add 40ms to each
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode()) if length else {}
+
+    def _user(self):
+        # i.e. Host: bob.vlab.local -> bob
+        return self.headers['Host'].split('.')[0]
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path.startswith('/api/1/ipam/portmap'):
+            self._respond(200, {'content': {'ports': self.server.inventory.port_map(self._user())}})
+        elif '/task/' in self.path:
+            task_id = self.path.rsplit('/', 1)[-1]
+            with self.server.lock:
+                remaining = self.server.tasks.get(task_id, 0)
+                self.server.tasks[task_id] = remaining - 1
+            self._respond(202 if remaining > 0 else 200, {'content': {}})
+        else:
+            self._respond(404, {'error': 'no such endpoint'})
+
+    def do_DELETE(self):
+        time.sleep(self.server.latency)
+        body = self._read_body()
+        if self.path.startswith('/api/1/ipam/portmap'):
+            self._respond(200, {'content': {}})
+        elif self.path.startswith('/api/2/inf/'):
+            # the user is only in the auth token; no need to verify it here
+            claims = jwt.decode(self.headers['X-Auth'], options={'verify_signature': False})
+            self.server.inventory.delete(claims['username'], body['name'])
+            task_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.tasks[task_id] = self.server.task_polls
+            link = '<https://{}{}/task/{}>; rel=status'.format(self.headers['Host'], self.path, task_id)
+            self._respond(202, {'content': {'task-id': task_id}}, headers={'Link': link})
+        else:
+            self._respond(404, {'error': 'no such endpoint'})
+
+
+class VlabApiServer(socketserver.ThreadingMixIn, HTTPServer):
+    """A local HTTP server that emulates the vLab APIs.
+
+    :param inventory: The synthetic vLab; deleted VMs are removed from it
+    :type inventory: Inventory
+
+    :param latency: Seconds each request takes
+    :type latency: Float
+
+    :param task_polls: How many times a delete task reports 202 before it's done
+    :type task_polls: Integer
+    """
+    daemon_threads = True
+
+    def __init__(self, inventory, latency=0, task_polls=0):
+        super().__init__(('127.0.0.1', 0), _VlabApiHandler)
+        self.inventory = inventory
+        self.latency = latency
+        self.task_polls = task_polls
+        self.lock = threading.Lock()
+        self.tasks = {}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='vlab-api', daemon=True).start()
+
+
+class RoutedAdapter(HTTPAdapter):
+    """Sends every request to one local server, keeping the original host in
+    the Host header; so ``https://bob.vlab.local/...`` works without DNS or TLS.
+
+    :param address: The (IP, port) of the local server
+    :type address: Tuple
+    """
+    def __init__(self, address, **kwargs):
+        self._address = address
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.headers['Host'] = parts.netloc
+        request.url = urlunsplit(('http', '{}:{}'.format(*self._address), parts.path, parts.query, ''))
+        return super().send(request, **kwargs)
@@ -13,4 +13,20 @@ psql -v ON_ERROR_STOP=1 --username ${POSTGRES_USER} --dbname quota <<-EOSQL
     triggered  BIGINT NOT NULL,
     last_notified BIGINT
   );
+  CREATE TABLE quota_outbox(
+    id BIGSERIAL PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    mail TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt BIGINT NOT NULL,
+    created BIGINT NOT NULL
+  );
+  CREATE INDEX quota_outbox_next_attempt ON quota_outbox (next_attempt);
+  CREATE TABLE quota_events(
+    created BIGINT NOT NULL,
+    username TEXT NOT NULL,
+    event TEXT NOT NULL,
+    vms INTEGER NOT NULL DEFAULT 0
+  );
+  CREATE INDEX quota_events_created ON quota_events USING BRIN (created);
 EOSQL
@@ -3,7 +3,7 @@
 import unittest
 
 from jsonschema import Draft4Validator, validate, ValidationError
-from vlab_quota.libs.views import quota
+from vlab_quota.libs.views import quota, events
 
 
 class TestQuotaViewSchema(unittest.TestCase):
@@ -20,5 +20,19 @@ class TestQuotaViewSchema(unittest.TestCase):
         self.assertTrue(schema_valid)
 
 
+class TestEventsViewSchema(unittest.TestCase):
+    """A set of test cases of /api/1/quota/events"""
+
+    def test_get_schema(self):
+        """The schema defined for GET is valid"""
+        try:
+            Draft4Validator.check_schema(events.EventsView.GET_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+
 if __name__ == '__main__':
     unittest.main()
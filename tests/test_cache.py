@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``cache.py`` module"""
+import unittest
+from unittest.mock import patch
+
+from vlab_quota.libs import cache
+
+
+class TestTTLCache(unittest.TestCase):
+    """A suite of test cases for the ``TTLCache`` object"""
+
+    def test_get(self):
+        """``TTLCache.get`` returns a cached value"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+        the_cache.set('bob', 'bob@vlab.local')
+
+        self.assertEqual(the_cache.get('bob'), 'bob@vlab.local')
+
+    def test_default(self):
+        """``TTLCache.get`` returns the default for missing entries"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+
+        self.assertEqual(the_cache.get('bob', 'doh'), 'doh')
+
+    def test_expires(self):
+        """``TTLCache.get`` does not return expired entries"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+        with patch.object(cache.time, 'monotonic') as fake_monotonic:
+            fake_monotonic.return_value = 100
+            the_cache.set('bob', 'bob@vlab.local')
+            fake_monotonic.return_value = 161
+            value = the_cache.get('bob')
+
+        self.assertTrue(value is None)
+        self.assertEqual(len(the_cache), 0)
+
+    def test_lru(self):
+        """``TTLCache`` evicts the least recently used entry when full"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+        the_cache.set('bob', 1)
+        the_cache.set('sam', 2)
+        the_cache.get('bob')
+        the_cache.set('lisa', 3)
+
+        self.assertEqual(the_cache.get('bob'), 1)
+        self.assertTrue(the_cache.get('sam') is None)
+        self.assertEqual(the_cache.get('lisa'), 3)
+
+    def test_pop(self):
+        """``TTLCache.pop`` removes an entry"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+        the_cache.set('bob', 1)
+        the_cache.pop('bob')
+        the_cache.pop('not-there')
+
+        self.assertTrue(the_cache.get('bob') is None)
+
+    def test_clear(self):
+        """``TTLCache.clear`` removes every entry"""
+        the_cache = cache.TTLCache(maxsize=2, ttl=60)
+        the_cache.set('bob', 1)
+        the_cache.set('sam', 2)
+        the_cache.clear()
+
+        self.assertEqual(len(the_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
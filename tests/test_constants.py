@@ -12,6 +12,9 @@ class TestConsts(unittest.TestCase):
         found = [x for x in dir(const) if x.isupper() and not x.startswith('_')]
         expected = ['DB_DATABASE_NAME',
                     'DB_HOST',
+                    'DB_POOL_MIN',
+                    'DB_POOL_MAX',
+                    'DB_POOL_TIMEOUT',
                     'DB_PASSWORD',
                     'DB_USER',
                     'INF_VCENTER_PASSWORD',
@@ -30,7 +33,19 @@ class TestConsts(unittest.TestCase):
                     'QUOTA_EMAIL_BCC',
                     'VLAB_QUOTA_LIMIT',
                     'QUOTA_GRACE_PERIOD',
+                    'QUOTA_DELETE_WORKERS',
+                    'QUOTA_NOTIFY_WORKERS',
+                    'QUOTA_USER_DELETE_WORKERS',
+                    'QUOTA_MAX_INFLIGHT_DELETES',
+                    'QUOTA_VICTIM_POLICY',
+                    'QUOTA_TASK_TIMEOUT',
+                    'QUOTA_TASK_MAX_BACKOFF',
+                    'QUOTA_HTTP_CONNECT_TIMEOUT',
+                    'QUOTA_HTTP_READ_TIMEOUT',
+                    'QUOTA_HTTP_POOL_HOSTS',
+                    'QUOTA_HTTP_POOL_SIZE',
                     'AUTH_TOKEN_ALGORITHM',
+                    'QUOTA_TOKEN_REFRESH_MARGIN',
                     'VLAB_LOCAL_IP',
                     'VLAB_SERVER_IP',
                     'AUTH_TOKEN_VERSION',
@@ -39,8 +54,36 @@ class TestConsts(unittest.TestCase):
                     'AUTH_BIND_PASSWORD_LOCATION',
                     'AUTH_BIND_USER',
                     'INF_VCENTER_TOP_LVL_DIR',
+                    'QUOTA_INVENTORY_MODE',
                     'AUTH_SEARCH_BASE',
-                    'AUTH_LDAP_URL',]
+                    'AUTH_LDAP_URL',
+                    'QUOTA_EMAIL_CACHE_SIZE',
+                    'QUOTA_EMAIL_CACHE_TTL',
+                    'QUOTA_EMAIL_MISS_TTL',
+                    'QUOTA_LDAP_POOL_SIZE',
+                    'QUOTA_LDAP_POOL_TIMEOUT',
+                    'QUOTA_LDAP_MAX_IDLE',
+                    'QUOTA_LDAP_PROBE_IDLE',
+                    'QUOTA_LDAP_TIMEOUT',
+                    'QUOTA_METRICS_PORT',
+                    'QUOTA_TRACE_FILE',
+                    'QUOTA_LOOP_MIN_INTERVAL',
+                    'QUOTA_LOOP_MAX_INTERVAL',
+                    'QUOTA_LOOP_MAX_BACKOFF',
+                    'QUOTA_LOOP_JITTER',
+                    'QUOTA_WORKER_MODE',
+                    'QUOTA_SHARD_COUNT',
+                    'QUOTA_SHARD_VNODES',
+                    'QUOTA_API_CACHE_SIZE',
+                    'QUOTA_API_CACHE_TTL',
+                    'QUOTA_ADMINS',
+                    'QUOTA_EMAIL_DELIVERY',
+                    'QUOTA_EVENT_HISTORY',
+                    'QUOTA_OUTBOX_SENDERS',
+                    'QUOTA_OUTBOX_BATCH_SIZE',
+                    'QUOTA_OUTBOX_MAX_ATTEMPTS',
+                    'QUOTA_OUTBOX_MAX_BACKOFF',
+                    'QUOTA_OUTBOX_LEASE',]
 
         # set() avoids false positives due to ordering
         self.assertEqual(set(found), set(expected))
@@ -105,6 +105,98 @@ class TestDatabase(unittest.TestCase):
 
         self.assertEqual(exceeded_quota_epoch, expected)
 
+    def test_user_info_exact_match(self):
+        """``user_info`` looks up the user by exact match, not a pattern"""
+        db = database.Database()
+        db.user_info('sally')
+
+        the_args, _ = db._cursor.execute.call_args
+        sql = the_args[0]
+        expected_sql = 'SELECT triggered, last_notified FROM quota_violations WHERE username = %s;'
+
+        self.assertEqual(sql, expected_sql)
+
+    def test_users_info(self):
+        """``users_info`` returns a dictionary of username to violation info"""
+        fake_fetchall = MagicMock()
+        fake_fetchall.return_value = [('sally', 1234, 5678)]
+        db = database.Database()
+        db._cursor.fetchall = fake_fetchall
+
+        info = db.users_info(['sally', 'bob'])
+        expected = {'sally': (1234, 5678), 'bob': (0, 0)}
+
+        self.assertEqual(info, expected)
+
+    def test_users_info_one_query(self):
+        """``users_info`` looks up every user with a single query"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = []
+        db.users_info(['sally', 'bob'])
+
+        the_args, _ = db._cursor.execute.call_args
+        sql, params = the_args
+        expected_sql = 'SELECT username, triggered, last_notified FROM quota_violations WHERE username = ANY(%s);'
+
+        self.assertEqual(db._cursor.execute.call_count, 1)
+        self.assertEqual(sql, expected_sql)
+        self.assertEqual(params, (['sally', 'bob'],))
+
+    def test_users_info_empty(self):
+        """``users_info`` does not query the database when no users are supplied"""
+        db = database.Database()
+        info = db.users_info([])
+
+        self.assertEqual(info, {})
+        self.assertFalse(db._cursor.execute.called)
+
+    def test_iter_violations(self):
+        """``iter_violations`` yields every row from a server-side cursor"""
+        db = database.Database()
+        named_cursor = MagicMock()
+        named_cursor.__iter__.return_value = iter([('bob', 1, 2), ('sam', 3, 4)])
+        self.mocked_connection.cursor.return_value = named_cursor
+
+        rows = list(db.iter_violations())
+        _, the_kwargs = self.mocked_connection.cursor.call_args
+
+        self.assertEqual(rows, [('bob', 1, 2), ('sam', 3, 4)])
+        self.assertTrue(the_kwargs['name'])
+
+    def test_iter_violations_keyset(self):
+        """``iter_violations`` pages through the rows by username"""
+        db = database.Database()
+        named_cursor = MagicMock()
+        self.mocked_connection.cursor.return_value = named_cursor
+
+        list(db.iter_violations(after='bob', limit=10))
+        the_args, _ = named_cursor.execute.call_args
+        sql, params = the_args
+        expected_sql = 'SELECT username, triggered, last_notified FROM quota_violations WHERE username > %s ORDER BY username LIMIT %s'
+
+        self.assertEqual(sql, expected_sql)
+        self.assertEqual(params, ['bob', 10])
+
+    def test_iter_violations_ends_transaction(self):
+        """``iter_violations`` ends the transaction once done"""
+        self.mocked_connection.closed = 0
+        db = database.Database()
+        self.mocked_connection.cursor.return_value = MagicMock()
+
+        list(db.iter_violations())
+
+        self.assertTrue(self.mocked_connection.rollback.called)
+
+    def test_iter_violations_error(self):
+        """``iter_violations`` raises DatabaseError instead of psycopg2 errors"""
+        db = database.Database()
+        named_cursor = MagicMock()
+        named_cursor.execute.side_effect = psycopg2.Error('testing')
+        self.mocked_connection.cursor.return_value = named_cursor
+
+        with self.assertRaises(database.DatabaseError):
+            list(db.iter_violations())
+
     def test_remove_user(self):
         """``remove_user`` executes the expected SQL to delete a user"""
         db = database.Database()
@@ -112,10 +204,70 @@ class TestDatabase(unittest.TestCase):
 
         the_args, _ = db._cursor.execute.call_args
         sql = the_args[0]
-        expected_sql = 'DELETE FROM quota_violations WHERE username LIKE (%s)'
+        expected_sql = "WITH changed AS (\n                    DELETE FROM quota_violations WHERE username = ANY(%s) RETURNING username\n                 )\n                 SELECT username, pg_notify('quota_violations', username) FROM changed;\n        "
 
         self.assertEqual(sql, expected_sql)
 
+    def test_remove_users(self):
+        """``remove_users`` deletes many users with a single statement"""
+        db = database.Database()
+        db.remove_users(['nick', 'sally'])
+
+        the_args, _ = db._cursor.execute.call_args
+        params = the_args[1]
+        expected = (['nick', 'sally'],)
+
+        self.assertEqual(db._cursor.execute.call_count, 1)
+        self.assertEqual(params, expected)
+
+    def test_remove_users_returns(self):
+        """``remove_users`` returns the users that had a record to remove"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [('nick', '')]
+
+        removed = db.remove_users(['nick', 'sally'])
+
+        self.assertEqual(removed, ['nick'])
+
+    def test_remove_users_empty(self):
+        """``remove_users`` does not query the database when no users are supplied"""
+        db = database.Database()
+        removed = db.remove_users([])
+
+        self.assertEqual(removed, [])
+        self.assertFalse(db._cursor.execute.called)
+
+    def test_reconcile_users(self):
+        """``reconcile_users`` deletes every user not currently exceeding their quota with a single statement"""
+        db = database.Database()
+        db.reconcile_users({'nick'})
+
+        the_args, _ = db._cursor.execute.call_args
+        sql, params = the_args
+        expected_sql = "WITH changed AS (\n                    DELETE FROM quota_violations WHERE username <> ALL(%s) RETURNING username\n                 )\n                 SELECT username, pg_notify('quota_violations', username) FROM changed;\n        "
+
+        self.assertEqual(sql, expected_sql)
+        self.assertEqual(params, (['nick'],))
+
+    def test_reconcile_users_returns(self):
+        """``reconcile_users`` returns the users that were removed"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [('sally', '')]
+
+        removed = db.reconcile_users({'nick'})
+
+        self.assertEqual(removed, ['sally'])
+
+    def test_reconcile_users_empty(self):
+        """``reconcile_users`` removes every user when nobody is exceeding their quota"""
+        db = database.Database()
+        db.reconcile_users(set())
+
+        the_args, _ = db._cursor.execute.call_args
+        params = the_args[1]
+
+        self.assertEqual(params, ([],))
+
     def test_upsert_user(self):
         """``upsert_user`` Executes SQL that will create or update a user"""
         db = database.Database()
@@ -123,10 +275,303 @@ class TestDatabase(unittest.TestCase):
 
         the_args, _ = db._cursor.execute.call_args
         sql = the_args[0]
-        expected_sql = 'INSERT INTO quota_violations (username, triggered, last_notified)\n                 VALUES (%s, %s, %s)\n                 ON CONFLICT (username)\n                 DO UPDATE SET\n                    (triggered, last_notified)\n                    = (EXCLUDED.triggered, EXCLUDED.last_notified);\n        '
+        expected_sql = "WITH changed AS (\n                    INSERT INTO quota_violations (username, triggered, last_notified)\n                    VALUES (%s, %s, %s)\n                    ON CONFLICT (username)\n                    DO UPDATE SET\n                       (triggered, last_notified)\n                       = (EXCLUDED.triggered, EXCLUDED.last_notified)\n                    RETURNING username\n                 )\n                 SELECT pg_notify('quota_violations', username) FROM changed;\n        "
 
         self.assertEqual(sql, expected_sql)
 
+    @patch.object(database, 'execute_values')
+    def test_upsert_users(self, fake_execute_values):
+        """``upsert_users`` creates or updates many users with a single statement"""
+        db = database.Database()
+        db.upsert_users([('nick', 100, 100), ('sally', 200, 200)])
+
+        the_args, _ = fake_execute_values.call_args
+        sql, rows = the_args[1], the_args[2]
+
+        self.assertEqual(fake_execute_values.call_count, 1)
+        self.assertTrue('VALUES %s' in sql)
+        self.assertTrue("pg_notify('quota_violations', username)" in sql)
+        self.assertEqual(rows, [('nick', 100, 100), ('sally', 200, 200)])
+        self.assertTrue(self.mocked_connection.commit.called)
+
+    @patch.object(database, 'execute_values')
+    def test_upsert_users_empty(self, fake_execute_values):
+        """``upsert_users`` does not query the database when no users are supplied"""
+        db = database.Database()
+        db.upsert_users([])
+
+        self.assertFalse(fake_execute_values.called)
+
+    @patch.object(database, 'execute_values')
+    def test_execute_values_error(self, fake_execute_values):
+        """``execute_values`` rolls back, and raises DatabaseError upon error"""
+        fake_execute_values.side_effect = psycopg2.Error('testing')
+        db = database.Database()
+
+        with self.assertRaises(database.DatabaseError):
+            db.execute_values('INSERT INTO foo (bar) VALUES %s', [(1,)])
+        self.assertEqual(self.mocked_connection.rollback.call_count, 1)
+
+    @patch.object(database, 'execute_values')
+    def test_enqueue_emails(self, fake_execute_values):
+        """``enqueue_emails`` adds many emails to the outbox with a single statement"""
+        db = database.Database()
+        db.enqueue_emails([('bob@vlab.local', 'mail1'), ('sam@vlab.local', 'mail2')])
+
+        the_args, _ = fake_execute_values.call_args
+        rows = the_args[2]
+
+        self.assertEqual(fake_execute_values.call_count, 1)
+        self.assertEqual([x[:2] for x in rows], [('bob@vlab.local', 'mail1'), ('sam@vlab.local', 'mail2')])
+
+    @patch.object(database, 'execute_values')
+    def test_enqueue_warnings(self, fake_execute_values):
+        """``enqueue_warnings`` queues the emails and records the users in a single transaction"""
+        db = database.Database()
+        db.enqueue_warnings([('bob@vlab.local', 'mail1')], [('bob', 100, 100)])
+
+        statements = [x[0][1] for x in fake_execute_values.call_args_list]
+
+        self.assertEqual(len(statements), 2)
+        self.assertTrue('quota_outbox' in statements[0])
+        self.assertTrue('quota_violations' in statements[1])
+        self.assertEqual(self.mocked_connection.commit.call_count, 1)
+
+    @patch.object(database, 'execute_values')
+    def test_enqueue_warnings_error(self, fake_execute_values):
+        """``enqueue_warnings`` rolls back both statements upon error"""
+        fake_execute_values.side_effect = [None, psycopg2.Error('testing')]
+        db = database.Database()
+
+        with self.assertRaises(database.DatabaseError):
+            db.enqueue_warnings([('bob@vlab.local', 'mail1')], [('bob', 100, 100)])
+        self.assertFalse(self.mocked_connection.commit.called)
+        self.assertEqual(self.mocked_connection.rollback.call_count, 1)
+
+    @patch.object(database, 'execute_values')
+    def test_enqueue_emails_empty(self, fake_execute_values):
+        """``enqueue_emails`` does not query the database when there are no emails"""
+        db = database.Database()
+        db.enqueue_emails([])
+
+        self.assertFalse(fake_execute_values.called)
+
+    def test_claim_emails(self):
+        """``claim_emails`` skips emails already claimed by someone else"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(1, 'bob@vlab.local', 'mail1', 1)]
+
+        emails = db.claim_emails(limit=10, lease=60)
+        the_args, _ = db._cursor.execute.call_args
+        sql = the_args[0]
+
+        self.assertEqual(emails, [(1, 'bob@vlab.local', 'mail1', 1)])
+        self.assertTrue('FOR UPDATE SKIP LOCKED' in sql)
+
+    def test_delete_emails(self):
+        """``delete_emails`` removes many emails with a single statement"""
+        db = database.Database()
+        db.delete_emails([1, 2])
+
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertEqual(the_args[1], ([1, 2],))
+
+    @patch.object(database, 'execute_values')
+    def test_retry_emails(self, fake_execute_values):
+        """``retry_emails`` reschedules many emails with a single statement"""
+        db = database.Database()
+        db.retry_emails([(1, 100), (2, 200)])
+
+        the_args, _ = fake_execute_values.call_args
+
+        self.assertEqual(the_args[2], [(1, 100), (2, 200)])
+
+    @patch.object(database, 'execute_values')
+    def test_record_events(self, fake_execute_values):
+        """``record_events`` appends many events with a single statement"""
+        db = database.Database()
+        db.record_events([(1, 'bob', 'warned', 8), (1, 'sam', 'deleted', 2)])
+
+        the_args, _ = fake_execute_values.call_args
+
+        self.assertEqual(fake_execute_values.call_count, 1)
+        self.assertEqual(the_args[2], [(1, 'bob', 'warned', 8), (1, 'sam', 'deleted', 2)])
+
+    @patch.object(database, 'execute_values')
+    def test_record_events_empty(self, fake_execute_values):
+        """``record_events`` does not query the database when there are no events"""
+        db = database.Database()
+        db.record_events([])
+
+        self.assertFalse(fake_execute_values.called)
+
+    def test_event_aggregates(self):
+        """``event_aggregates`` only reads the events within the time range"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(0, 'warned', 3, 2, 12)]
+
+        rows = db.event_aggregates(0, 7200, 3600)
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertEqual(rows, [(0, 'warned', 3, 2, 12)])
+        self.assertEqual(the_args[1], (3600, 3600, 0, 7200))
+
+    def test_join_shard_group(self):
+        """``join_shard_group`` returns False if the member ID is already in use"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(False,)]
+
+        joined = db.join_shard_group(42)
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertFalse(joined)
+        self.assertEqual(the_args[1], (database.MEMBER_LOCK_SPACE, 42))
+
+    def test_shard_group_members(self):
+        """``shard_group_members`` returns the IDs of every member"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(1,), (42,)]
+
+        members = db.shard_group_members()
+
+        self.assertEqual(members, [1, 42])
+
+    def test_held_shards(self):
+        """``held_shards`` only returns the shards locked by this connection"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(3,), (7,)]
+
+        shards = db.held_shards()
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertEqual(shards, [3, 7])
+        self.assertTrue('pg_backend_pid()' in the_args[0])
+
+    def test_lock_shards(self):
+        """``lock_shards`` returns the shards that were locked"""
+        db = database.Database()
+        db._cursor.fetchall.return_value = [(3,)]
+
+        locked = db.lock_shards({3, 7})
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertEqual(locked, [3])
+        self.assertEqual(sorted(the_args[1][0]), [3, 7])
+
+    def test_lock_shards_empty(self):
+        """``lock_shards`` does not query the database when there are no shards"""
+        db = database.Database()
+
+        locked = db.lock_shards([])
+
+        self.assertEqual(locked, [])
+        self.assertFalse(db._cursor.execute.called)
+
+    def test_unlock_shards(self):
+        """``unlock_shards`` unlocks many shards with a single statement"""
+        db = database.Database()
+        db.unlock_shards([3, 7])
+
+        the_args, _ = db._cursor.execute.call_args
+
+        self.assertEqual(the_args[1], (database.SHARD_LOCK_SPACE, [3, 7]))
+
+    def test_unlock_shards_empty(self):
+        """``unlock_shards`` does not query the database when there are no shards"""
+        db = database.Database()
+        db.unlock_shards([])
+
+        self.assertFalse(db._cursor.execute.called)
+
+@patch.object(database, 'ThreadedConnectionPool')
+class TestDatabasePooled(unittest.TestCase):
+    """A suite of tests for the pooled mode of the Database object"""
+    def setUp(self):
+        """Runs before every test case"""
+        database._POOLS.clear()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        database._POOLS.clear()
+
+    def test_borrows_connection(self, fake_ThreadedConnectionPool):
+        """``Database`` borrows a connection from the pool when ``pooled=True``"""
+        fake_pool = fake_ThreadedConnectionPool.return_value
+        db = database.Database(pooled=True)
+
+        self.assertTrue(db._connection is fake_pool.getconn.return_value)
+
+    def test_returns_connection(self, fake_ThreadedConnectionPool):
+        """``Database`` returns the connection to the pool instead of closing it"""
+        fake_pool = fake_ThreadedConnectionPool.return_value
+        fake_pool.getconn.return_value.closed = 0
+        with database.Database(pooled=True) as db:
+            pass
+
+        fake_pool.putconn.assert_called_with(db._connection, close=False)
+        self.assertFalse(db._connection.close.called)
+
+    def test_discards_broken(self, fake_ThreadedConnectionPool):
+        """``Database`` has the pool discard a connection that was closed"""
+        fake_pool = fake_ThreadedConnectionPool.return_value
+        fake_pool.getconn.return_value.closed = 2
+        with database.Database(pooled=True) as db:
+            pass
+
+        fake_pool.putconn.assert_called_with(db._connection, close=True)
+
+    def test_close_twice(self, fake_ThreadedConnectionPool):
+        """``Database`` only returns the connection to the pool once"""
+        fake_pool = fake_ThreadedConnectionPool.return_value
+        with database.Database(pooled=True) as db:
+            db.close()
+
+        self.assertEqual(fake_pool.putconn.call_count, 1)
+
+    def test_one_pool(self, fake_ThreadedConnectionPool):
+        """``Database`` shares one pool within a process"""
+        database.Database(pooled=True).close()
+        database.Database(pooled=True).close()
+
+        self.assertEqual(fake_ThreadedConnectionPool.call_count, 1)
+
+    @patch.object(database.os, 'getpid')
+    def test_new_pool_after_fork(self, fake_getpid, fake_ThreadedConnectionPool):
+        """``Database`` creates a new pool in a forked process"""
+        fake_getpid.return_value = 1
+        database.Database(pooled=True).close()
+        fake_getpid.return_value = 2
+        database.Database(pooled=True).close()
+
+        self.assertEqual(fake_ThreadedConnectionPool.call_count, 2)
+
+    @patch.object(database, 'const')
+    def test_checkout_timeout(self, fake_const, fake_ThreadedConnectionPool):
+        """``Database`` raises DatabaseError when no pooled connection frees up in time"""
+        fake_const.DB_POOL_MIN = 1
+        fake_const.DB_POOL_MAX = 1
+        fake_const.DB_POOL_TIMEOUT = 0
+        fake_const.QUOTA_LOG_LEVEL = 'INFO'
+        database.Database(pooled=True)
+
+        with self.assertRaises(database.DatabaseError):
+            database.Database(pooled=True)
+
+    def test_checkout_error(self, fake_ThreadedConnectionPool):
+        """``Database`` frees up the pool slot if it cannot obtain a connection"""
+        fake_pool = fake_ThreadedConnectionPool.return_value
+        fake_pool.getconn.side_effect = [psycopg2.OperationalError('testing'), MagicMock()]
+        with self.assertRaises(database.DatabaseError):
+            database.Database(pooled=True)
+        _, slots = database._get_pool(database=database.const.DB_DATABASE_NAME,
+                                      host=database.const.DB_HOST,
+                                      user=database.const.DB_USER,
+                                      password=database.const.DB_PASSWORD)
+        # all slots free means the semaphore can't be released again
+        with self.assertRaises(ValueError):
+            slots.release()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``events.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_quota.libs import events
+from vlab_quota.libs.database import DatabaseError
+
+
+@patch.object(events, 'log')
+class TestEventLog(unittest.TestCase):
+    """A suite of test cases for the ``EventLog`` object"""
+    @patch.object(events.time, 'time')
+    def test_flush(self, fake_time, fake_log):
+        """``EventLog.flush`` writes every queued event with a single statement"""
+        fake_time.return_value = 1234.5
+        fake_db = MagicMock()
+        event_log = events.EventLog(fake_db)
+        event_log.record('bob', events.WARNED, vms=8)
+        event_log.record('sam', events.RECONCILED)
+
+        event_log.flush()
+        expected = [(1234, 'bob', 'warned', 8), (1234, 'sam', 'reconciled', 0)]
+
+        fake_db.record_events.assert_called_once_with(expected)
+        self.assertEqual(len(event_log), 0)
+
+    def test_unknown_event(self, fake_log):
+        """``EventLog.record`` raises ValueError for an unknown type of event"""
+        event_log = events.EventLog(MagicMock())
+
+        with self.assertRaises(ValueError):
+            event_log.record('bob', 'exploded')
+
+    def test_context_manager(self, fake_log):
+        """``EventLog`` flushes upon exiting the ``with`` block"""
+        fake_db = MagicMock()
+        with events.EventLog(fake_db) as event_log:
+            event_log.record('bob', events.DELETED, vms=2)
+
+        self.assertTrue(fake_db.record_events.called)
+
+    def test_keeps_original_error(self, fake_log):
+        """``EventLog`` doesn't hide the error that ended the ``with`` block when the flush fails too"""
+        fake_db = MagicMock()
+        fake_db.record_events.side_effect = DatabaseError('flush failed', pgcode=None)
+
+        with self.assertRaises(RuntimeError):
+            with events.EventLog(fake_db) as event_log:
+                event_log.record('bob', events.DELETED, vms=2)
+                raise RuntimeError('testing')
+
+        self.assertTrue(fake_log.error.called)
+
+    def test_flush_error(self, fake_log):
+        """``EventLog`` logs, and doesn't raise, an error writing the history"""
+        fake_db = MagicMock()
+        fake_db.record_events.side_effect = DatabaseError('flush failed', pgcode=None)
+
+        with events.EventLog(fake_db) as event_log:
+            event_log.record('bob', events.DELETED, vms=2)
+
+        self.assertTrue(fake_log.error.called)
+        self.assertEqual(len(event_log), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the EventsView object"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+from flask import Flask
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_quota.libs.views import events
+
+
+class TestEventsView(unittest.TestCase):
+    """A suite of test cases for the EventsView object"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.token = generate_v2_test_token(username='sally')
+        cls.non_admin_token = generate_v2_test_token(username='bob')
+
+    @classmethod
+    def setUp(cls):
+        """Run before every test case"""
+        app = Flask(__name__)
+        events.EventsView.register(app)
+        cls.app = app.test_client()
+        events.const.QUOTA_ADMINS.append('sally')
+
+    @classmethod
+    def tearDown(cls):
+        """Run after every test case"""
+        events.const.QUOTA_ADMINS.remove('sally')
+
+    @patch.object(events, 'Database')
+    def test_aggregates(self, fake_Database):
+        """EventsView - GET on /api/1/quota/events returns the aggregates of each bucket"""
+        fake_db = fake_Database.return_value.__enter__.return_value
+        fake_db.event_aggregates.return_value = [(0, 'deleted', 2, 1, 5), (3600, 'warned', 3, 3, 12)]
+        resp = self.app.get('/api/1/quota/events?start=0&end=7200&bucket=3600', headers={'X-Auth': self.token})
+
+        content = ujson.loads(resp.get_data(as_text=True))['content']
+        expected = [{'start': 0, 'event': 'deleted', 'count': 2, 'users': 1, 'vms': 5},
+                    {'start': 3600, 'event': 'warned', 'count': 3, 'users': 3, 'vms': 12}]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(content['aggregates'], expected)
+        fake_db.event_aggregates.assert_called_with(0, 7200, 3600)
+
+    @patch.object(events.time, 'time')
+    @patch.object(events, 'Database')
+    def test_defaults(self, fake_Database, fake_time):
+        """EventsView - GET on /api/1/quota/events defaults to daily buckets for the last 30 days"""
+        fake_time.return_value = 5000000
+        fake_db = fake_Database.return_value.__enter__.return_value
+        fake_db.event_aggregates.return_value = []
+        self.app.get('/api/1/quota/events', headers={'X-Auth': self.token})
+
+        fake_db.event_aggregates.assert_called_with(5000000 - events.DEFAULT_RANGE, 5000000, events.DEFAULT_BUCKET)
+
+    @patch.object(events, 'Database')
+    def test_not_an_int(self, fake_Database):
+        """EventsView - GET on /api/1/quota/events returns 400 if a timestamp isn't an integer"""
+        resp = self.app.get('/api/1/quota/events?start=yesterday', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(fake_Database.called)
+
+    @patch.object(events, 'Database')
+    def test_backwards_range(self, fake_Database):
+        """EventsView - GET on /api/1/quota/events returns 400 if start isn't before end"""
+        resp = self.app.get('/api/1/quota/events?start=200&end=100', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(fake_Database.called)
+
+    @patch.object(events, 'Database')
+    def test_too_many_buckets(self, fake_Database):
+        """EventsView - GET on /api/1/quota/events returns 400 if there would be too many buckets"""
+        end = events.MAX_BUCKETS + 1
+        resp = self.app.get('/api/1/quota/events?start=0&end={}&bucket=1'.format(end), headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(fake_Database.called)
+
+    @patch.object(events, 'Database')
+    def test_admin_only(self, fake_Database):
+        """EventsView - GET on /api/1/quota/events is only allowed for admins"""
+        resp = self.app.get('/api/1/quota/events', headers={'X-Auth': self.non_admin_token})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(fake_Database.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``inventory.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_quota.libs import inventory
+
+
+def _make_obj_content(name, child_count):
+    """Create a fake PropertyCollector ObjectContent for a user folder"""
+    name_prop = MagicMock()
+    name_prop.name = 'name'
+    name_prop.val = name
+    child_prop = MagicMock()
+    child_prop.name = 'childEntity'
+    child_prop.val = list(range(child_count))
+    obj_content = MagicMock()
+    obj_content.propSet = [name_prop, child_prop]
+    return obj_content
+
+
+@patch.object(inventory, '_user_folders_spec')
+class TestGetVmCounts(unittest.TestCase):
+    """A suite of test cases for the ``get_vm_counts`` function"""
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        cls.vcenter = MagicMock()
+        cls.collector = cls.vcenter.content.propertyCollector
+
+    def test_vm_counts(self, fake_user_folders_spec):
+        """``get_vm_counts`` returns a mapping of user folder name to the number of child items"""
+        result = MagicMock()
+        result.objects = [_make_obj_content('bill', 4), _make_obj_content('lisa', 2)]
+        result.token = None
+        self.collector.RetrievePropertiesEx.return_value = result
+
+        vm_counts = inventory.get_vm_counts(self.vcenter)
+        expected = {'bill': 4, 'lisa': 2}
+
+        self.assertEqual(vm_counts, expected)
+
+    def test_single_retrieval(self, fake_user_folders_spec):
+        """``get_vm_counts`` makes one PropertyCollector call when the result is not paged"""
+        result = MagicMock()
+        result.objects = [_make_obj_content('bill', 4)]
+        result.token = None
+        self.collector.RetrievePropertiesEx.return_value = result
+
+        inventory.get_vm_counts(self.vcenter)
+
+        self.assertEqual(self.collector.RetrievePropertiesEx.call_count, 1)
+        self.assertFalse(self.collector.ContinueRetrievePropertiesEx.called)
+
+    def test_paged_results(self, fake_user_folders_spec):
+        """``get_vm_counts`` follows the continuation token of a paged result"""
+        page1 = MagicMock()
+        page1.objects = [_make_obj_content('bill', 4)]
+        page1.token = 'some-token'
+        page2 = MagicMock()
+        page2.objects = [_make_obj_content('lisa', 3)]
+        page2.token = None
+        self.collector.RetrievePropertiesEx.return_value = page1
+        self.collector.ContinueRetrievePropertiesEx.return_value = page2
+
+        vm_counts = inventory.get_vm_counts(self.vcenter)
+        expected = {'bill': 4, 'lisa': 3}
+
+        self.assertEqual(vm_counts, expected)
+
+    def test_no_results(self, fake_user_folders_spec):
+        """``get_vm_counts`` returns an empty dictionary when there are no user folders"""
+        self.collector.RetrievePropertiesEx.return_value = None
+
+        vm_counts = inventory.get_vm_counts(self.vcenter)
+
+        self.assertEqual(vm_counts, {})
+
+
+def _make_vm_content(**props):
+    """Create a fake PropertyCollector ObjectContent for a VM"""
+    prop_set = []
+    for name, val in props.items():
+        prop = MagicMock()
+        prop.name = name
+        prop.val = val
+        prop_set.append(prop)
+    obj_content = MagicMock()
+    obj_content.propSet = prop_set
+    return obj_content
+
+
+@patch.object(inventory, '_vm_details_spec')
+class TestGetVmDetails(unittest.TestCase):
+    """A suite of test cases for the ``get_vm_details`` function"""
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        cls.vcenter = MagicMock()
+        cls.collector = cls.vcenter.content.propertyCollector
+
+    def _retrieve_returns(self, *obj_contents):
+        result = MagicMock()
+        result.objects = list(obj_contents)
+        result.token = None
+        self.collector.RetrievePropertiesEx.return_value = result
+
+    def test_details(self, fake_vm_details_spec):
+        """``get_vm_details`` returns the name, component, power state, creation time and size of a VM"""
+        self._retrieve_returns(_make_vm_content(**{'name': 'myVM',
+                                                   'config.annotation': '{"component": "OneFS", "created": 1234}',
+                                                   'runtime.powerState': 'poweredOn',
+                                                   'summary.storage.committed': 9001}))
+
+        details = inventory.get_vm_details(self.vcenter, MagicMock())
+        expected = [inventory.VMDetails(name='myVM',
+                                        component='OneFS',
+                                        power_state='poweredOn',
+                                        created=1234,
+                                        size=9001)]
+
+        self.assertEqual(details, expected)
+
+    def test_bad_notes(self, fake_vm_details_spec):
+        """``get_vm_details`` sets the component to 'Unknown' when the VM notes are not valid JSON"""
+        self._retrieve_returns(_make_vm_content(**{'name': 'myVM', 'config.annotation': 'doh'}))
+
+        details = inventory.get_vm_details(self.vcenter, MagicMock())
+
+        self.assertEqual(details[0].component, 'Unknown')
+
+    def test_deploying(self, fake_vm_details_spec):
+        """``get_vm_details`` sets the component to 'Unknown' when the VM has no config"""
+        self._retrieve_returns(_make_vm_content(**{'name': 'myVM'}))
+
+        details = inventory.get_vm_details(self.vcenter, MagicMock())
+
+        self.assertEqual(details[0].component, 'Unknown')
+
+    def test_single_retrieval(self, fake_vm_details_spec):
+        """``get_vm_details`` makes one PropertyCollector call for all of a user's VMs"""
+        self._retrieve_returns(_make_vm_content(name='vm1'), _make_vm_content(name='vm2'))
+
+        details = inventory.get_vm_details(self.vcenter, MagicMock())
+
+        self.assertEqual(len(details), 2)
+        self.assertEqual(self.collector.RetrievePropertiesEx.call_count, 1)
+
+
+def _make_update(moid, kind='enter', name=None, child_count=None):
+    """Create a fake PropertyCollector ObjectUpdate for a user folder"""
+    changes = []
+    if name is not None:
+        name_change = MagicMock()
+        name_change.name = 'name'
+        name_change.op = 'assign'
+        name_change.val = name
+        changes.append(name_change)
+    if child_count is not None:
+        child_change = MagicMock()
+        child_change.name = 'childEntity'
+        child_change.op = 'assign'
+        child_change.val = list(range(child_count))
+        changes.append(child_change)
+    obj_update = MagicMock()
+    obj_update.obj._moId = moid
+    obj_update.kind = kind
+    obj_update.changeSet = changes
+    return obj_update
+
+
+def _make_update_set(version, *obj_updates, truncated=False):
+    """Create a fake PropertyCollector UpdateSet"""
+    filter_update = MagicMock()
+    filter_update.objectSet = list(obj_updates)
+    update_set = MagicMock()
+    update_set.version = version
+    update_set.truncated = truncated
+    update_set.filterSet = [filter_update]
+    return update_set
+
+
+@patch.object(inventory, 'log')
+@patch.object(inventory, '_user_folders_spec')
+class TestInventoryTracker(unittest.TestCase):
+    """A suite of test cases for the ``InventoryTracker`` object"""
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        cls.vcenter = MagicMock()
+        cls.collector = cls.vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        cls.initial = _make_update_set('1',
+                                       _make_update('group-1', name='bill', child_count=4),
+                                       _make_update('group-2', name='lisa', child_count=2))
+
+    def test_initial_sync(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` loads every user folder on the first update"""
+        self.collector.WaitForUpdatesEx.return_value = self.initial
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+
+        expected = {'bill': 4, 'lisa': 2}
+
+        self.assertEqual(tracker.vm_counts(), expected)
+
+    def test_applies_deltas(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` only updates the user folders that changed"""
+        delta = _make_update_set('2', _make_update('group-2', kind='modify', child_count=9))
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, delta]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+        tracker.update()
+
+        expected = {'bill': 4, 'lisa': 9}
+
+        self.assertEqual(tracker.vm_counts(), expected)
+
+    def test_uses_version(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` asks vCenter for changes since the last version"""
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, None]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+        tracker.update(max_wait=5)
+
+        _, the_kwargs = self.collector.WaitForUpdatesEx.call_args
+        version = the_kwargs['version']
+        expected = '1'
+
+        self.assertEqual(version, expected)
+
+    def test_float_wait(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker.update`` rounds a fractional wait up to whole seconds for vCenter"""
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, None]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+        tracker.update(max_wait=4.2)
+
+        _, the_kwargs = self.collector.WaitForUpdatesEx.call_args
+        max_wait = the_kwargs['options'].maxWaitSeconds
+
+        self.assertEqual(max_wait, 5)
+
+    def test_no_changes(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker.update`` returns False when nothing changed"""
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, None]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+
+        changed = tracker.update(max_wait=5)
+
+        self.assertFalse(changed)
+
+    def test_folder_removed(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` forgets about user folders that are deleted"""
+        delta = _make_update_set('2', _make_update('group-1', kind='leave'))
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, delta]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+        tracker.update()
+
+        expected = {'lisa': 2}
+
+        self.assertEqual(tracker.vm_counts(), expected)
+
+    def test_truncated(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` fetches the rest of a truncated update"""
+        page1 = _make_update_set('1_1', _make_update('group-1', name='bill', child_count=4), truncated=True)
+        page2 = _make_update_set('1', _make_update('group-2', name='lisa', child_count=2))
+        self.collector.WaitForUpdatesEx.side_effect = [page1, page2]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+
+        expected = {'bill': 4, 'lisa': 2}
+
+        self.assertEqual(tracker.vm_counts(), expected)
+
+    def test_resync(self, fake_user_folders_spec, fake_log):
+        """``InventoryTracker`` performs a full resync if the update version is lost"""
+        lost = inventory.vmodl.query.InvalidCollectorVersion()
+        fresh = _make_update_set('1', _make_update('group-3', name='zed', child_count=3))
+        self.collector.WaitForUpdatesEx.side_effect = [self.initial, lost, fresh]
+        tracker = inventory.InventoryTracker(self.vcenter)
+        tracker.update()
+        tracker.update()
+
+        expected = {'zed': 3}
+
+        self.assertEqual(tracker.vm_counts(), expected)
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``ldap_pool.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ldap3.core.exceptions import LDAPSessionTerminatedByServerError
+
+from vlab_quota.libs import ldap_pool
+
+
+def _make_conn():
+    """Create a fake, healthy LDAP connection"""
+    conn = MagicMock()
+    conn.closed = False
+    conn.bound = True
+    conn.result = {'result': 0}
+    return conn
+
+
+@patch.object(ldap_pool, 'log')
+class TestLdapPool(unittest.TestCase):
+    """A suite of test cases for the ``LdapPool`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.factory = MagicMock()
+        self.factory.side_effect = lambda: _make_conn()
+
+    def test_reuses_connection(self, fake_log):
+        """``LdapPool`` reuses a connection once it's returned to the pool"""
+        pool = ldap_pool.LdapPool(self.factory, size=2)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            pass
+
+        self.assertTrue(conn1 is conn2)
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_concurrent(self, fake_log):
+        """``LdapPool`` hands out a different connection to concurrent users"""
+        pool = ldap_pool.LdapPool(self.factory, size=2)
+        with pool.connection() as conn1:
+            with pool.connection() as conn2:
+                pass
+
+        self.assertFalse(conn1 is conn2)
+
+    def test_checkout_timeout(self, fake_log):
+        """``LdapPool`` raises LdapPoolTimeout when no connection frees up in time"""
+        pool = ldap_pool.LdapPool(self.factory, size=1, timeout=0)
+        with pool.connection():
+            with self.assertRaises(ldap_pool.LdapPoolTimeout):
+                with pool.connection():
+                    pass
+
+    def test_replaces_closed(self, fake_log):
+        """``LdapPool`` replaces a connection that was closed"""
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+        with pool.connection() as conn1:
+            pass
+        conn1.closed = True
+        with pool.connection() as conn2:
+            pass
+
+        self.assertFalse(conn1 is conn2)
+        self.assertTrue(conn1.unbind.called)
+
+    def test_replaces_idle(self, fake_log):
+        """``LdapPool`` replaces a connection that sat idle too long"""
+        pool = ldap_pool.LdapPool(self.factory, size=1, max_idle=-1)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            pass
+
+        self.assertFalse(conn1 is conn2)
+
+    def test_probes_idle(self, fake_log):
+        """``LdapPool`` reuses an idle connection that still answers the LDAP server"""
+        pool = ldap_pool.LdapPool(self.factory, size=1, probe_idle=-1)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            pass
+
+        self.assertTrue(conn1 is conn2)
+        self.assertTrue(conn1.extend.standard.who_am_i.called)
+
+    def test_replaces_stale(self, fake_log):
+        """``LdapPool`` replaces an idle connection that the LDAP server dropped"""
+        pool = ldap_pool.LdapPool(self.factory, size=1, probe_idle=-1)
+        with pool.connection() as conn1:
+            pass
+        conn1.extend.standard.who_am_i.side_effect = LDAPSessionTerminatedByServerError('testing')
+        with pool.connection() as conn2:
+            pass
+
+        self.assertFalse(conn1 is conn2)
+        self.assertTrue(conn1.unbind.called)
+
+    def test_discards_broken(self, fake_log):
+        """``LdapPool`` does not reuse a connection that hit a network error"""
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+        try:
+            with pool.connection() as conn1:
+                raise LDAPSessionTerminatedByServerError('testing')
+        except LDAPSessionTerminatedByServerError:
+            pass
+        with pool.connection() as conn2:
+            pass
+
+        self.assertFalse(conn1 is conn2)
+
+    def test_search(self, fake_log):
+        """``LdapPool.search`` returns the entries found"""
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+
+        conn = _make_conn()
+        conn.entries = ['some-entry']
+        self.factory.side_effect = [conn]
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+
+        entries = pool.search(search_base='DC=vlab', search_filter='(sAMAccountName=bob)')
+
+        self.assertEqual(entries, ['some-entry'])
+
+    def test_search_retries(self, fake_log):
+        """``LdapPool.search`` retries on a new connection if the server dropped the old one"""
+        broken = _make_conn()
+        broken.search.side_effect = LDAPSessionTerminatedByServerError('testing')
+        healthy = _make_conn()
+        healthy.entries = ['some-entry']
+        self.factory.side_effect = [broken, healthy]
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+
+        entries = pool.search(search_base='DC=vlab', search_filter='(sAMAccountName=bob)')
+
+        self.assertEqual(entries, ['some-entry'])
+        self.assertTrue(broken.unbind.called)
+
+    def test_search_gives_up(self, fake_log):
+        """``LdapPool.search`` only retries once"""
+        broken = _make_conn()
+        broken.search.side_effect = LDAPSessionTerminatedByServerError('testing')
+        self.factory.side_effect = lambda: broken
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+
+        with self.assertRaises(LDAPSessionTerminatedByServerError):
+            pool.search(search_base='DC=vlab', search_filter='(sAMAccountName=bob)')
+
+    def test_close(self, fake_log):
+        """``LdapPool.close`` unbinds idle connections"""
+        pool = ldap_pool.LdapPool(self.factory, size=1)
+        with pool.connection() as conn:
+            pass
+        pool.close()
+
+        self.assertTrue(conn.unbind.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``metrics.py`` module"""
+import unittest
+import urllib.request
+from unittest.mock import patch
+
+from vlab_quota.libs import metrics
+
+
+@patch.object(metrics, '_REGISTRY', [])
+class TestMetrics(unittest.TestCase):
+    """A suite of test cases for the metric objects"""
+    def test_counter(self):
+        """``Counter`` renders the total of every increment"""
+        counter = metrics.Counter('test_total', 'Just testing')
+        counter.inc()
+        counter.inc(2)
+
+        expected = '# HELP test_total Just testing\n# TYPE test_total counter\ntest_total 3.0\n'
+
+        self.assertEqual(counter.render(), expected)
+
+    def test_counter_negative(self):
+        """``Counter`` cannot go down"""
+        counter = metrics.Counter('test_total', 'Just testing')
+
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+
+    def test_gauge(self):
+        """``Gauge`` renders the last value set"""
+        gauge = metrics.Gauge('test_gauge', 'Just testing')
+        gauge.set(5)
+        gauge.set(2)
+
+        self.assertTrue('test_gauge 2.0\n' in gauge.render())
+
+    def test_labels(self):
+        """Metrics with labels render a sample per label value"""
+        counter = metrics.Counter('test_total', 'Just testing', labelnames=('stage',))
+        counter.inc(stage='db')
+        counter.inc(stage='ldap')
+
+        output = counter.render()
+
+        self.assertTrue('test_total{stage="db"} 1.0\n' in output)
+        self.assertTrue('test_total{stage="ldap"} 1.0\n' in output)
+
+    def test_labels_required(self):
+        """Metrics with labels raise ValueError if the labels are not supplied"""
+        counter = metrics.Counter('test_total', 'Just testing', labelnames=('stage',))
+
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_histogram(self):
+        """``Histogram`` renders cumulative buckets, the sum and the count"""
+        histogram = metrics.Histogram('test_seconds', 'Just testing', buckets=(1, 5))
+        histogram.observe(0.5)
+        histogram.observe(3)
+        histogram.observe(10)
+
+        output = histogram.render()
+
+        self.assertTrue('test_seconds_bucket{le="1.0"} 1\n' in output)
+        self.assertTrue('test_seconds_bucket{le="5.0"} 2\n' in output)
+        self.assertTrue('test_seconds_bucket{le="+Inf"} 3\n' in output)
+        self.assertTrue('test_seconds_sum 13.5\n' in output)
+        self.assertTrue('test_seconds_count 3\n' in output)
+
+    def test_histogram_time(self):
+        """``Histogram.time`` observes the block, even when it raises"""
+        histogram = metrics.Histogram('test_seconds', 'Just testing', labelnames=('stage',))
+        try:
+            with histogram.time(stage='db'):
+                raise RuntimeError('testing')
+        except RuntimeError:
+            pass
+
+        self.assertTrue('test_seconds_count{stage="db"} 1\n' in histogram.render())
+
+    def test_escapes_labels(self):
+        """Label values are escaped"""
+        gauge = metrics.Gauge('test_gauge', 'Just testing', labelnames=('name',))
+        gauge.set(1, name='say "hi"')
+
+        self.assertTrue(r'test_gauge{name="say \"hi\""} 1.0' in gauge.render())
+
+    def test_render(self):
+        """``render`` includes every metric"""
+        metrics.Counter('test_total', 'Just testing')
+        metrics.Gauge('test_gauge', 'Just testing')
+
+        output = metrics.render()
+
+        self.assertTrue('# TYPE test_total counter' in output)
+        self.assertTrue('# TYPE test_gauge gauge' in output)
+
+
+class TestServe(unittest.TestCase):
+    """A suite of test cases for the ``serve`` function"""
+    def test_serve(self):
+        """``serve`` answers HTTP requests with the metrics"""
+        server = metrics.serve(port=0, address='127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+
+        with urllib.request.urlopen(url) as resp:
+            body = resp.read().decode()
+            content_type = resp.headers['Content-Type']
+
+        self.assertTrue('vlab_quota_cycle_seconds_count' in body)
+        self.assertEqual(content_type, metrics.CONTENT_TYPE)
+
+
+if __name__ == '__main__':
+    unittest.main()
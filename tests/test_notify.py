@@ -37,80 +37,55 @@ class TestGetSslContext(unittest.TestCase):
 
 class TestGenerateWarning(unittest.TestCase):
     """A suite of test cases for the ``_generate_warning`` function"""
-    TEMPLATE = """
-        <html>
-          <body style="font-family:Helvetica;">
-           <div style="background:blue">
-             <h1 style="color:white;margin-left:5px">vLab</h1>
-           </div>
-           <h2 style="color:red;font-weight:bold">Quota Violation</h2>
-           <p>You currently have {{ vm_quota }} VMs.<br>
-              You are allowed to have {{ vm_count }} VMs.<br><br>
-
-              If you do not <b>delete {{ vm_delta }} VMs by {{ exp_date }}</b>, vLab will randomly choose which VMs <br>
-              to delete on that date.<br><br>
-
-              You have been warned.
-           </p>
-          </body>
-        </html>
-    """
-
-    @patch.object(notify, 'open')
-    def test_generate_warning(self, fake_open):
+
+    def test_generate_warning(self):
         """``_generate_warning`` returns a string"""
-        fake_open.return_value.__enter__.return_value.read.return_value = self.TEMPLATE
         message = notify._generate_warning(9001, 1234)
 
         self.assertTrue(isinstance(message, str))
 
-    @patch.object(notify, '_get_template_abs')
-    @patch.object(notify, 'open')
-    def test_generate_warning_abs(self, fake_open, fake_get_template_abs):
-        """``_generate_warning`` opens the template file via an absolute file path"""
-        fake_open.return_value.__enter__.return_value.read.return_value = self.TEMPLATE
+    def test_generate_warning_renders(self):
+        """``_generate_warning`` fills in the template"""
         message = notify._generate_warning(9001, 1234)
 
-        self.assertTrue(fake_get_template_abs.called)
+        self.assertTrue('9001' in message)
+
+    def test_compiled_once(self):
+        """``_generate_warning`` only loads and compiles the template once"""
+        notify._TEMPLATES.cache.clear()
+        loader = notify._TEMPLATES.loader
+        with patch.object(loader, 'get_source', wraps=loader.get_source) as fake_get_source:
+            notify._generate_warning(9001, 1234)
+            notify._generate_warning(9002, 1234)
+
+        self.assertEqual(fake_get_source.call_count, 1)
 
 
 class TestGenerateFollowUp(unittest.TestCase):
     """A suite of test cases for the ``_generate_follow_up`` function"""
-    TEMPLATE = """
-        <html>
-          <body style="font-family:Helvetica;">
-           <div style="background:blue">
-             <h1 style="color:white;margin-left:5px">vLab</h1>
-           </div>
-           <h2 style="color:red;font-weight:bold">Quota Violation</h2>
-           <p>On {{ date }} vLab deleted the following VMs:</p>
-           <ul>
-            {% for vm in vms %}
-            <li>{{ vm }}</li>
-            {% endfor %}
-           </ul>
-           <p>These VMs were randomly choosen, and were deleted due to the soft-quota
-            grace period expiring.
-           </p>
-          </body>
-        </html>
-    """
-    @patch.object(notify, 'open')
-    def test_generate_follow_up_html(self, fake_open):
+
+    def test_generate_follow_up_html(self):
         """``_generate_follow_up`` returns a string"""
-        fake_open.return_value.__enter__.return_value.read.return_value = self.TEMPLATE
         message = notify._generate_follow_up(1234, ['vmFoo', 'vmBar'])
 
         self.assertTrue(isinstance(message, str))
 
-    @patch.object(notify, '_get_template_abs')
-    @patch.object(notify, 'open')
-    def test_generate_follow_up_html_abs(self, fake_open, fake_get_template_abs):
-        """``_generate_follow_up`` opens the template file via an absolute file path"""
-        fake_open.return_value.__enter__.return_value.read.return_value = self.TEMPLATE
+    def test_generate_follow_up_renders(self):
+        """``_generate_follow_up`` lists the deleted VMs"""
         message = notify._generate_follow_up(1234, ['vmFoo', 'vmBar'])
 
-        self.assertTrue(fake_get_template_abs.called)
+        self.assertTrue('vmFoo' in message)
+        self.assertTrue('vmBar' in message)
+
+    def test_compiled_once(self):
+        """``_generate_follow_up`` only loads and compiles the template once"""
+        notify._TEMPLATES.cache.clear()
+        loader = notify._TEMPLATES.loader
+        with patch.object(loader, 'get_source', wraps=loader.get_source) as fake_get_source:
+            notify._generate_follow_up(1234, ['vmFoo'])
+            notify._generate_follow_up(1234, ['vmBar'])
+
+        self.assertEqual(fake_get_source.call_count, 1)
 
 
 class TestMakeEmail(unittest.TestCase):
@@ -250,6 +225,102 @@ class TestSendEmail(unittest.TestCase):
             notify._send_email('salldy@vlab.local', 'asdfwed')
 
 
+@patch.object(notify, 'log')
+@patch.object(notify, '_connect')
+class TestMailer(unittest.TestCase):
+    """A suite of test cases for the ``Mailer`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.session = MagicMock()
+        self.session.sendmail.return_value = {}
+
+    def test_one_session(self, fake_connect, fake_log):
+        """``Mailer.flush`` sends every queued email over a single session"""
+        fake_connect.return_value = self.session
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+        mailer.enqueue('sam@vlab.local', 'mail2')
+
+        failed = mailer.flush()
+
+        self.assertEqual(failed, {})
+        self.assertEqual(fake_connect.call_count, 1)
+        self.assertEqual(self.session.sendmail.call_count, 2)
+
+    def test_flush_empties_queue(self, fake_connect, fake_log):
+        """``Mailer.flush`` only sends an email once"""
+        fake_connect.return_value = self.session
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+        mailer.flush()
+        mailer.flush()
+
+        self.assertEqual(self.session.sendmail.call_count, 1)
+
+    def test_reconnects(self, fake_connect, fake_log):
+        """``Mailer`` reconnects and retries when the server drops the session"""
+        broken = MagicMock()
+        broken.sendmail.side_effect = notify.smtplib.SMTPServerDisconnected('testing')
+        fake_connect.side_effect = [broken, self.session]
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+
+        failed = mailer.flush()
+
+        self.assertEqual(failed, {})
+        self.assertTrue(self.session.sendmail.called)
+
+    def test_connection_refused(self, fake_connect, fake_log):
+        """``Mailer.flush`` reports an email as failed when the server refuses the connection"""
+        fake_connect.side_effect = ConnectionRefusedError('testing')
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+
+        failed = mailer.flush()
+
+        self.assertTrue(isinstance(failed['bob@vlab.local'], ConnectionRefusedError))
+
+    def test_reports_failures(self, fake_connect, fake_log):
+        """``Mailer.flush`` returns the emails that could not be sent, and keeps sending the rest"""
+        self.session.sendmail.side_effect = [notify.smtplib.SMTPRecipientsRefused({}), {}]
+        fake_connect.return_value = self.session
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+        mailer.enqueue('sam@vlab.local', 'mail2')
+
+        failed = mailer.flush()
+
+        self.assertEqual(list(failed.keys()), ['bob@vlab.local'])
+        self.assertEqual(fake_connect.call_count, 1)
+
+    def test_partial_failure(self, fake_connect, fake_log):
+        """``Mailer.flush`` reports an email where some recipients were refused"""
+        self.session.sendmail.return_value = {'bob@vlab.local': (550, 'no such user')}
+        fake_connect.return_value = self.session
+        mailer = notify.Mailer()
+        mailer.enqueue('bob@vlab.local', 'mail1')
+
+        failed = mailer.flush()
+
+        self.assertTrue(isinstance(failed['bob@vlab.local'], notify.NotifyError))
+
+    def test_context_manager(self, fake_connect, fake_log):
+        """``Mailer`` flushes and closes the session when used as a context manager"""
+        fake_connect.return_value = self.session
+        with notify.Mailer() as mailer:
+            mailer.enqueue('bob@vlab.local', 'mail1')
+
+        self.assertTrue(self.session.sendmail.called)
+        self.assertTrue(self.session.quit.called)
+
+    def test_no_emails(self, fake_connect, fake_log):
+        """``Mailer`` does not connect to the server when there's nothing to send"""
+        with notify.Mailer():
+            pass
+
+        self.assertFalse(fake_connect.called)
+
+
 class TestSendWarning(unittest.TestCase):
     """A suite of test cases for the ``send_warning`` function"""
     @patch.object(notify, '_generate_warning')
@@ -333,5 +404,26 @@ class TestShouldSendWarning(unittest.TestCase):
         self.assertTrue(answer)
 
 
+class TestSendWithMailer(unittest.TestCase):
+    """A suite of test cases for sending emails via a ``Mailer``"""
+    @patch.object(notify, '_send_email')
+    def test_send_warning(self, fake_send_email):
+        """``send_warning`` queues the email on the supplied Mailer"""
+        fake_mailer = MagicMock()
+        notify.send_warning('bob@vlab.local', 45, 123456789, mailer=fake_mailer)
+
+        self.assertTrue(fake_mailer.enqueue.called)
+        self.assertFalse(fake_send_email.called)
+
+    @patch.object(notify, '_send_email')
+    def test_send_follow_up(self, fake_send_email):
+        """``send_follow_up`` queues the email on the supplied Mailer"""
+        fake_mailer = MagicMock()
+        notify.send_follow_up('bob@vlab.local', 45, ['vm1'], mailer=fake_mailer)
+
+        self.assertTrue(fake_mailer.enqueue.called)
+        self.assertFalse(fake_send_email.called)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``outbox.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_quota.libs import outbox
+
+
+class TestOutbox(unittest.TestCase):
+    """A suite of test cases for the ``Outbox`` object"""
+    def test_flush(self):
+        """``Outbox.flush`` writes every queued email with a single call"""
+        fake_db = MagicMock()
+        the_outbox = outbox.Outbox(fake_db)
+        the_outbox.enqueue('bob@vlab.local', 'mail1')
+        the_outbox.enqueue('sam@vlab.local', 'mail2')
+
+        failed = the_outbox.flush()
+
+        fake_db.enqueue_emails.assert_called_once_with([('bob@vlab.local', 'mail1'), ('sam@vlab.local', 'mail2')])
+        self.assertEqual(failed, {})
+
+    def test_flush_users(self):
+        """``Outbox.flush`` records the supplied users in the same transaction as the emails"""
+        fake_db = MagicMock()
+        the_outbox = outbox.Outbox(fake_db)
+        the_outbox.enqueue('bob@vlab.local', 'mail1')
+
+        the_outbox.flush(users=[('bob', 100, 100)])
+
+        fake_db.enqueue_warnings.assert_called_once_with([('bob@vlab.local', 'mail1')], [('bob', 100, 100)])
+        self.assertFalse(fake_db.enqueue_emails.called)
+
+    def test_context_manager(self):
+        """``Outbox`` writes the queued emails when used as a context manager"""
+        fake_db = MagicMock()
+        with outbox.Outbox(fake_db) as the_outbox:
+            the_outbox.enqueue('bob@vlab.local', 'mail1')
+
+        self.assertTrue(fake_db.enqueue_emails.called)
+
+    @patch.object(outbox.notify, '_send_email')
+    def test_send_warning(self, fake_send_email):
+        """``Outbox`` can be used as the mailer for ``notify.send_warning``"""
+        fake_db = MagicMock()
+        with outbox.Outbox(fake_db) as the_outbox:
+            outbox.notify.send_warning('bob@vlab.local', 45, 123456789, mailer=the_outbox)
+
+        self.assertFalse(fake_send_email.called)
+        self.assertTrue(fake_db.enqueue_emails.called)
+
+
+@patch.object(outbox, 'log')
+@patch.object(outbox.notify, 'Mailer')
+class TestOutboxSender(unittest.TestCase):
+    """A suite of test cases for the ``OutboxSender`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.db = MagicMock()
+
+    def test_sends(self, fake_Mailer, fake_log):
+        """``OutboxSender.send_due`` sends the emails, then removes them from the outbox"""
+        self.db.claim_emails.return_value = [(1, 'bob@vlab.local', 'mail1', 1), (2, 'sam@vlab.local', 'mail2', 1)]
+        sender = outbox.OutboxSender(self.db, senders=2)
+
+        claimed = sender.send_due()
+        the_args, _ = self.db.delete_emails.call_args
+
+        self.assertEqual(claimed, 2)
+        self.assertEqual(sorted(the_args[0]), [1, 2])
+        self.assertEqual(fake_Mailer.return_value.send.call_count, 2)
+
+    def test_nothing_due(self, fake_Mailer, fake_log):
+        """``OutboxSender.send_due`` does nothing when no emails are due"""
+        self.db.claim_emails.return_value = []
+        sender = outbox.OutboxSender(self.db)
+
+        claimed = sender.send_due()
+
+        self.assertEqual(claimed, 0)
+        self.assertFalse(fake_Mailer.called)
+
+    def test_retries(self, fake_Mailer, fake_log):
+        """``OutboxSender.send_due`` reschedules emails that failed, with a backoff"""
+        fake_Mailer.return_value.send.side_effect = OSError('testing')
+        self.db.claim_emails.return_value = [(1, 'bob@vlab.local', 'mail1', 3)]
+        sender = outbox.OutboxSender(self.db, senders=1, max_attempts=10, max_backoff=3600)
+
+        with patch.object(outbox.time, 'time') as fake_time:
+            fake_time.return_value = 1000
+            sender.send_due()
+        the_args, _ = self.db.retry_emails.call_args
+        expected = [(1, 1008)]
+
+        self.assertEqual(the_args[0], expected)
+        self.db.delete_emails.assert_called_with([])
+
+    def test_max_backoff(self, fake_Mailer, fake_log):
+        """``OutboxSender`` never waits longer than ``max_backoff`` to retry an email"""
+        sender = outbox.OutboxSender(self.db, max_backoff=60)
+
+        self.assertEqual(sender._backoff(20), 60)
+
+    def test_gives_up(self, fake_Mailer, fake_log):
+        """``OutboxSender.send_due`` drops an email once it hits the max attempts"""
+        fake_Mailer.return_value.send.side_effect = OSError('testing')
+        self.db.claim_emails.return_value = [(1, 'bob@vlab.local', 'mail1', 10)]
+        sender = outbox.OutboxSender(self.db, senders=1, max_attempts=10)
+
+        sender.send_due()
+
+        self.db.delete_emails.assert_called_with([1])
+        self.assertTrue(fake_log.error.called)
+
+    def test_closes_sessions(self, fake_Mailer, fake_log):
+        """``OutboxSender`` closes its SMTP sessions after each batch"""
+        self.db.claim_emails.return_value = [(1, 'bob@vlab.local', 'mail1', 1)]
+        sender = outbox.OutboxSender(self.db, senders=1)
+
+        sender.send_due()
+
+        self.assertTrue(fake_Mailer.return_value.close.called)
+
+    def test_run_survives_db_errors(self, fake_Mailer, fake_log):
+        """``OutboxSender`` keeps running when the database has an error"""
+        self.db.claim_emails.side_effect = outbox.DatabaseError('testing', pgcode=None)
+        sender = outbox.OutboxSender(self.db)
+        sender._stop.wait = MagicMock(side_effect=lambda x: sender._stop.set())
+
+        sender._run()
+
+        self.assertTrue(fake_log.error.called)
+
+    def test_run_survives_bugs(self, fake_Mailer, fake_log):
+        """``OutboxSender`` keeps running, and logs the traceback, upon an unexpected error"""
+        self.db.claim_emails.side_effect = [KeyError('testing'), outbox.DatabaseError('testing', pgcode=None)]
+        sender = outbox.OutboxSender(self.db)
+        sender._stop.wait = MagicMock(side_effect=lambda x: sender._stop.set() if self.db.claim_emails.call_count > 1 else None)
+
+        sender._run()
+
+        self.assertTrue(fake_log.exception.called)
+        self.assertEqual(self.db.claim_emails.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
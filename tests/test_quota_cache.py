@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``quota_cache.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import psycopg2
+
+from vlab_quota.libs import quota_cache
+
+
+class TestQuotaCache(unittest.TestCase):
+    """A suite of test cases for the ``QuotaCache`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache = quota_cache.QuotaCache(maxsize=10, ttl=60)
+        self.loader = MagicMock()
+        self.loader.return_value = (0, 0)
+
+    def test_not_listening(self):
+        """``QuotaCache.get`` always uses the loader while not listening for changes"""
+        self.cache.get('bob', self.loader)
+        self.cache.get('bob', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_cached(self):
+        """``QuotaCache.get`` caches the info while listening for changes"""
+        self.cache._set_listening(True)
+        info1 = self.cache.get('bob', self.loader)
+        info2 = self.cache.get('bob', self.loader)
+
+        self.assertEqual(info1, (0, 0))
+        self.assertEqual(info2, (0, 0))
+        self.assertEqual(self.loader.call_count, 1)
+
+    def test_invalidate(self):
+        """``QuotaCache.invalidate`` drops only the user whose record changed"""
+        self.cache._set_listening(True)
+        self.cache.get('bob', self.loader)
+        self.cache.get('sam', self.loader)
+        self.cache.invalidate('bob')
+        self.cache.get('bob', self.loader)
+        self.cache.get('sam', self.loader)
+
+        self.assertEqual(self.loader.call_count, 3)
+
+    def test_invalidate_all(self):
+        """``QuotaCache.invalidate`` drops every user when no username is supplied"""
+        self.cache._set_listening(True)
+        self.cache.get('bob', self.loader)
+        self.cache.invalidate()
+        self.cache.get('bob', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_race(self):
+        """``QuotaCache.get`` doesn't cache info that changed while it was being loaded"""
+        self.cache._set_listening(True)
+        def racing_loader(username):
+            self.cache.invalidate(username)
+            return (1, 1)
+
+        self.cache.get('bob', racing_loader)
+        self.cache.get('bob', self.loader)
+
+        self.assertTrue(self.loader.called)
+
+    def test_disconnect(self):
+        """``QuotaCache`` drops every entry when the listener disconnects"""
+        self.cache._set_listening(True)
+        self.cache.get('bob', self.loader)
+        self.cache._set_listening(False)
+        self.cache._set_listening(True)
+        self.cache.get('bob', self.loader)
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    @patch.object(quota_cache, 'log')
+    @patch.object(quota_cache.select, 'select')
+    @patch.object(quota_cache.psycopg2, 'connect')
+    def test_listen(self, fake_connect, fake_select, fake_log):
+        """``QuotaCache`` invalidates the users named in change notifications"""
+        fake_conn = fake_connect.return_value
+        notification = MagicMock()
+        notification.payload = 'bob'
+        fake_conn.notifies = [notification]
+        fake_select.side_effect = [([fake_conn], [], []), psycopg2.OperationalError('testing')]
+        self.cache._stop.wait = MagicMock(side_effect=lambda x: self.cache._stop.set())
+
+        with patch.object(self.cache, 'invalidate') as fake_invalidate:
+            self.cache._listen()
+
+        fake_invalidate.assert_called_with('bob')
+        self.assertFalse(self.cache._listening)
+        self.assertTrue(fake_conn.close.called)
+
+    @patch.object(quota_cache, 'log')
+    @patch.object(quota_cache.psycopg2, 'connect')
+    def test_listen_retries(self, fake_connect, fake_log):
+        """``QuotaCache`` keeps trying to connect, with a backoff"""
+        fake_connect.side_effect = psycopg2.OperationalError('testing')
+        waits = []
+        def fake_wait(seconds):
+            waits.append(seconds)
+            if len(waits) == 3:
+                self.cache._stop.set()
+        self.cache._stop.wait = fake_wait
+
+        self.cache._listen()
+
+        self.assertEqual(waits, [1, 2, 4])
+
+
+@patch.object(quota_cache, 'QuotaCache')
+class TestGetCache(unittest.TestCase):
+    """A suite of test cases for the ``get_cache`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        quota_cache._CACHE = None
+
+    def tearDown(self):
+        """Runs after every test case"""
+        quota_cache._CACHE = None
+
+    def test_starts(self, fake_QuotaCache):
+        """``get_cache`` starts the listener of a new cache"""
+        cache = quota_cache.get_cache()
+
+        self.assertTrue(cache.start.called)
+
+    def test_reused(self, fake_QuotaCache):
+        """``get_cache`` returns the same cache within a process"""
+        quota_cache.get_cache()
+        quota_cache.get_cache()
+
+        self.assertEqual(fake_QuotaCache.call_count, 1)
+
+    @patch.object(quota_cache.os, 'getpid')
+    def test_after_fork(self, fake_getpid, fake_QuotaCache):
+        """``get_cache`` creates a new cache in a forked process"""
+        fake_getpid.return_value = 1
+        quota_cache.get_cache()
+        fake_getpid.return_value = 2
+        quota_cache.get_cache()
+
+        self.assertEqual(fake_QuotaCache.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,15 @@ class TestQuotaView(unittest.TestCase):
         app = Flask(__name__)
         quota.QuotaView.register(app)
         cls.app = app.test_client()
+        # Don't start a real NOTIFY listener; always use the supplied loader
+        cls.patcher = patch.object(quota.quota_cache, 'get_cache')
+        cls.fake_get_cache = cls.patcher.start()
+        cls.fake_get_cache.return_value.get.side_effect = lambda username, loader: loader(username)
+
+    @classmethod
+    def tearDown(cls):
+        """Run after every test case"""
+        cls.patcher.stop()
 
     @patch.object(quota, 'Database')
     def test_basic(self, fake_Database):
@@ -42,6 +51,26 @@ class TestQuotaView(unittest.TestCase):
 
         self.assertEqual(resp.json, expected)
 
+    @patch.object(quota, 'Database')
+    def test_pooled(self, fake_Database):
+        """QuotaView - GET on /api/1/quota uses a pooled database connection"""
+        fake_Database.return_value.__enter__.return_value.user_info.return_value = (1234, 2345)
+        self.app.get('/api/1/quota', headers={'X-Auth' : self.token})
+
+        _, the_kwargs = fake_Database.call_args
+
+        self.assertTrue(the_kwargs['pooled'])
+
+    @patch.object(quota, 'Database')
+    def test_cached(self, fake_Database):
+        """QuotaView - GET on /api/1/quota uses the cached quota info"""
+        self.fake_get_cache.return_value.get.side_effect = None
+        self.fake_get_cache.return_value.get.return_value = (1234, 2345)
+        resp = self.app.get('/api/1/quota', headers={'X-Auth' : self.token})
+
+        self.assertEqual(resp.json['content']['exceeded_on'], 1234)
+        self.assertFalse(fake_Database.called)
+
 
 if __name__ == '__main__':
     unittest.main()
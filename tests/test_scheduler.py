@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``scheduler.py`` module"""
+import unittest
+from unittest.mock import patch
+
+from vlab_quota.libs import scheduler
+
+
+@patch.object(scheduler, 'log')
+@patch.object(scheduler.time, 'time')
+@patch.object(scheduler.time, 'monotonic')
+class TestScheduler(unittest.TestCase):
+    """A suite of test cases for the ``Scheduler`` object"""
+    def _make(self, **kwargs):
+        """Create a Scheduler without jitter, unless told otherwise"""
+        params = {'min_interval': 2, 'max_interval': 60, 'max_backoff': 300, 'jitter': 0}
+        params.update(kwargs)
+        return scheduler.Scheduler(10, **params)
+
+    def _cycle(self, the_scheduler, fake_monotonic, took):
+        """Run a fake cycle that took ``took`` seconds"""
+        fake_monotonic.return_value = 100
+        the_scheduler.start_cycle()
+        fake_monotonic.return_value = 100 + took
+
+    def test_interval(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` waits out the rest of the interval"""
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=3.5)
+        the_scheduler.succeeded()
+
+        self.assertEqual(the_scheduler.finish_cycle(), 6.5)
+
+    def test_overrun(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` starts the next cycle right away, and counts the overrun"""
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=25)
+        the_scheduler.succeeded()
+
+        self.assertEqual(the_scheduler.finish_cycle(), 0)
+        self.assertEqual(the_scheduler.overruns, 1)
+
+    def test_backoff(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` backs off exponentially while a backend keeps failing"""
+        the_scheduler = self._make()
+        delays = []
+        for _ in range(3):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.failed('vcenter')
+            delays.append(the_scheduler.finish_cycle())
+
+        self.assertEqual(delays, [20, 40, 80])
+        self.assertFalse(the_scheduler.healthy('vcenter'))
+        self.assertTrue(the_scheduler.healthy('db'))
+
+    def test_max_backoff(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` never backs off longer than ``max_backoff``"""
+        the_scheduler = self._make()
+        for _ in range(10):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.failed('vcenter')
+            delay = the_scheduler.finish_cycle()
+
+        self.assertEqual(delay, 300)
+
+    def test_recovers(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` goes back to the normal interval once the backend recovers"""
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=0)
+        the_scheduler.failed('db')
+        the_scheduler.finish_cycle()
+        self._cycle(the_scheduler, fake_monotonic, took=0)
+        the_scheduler.succeeded()
+
+        self.assertEqual(the_scheduler.finish_cycle(), 10)
+        self.assertTrue(the_scheduler.healthy())
+
+    def test_idle(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` stretches the interval while idle, up to ``max_interval``"""
+        the_scheduler = self._make()
+        delays = []
+        for _ in range(4):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.succeeded(idle=True)
+            delays.append(the_scheduler.finish_cycle())
+
+        self.assertEqual(delays, [20, 40, 60, 60])
+
+    def test_idle_for_days(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` stays at ``max_interval`` no matter how long it's been idle"""
+        the_scheduler = scheduler.Scheduler(10.0, min_interval=2, max_interval=60, max_backoff=300, jitter=0)
+        for _ in range(2000):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.succeeded(idle=True)
+
+        self.assertEqual(the_scheduler.finish_cycle(), 60)
+
+    def test_failing_for_days(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` stays at ``max_backoff`` no matter how long a backend has been failing"""
+        the_scheduler = scheduler.Scheduler(10.0, min_interval=2, max_interval=60, max_backoff=300, jitter=0)
+        for _ in range(2000):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.failed('vcenter')
+
+        self.assertEqual(the_scheduler.finish_cycle(), 300)
+
+    def test_near_expiry(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` runs the next cycle as soon as a grace period expires"""
+        fake_time.return_value = 1000
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=1)
+        the_scheduler.succeeded(next_expiry=1003)
+
+        # +1 because the grace period is only over one second after it expires
+        self.assertEqual(the_scheduler.finish_cycle(), 4)
+
+    def test_near_expiry_min_interval(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` never runs cycles closer together than ``min_interval``"""
+        fake_time.return_value = 1000
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=0)
+        the_scheduler.succeeded(next_expiry=1000)
+
+        self.assertEqual(the_scheduler.finish_cycle(), 2)
+
+    def test_min_delay(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler.min_delay`` is the rest of ``min_interval``, after the wait was cut short"""
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=0.5)
+        the_scheduler.succeeded()
+        the_scheduler.finish_cycle()
+
+        self.assertEqual(the_scheduler.min_delay(), 1.5)
+        fake_monotonic.return_value = 200
+        self.assertEqual(the_scheduler.min_delay(), 0)
+
+    def test_delay(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler.delay`` picks up a failure recorded after the cycle finished"""
+        the_scheduler = self._make()
+        self._cycle(the_scheduler, fake_monotonic, took=4)
+        the_scheduler.succeeded()
+        the_scheduler.finish_cycle()
+        the_scheduler.failed('vcenter')
+
+        self.assertEqual(the_scheduler.delay(), 16)
+
+    def test_jitter(self, fake_monotonic, fake_time, fake_log):
+        """``Scheduler`` only ever lengthens the delay with jitter"""
+        the_scheduler = self._make(jitter=0.5)
+        delays = []
+        for _ in range(50):
+            self._cycle(the_scheduler, fake_monotonic, took=0)
+            the_scheduler.succeeded()
+            delays.append(the_scheduler.finish_cycle())
+
+        self.assertTrue(min(delays) >= 10)
+        self.assertTrue(max(delays) <= 15)
+        self.assertTrue(len(set(delays)) > 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
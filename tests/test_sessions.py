@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``sessions.py`` module"""
+import unittest
+from unittest.mock import patch
+
+from vlab_quota.libs import sessions
+
+
+class TestSessions(unittest.TestCase):
+    """A suite of test cases for the ``sessions`` module"""
+    def tearDown(self):
+        """Runs after every test case"""
+        sessions.close()
+
+    def test_get_session(self):
+        """``get_session`` returns the same session every time"""
+        session1 = sessions.get_session()
+        session2 = sessions.get_session()
+
+        self.assertTrue(session1 is session2)
+
+    def test_keep_alive_pool(self):
+        """``get_session`` pools connections per host"""
+        session = sessions.get_session()
+        adapter = session.get_adapter('https://some-host')
+
+        self.assertEqual(adapter._pool_connections, sessions.const.QUOTA_HTTP_POOL_HOSTS)
+        self.assertEqual(adapter._pool_maxsize, sessions.const.QUOTA_HTTP_POOL_SIZE)
+
+    def test_no_verify(self):
+        """``get_session`` does not verify TLS certs, because vLab uses self-signed certs"""
+        session = sessions.get_session()
+
+        self.assertFalse(session.verify)
+
+    @patch.object(sessions, 'get_session')
+    def test_request_timeout(self, fake_get_session):
+        """``request`` always sets a timeout"""
+        sessions.request('GET', 'https://some-host')
+
+        _, the_kwargs = fake_get_session.return_value.request.call_args
+        timeout = the_kwargs['timeout']
+        expected = (sessions.const.QUOTA_HTTP_CONNECT_TIMEOUT, sessions.const.QUOTA_HTTP_READ_TIMEOUT)
+
+        self.assertEqual(timeout, expected)
+
+    @patch.object(sessions, 'get_session')
+    def test_request_custom_timeout(self, fake_get_session):
+        """``request`` respects a timeout supplied by the caller"""
+        sessions.request('GET', 'https://some-host', timeout=3)
+
+        _, the_kwargs = fake_get_session.return_value.request.call_args
+        timeout = the_kwargs['timeout']
+
+        self.assertEqual(timeout, 3)
+
+    def test_close(self):
+        """``close`` drops the session, so a new one is created on the next use"""
+        session1 = sessions.get_session()
+        sessions.close()
+        session2 = sessions.get_session()
+
+        self.assertFalse(session1 is session2)
+
+
+if __name__ == '__main__':
+    unittest.main()
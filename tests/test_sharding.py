@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``sharding.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_quota.libs import sharding
+from vlab_quota.libs.database import DatabaseError
+
+
+class TestShardOf(unittest.TestCase):
+    """A suite of test cases for the ``shard_of`` function"""
+    def test_case_insensitive(self):
+        """``shard_of`` puts a user in the same shard, regardless of case"""
+        self.assertEqual(sharding.shard_of('Bob', 16), sharding.shard_of('bob', 16))
+
+    def test_in_range(self):
+        """``shard_of`` returns a shard between zero and the number of shards"""
+        shards = {sharding.shard_of('user{}'.format(x), 16) for x in range(1000)}
+
+        self.assertEqual(shards, set(range(16)))
+
+
+class TestHashRing(unittest.TestCase):
+    """A suite of test cases for the ``HashRing`` object"""
+    def test_no_members(self):
+        """``HashRing.owner`` returns None when there are no members"""
+        ring = sharding.HashRing([])
+
+        self.assertTrue(ring.owner(1) is None)
+
+    def test_deterministic(self):
+        """``HashRing`` maps keys the same way, regardless of the order of the members"""
+        ring1 = sharding.HashRing([1, 2, 3])
+        ring2 = sharding.HashRing([3, 1, 2])
+
+        self.assertEqual([ring1.owner(x) for x in range(256)], [ring2.owner(x) for x in range(256)])
+
+    def test_balanced(self):
+        """``HashRing`` spreads the keys somewhat evenly between the members"""
+        ring = sharding.HashRing([1, 2, 3, 4])
+        owners = [ring.owner(x) for x in range(256)]
+
+        for member in (1, 2, 3, 4):
+            # perfectly even would be 64
+            self.assertTrue(32 < owners.count(member) < 96)
+
+    def test_minimal_movement(self):
+        """``HashRing`` only moves keys to a new member; never between the existing ones"""
+        before = sharding.HashRing([1, 2, 3])
+        after = sharding.HashRing([1, 2, 3, 4])
+
+        for key in range(256):
+            if after.owner(key) != 4:
+                self.assertEqual(after.owner(key), before.owner(key))
+
+
+@patch.object(sharding, 'log')
+class TestShardCoordinator(unittest.TestCase):
+    """A suite of test cases for the ``ShardCoordinator`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_db = MagicMock()
+        self.fake_db.join_shard_group.return_value = True
+        self.fake_db.held_shards.return_value = []
+        self.fake_db.lock_shards.side_effect = lambda shards: list(shards)
+        self.coordinator = sharding.ShardCoordinator(db_factory=lambda: self.fake_db, shards=16)
+
+    def test_sole_member(self, fake_log):
+        """``ShardCoordinator.rebalance`` takes every shard when it's the only worker"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member]
+
+        owned = self.coordinator.rebalance()
+
+        self.assertEqual(owned, set(range(16)))
+        self.assertTrue(self.coordinator.owns('bob'))
+
+    def test_rejoins_taken_id(self, fake_log):
+        """``ShardCoordinator`` picks another member ID if one is already in use"""
+        self.fake_db.join_shard_group.side_effect = [False, True]
+        self.fake_db.shard_group_members.return_value = []
+
+        self.coordinator.rebalance()
+
+        self.assertEqual(self.fake_db.join_shard_group.call_count, 2)
+
+    def test_hands_back(self, fake_log):
+        """``ShardCoordinator.rebalance`` hands back the shards of a worker that joined"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member, 7]
+        self.fake_db.held_shards.return_value = list(range(16))
+
+        owned = self.coordinator.rebalance()
+        ring = sharding.HashRing([self.coordinator.member, 7])
+        expected = {x for x in range(16) if ring.owner(x) == self.coordinator.member}
+        released = set(self.fake_db.unlock_shards.call_args[0][0])
+
+        self.assertEqual(owned, expected)
+        self.assertEqual(released, set(range(16)) - expected)
+
+    def test_keep(self, fake_log):
+        """``ShardCoordinator.rebalance`` doesn't hand back the shards of users in ``keep``"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member, 7]
+        self.fake_db.held_shards.return_value = list(range(16))
+        self.coordinator.rebalance()
+        the_other = next(x for x in range(16) if x not in self.coordinator.owned)
+        user = next('user{}'.format(x) for x in range(1000) if sharding.shard_of('user{}'.format(x), 16) == the_other)
+
+        self.coordinator.rebalance(keep=[user])
+
+        self.assertTrue(self.coordinator.owns(user))
+
+    def test_taken_shard(self, fake_log):
+        """``ShardCoordinator`` doesn't own a shard it couldn't lock"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member]
+        self.fake_db.lock_shards.side_effect = lambda shards: [x for x in shards if x != 3]
+
+        owned = self.coordinator.rebalance()
+
+        self.assertFalse(3 in owned)
+
+    def test_db_error(self, fake_log):
+        """``ShardCoordinator`` owns nothing, and re-joins the group, after a database error"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member]
+        self.coordinator.rebalance()
+        self.fake_db.held_shards.side_effect = DatabaseError('testing', pgcode=None)
+
+        with self.assertRaises(DatabaseError):
+            self.coordinator.rebalance()
+
+        self.assertEqual(self.coordinator.owned, set())
+        self.assertTrue(self.fake_db.close.called)
+        self.assertTrue(self.coordinator.member is None)
+
+    def test_close(self, fake_log):
+        """``ShardCoordinator.close`` closes the connection, which releases every lock"""
+        self.fake_db.shard_group_members.side_effect = lambda: [self.coordinator.member]
+        self.coordinator.rebalance()
+
+        self.coordinator.close()
+
+        self.assertTrue(self.fake_db.close.called)
+        self.assertFalse(self.coordinator.owns('bob'))
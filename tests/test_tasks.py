@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``tasks.py`` module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_quota.libs import tasks
+
+
+def _make_resp(status_code):
+    """Create a fake HTTP response for a task status check"""
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.ok = status_code < 400
+    return resp
+
+
+@patch.object(tasks, 'log')
+@patch.object(tasks.sessions, 'request')
+class TestTaskTracker(unittest.TestCase):
+    """A suite of test cases for the ``TaskTracker`` object"""
+
+    def test_register(self, fake_request, fake_log):
+        """``TaskTracker`` keeps track of registered tasks"""
+        tracker = tasks.TaskTracker()
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        self.assertEqual(len(tracker), 1)
+        self.assertTrue(tracker.busy('bob'))
+        self.assertFalse(tracker.busy('lisa'))
+
+    def test_groups(self, fake_request, fake_log):
+        """``TaskTracker.groups`` returns every group with a task running"""
+        tracker = tasks.TaskTracker()
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+        tracker.register('https://other-task', {}, group='bob', label='vm2')
+        tracker.register('https://another-task', {}, group='sam', label='vm1')
+
+        self.assertEqual(tracker.groups(), {'bob', 'sam'})
+
+    def test_not_due(self, fake_request, fake_log):
+        """``TaskTracker.poll`` does not check a task before its backoff expires"""
+        tracker = tasks.TaskTracker(min_backoff=100)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        tracker.poll()
+
+        self.assertFalse(fake_request.called)
+
+    def test_task_done(self, fake_request, fake_log):
+        """``TaskTracker.poll`` reports the group once all its tasks succeed"""
+        fake_request.return_value = _make_resp(200)
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+        tracker.register('https://some-other-task', {}, group='bob', label='vm2')
+
+        done = tracker.poll()
+        expected = {'bob': (['vm1', 'vm2'], [], [])}
+
+        self.assertEqual(done, expected)
+        self.assertFalse(tracker.busy('bob'))
+
+    def test_task_failed(self, fake_request, fake_log):
+        """``TaskTracker.poll`` reports tasks that failed"""
+        fake_request.return_value = _make_resp(500)
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        done = tracker.poll()
+        expected = {'bob': ([], ['vm1'], [])}
+
+        self.assertEqual(done, expected)
+
+    def test_on_done(self, fake_request, fake_log):
+        """``TaskTracker.poll`` calls ``on_done`` once a task finishes, and not while it's running"""
+        fake_request.side_effect = [_make_resp(202), _make_resp(500)]
+        on_done = MagicMock()
+        tracker = tasks.TaskTracker(min_backoff=0, max_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1', on_done=on_done)
+
+        tracker.poll()
+        running_calls = on_done.call_count
+        tracker.poll()
+
+        self.assertEqual(running_calls, 0)
+        self.assertEqual(on_done.call_count, 1)
+
+    def test_fresh_token(self, fake_request, fake_log):
+        """``TaskTracker.poll`` obtains a new auth token for every status check"""
+        fake_request.return_value = _make_resp(202)
+        get_token = MagicMock(side_effect=['token1', 'token2'])
+        tracker = tasks.TaskTracker(min_backoff=0, max_backoff=0)
+        tracker.register('https://some-task', {'X-Auth': 'token0', 'User-Agent': 'vLab Quota'},
+                         group='bob', label='vm1', get_token=get_token)
+
+        tracker.poll()
+        tracker.poll()
+        _, the_kwargs = fake_request.call_args
+
+        self.assertEqual(the_kwargs['headers'], {'X-Auth': 'token2', 'User-Agent': 'vLab Quota'})
+
+    def test_defer(self, fake_request, fake_log):
+        """``TaskTracker.poll`` reports deferred work, separate from failures, once the rest of the group finishes"""
+        fake_request.return_value = _make_resp(200)
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+        tracker.defer('bob', 'vm2')
+
+        done = tracker.poll()
+
+        self.assertEqual(done, {'bob': (['vm1'], [], ['vm2'])})
+
+    def test_task_running(self, fake_request, fake_log):
+        """``TaskTracker.poll`` backs off on tasks that are still running"""
+        fake_request.return_value = _make_resp(202)
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        done = tracker.poll()
+
+        self.assertEqual(done, {})
+        self.assertTrue(tracker.busy('bob'))
+
+    def test_partial_group(self, fake_request, fake_log):
+        """``TaskTracker.poll`` does not report a group until every task in it finishes"""
+        fake_request.side_effect = [_make_resp(200), _make_resp(202)]
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+        tracker.register('https://some-other-task', {}, group='bob', label='vm2')
+
+        done = tracker.poll()
+
+        self.assertEqual(done, {})
+
+    def test_task_timeout(self, fake_request, fake_log):
+        """``TaskTracker.poll`` fails a task that runs past its deadline"""
+        fake_request.return_value = _make_resp(202)
+        tracker = tasks.TaskTracker(timeout=-1, min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        done = tracker.poll()
+        expected = {'bob': ([], ['vm1'], [])}
+
+        self.assertEqual(done, expected)
+
+    def test_connection_error(self, fake_request, fake_log):
+        """``TaskTracker.poll`` retries tasks when the status check fails to connect"""
+        fake_request.side_effect = tasks.requests.exceptions.ConnectionError('testing')
+        tracker = tasks.TaskTracker(min_backoff=0)
+        tracker.register('https://some-task', {}, group='bob', label='vm1')
+
+        done = tracker.poll()
+
+        self.assertEqual(done, {})
+        self.assertTrue(tracker.busy('bob'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``tokens.py`` module"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import jwt
+
+from vlab_quota.libs import tokens
+
+
+class TestGetSecret(unittest.TestCase):
+    """A suite of test cases for the ``_get_secret`` function"""
+    def test_no_location(self):
+        """``_get_secret`` raises RuntimeError if the 'location' parameter is not true"""
+        with self.assertRaises(RuntimeError):
+            tokens._get_secret(location=None)
+
+    @patch("vlab_quota.libs.tokens.open", create=True)
+    def test_reads_file(self, fake_open):
+        """``_get_secret`` reads the secret out of the supplied file"""
+        fake_file = MagicMock()
+        fake_file.read.return_value = 'aa.bb.cc'
+        fake_open.return_value.__enter__.return_value = fake_file
+
+        secret = tokens._get_secret(location='/some/path/location')
+        expected = 'aa.bb.cc'
+
+        self.assertEqual(secret, expected)
+
+
+class TestTokenProvider(unittest.TestCase):
+    """A suite of test cases for the ``TokenProvider`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        fd, self.key_file = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as the_file:
+            the_file.write('some-secret-key-that-is-long-enough\n')
+
+    def tearDown(self):
+        """Runs after every test case"""
+        os.remove(self.key_file)
+
+    def _change_key(self, new_key):
+        """Write a new key, and make sure the mtime of the file changes"""
+        with open(self.key_file, 'w') as the_file:
+            the_file.write(new_key)
+        stat = os.stat(self.key_file)
+        os.utime(self.key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def test_token(self):
+        """``TokenProvider.get`` returns a valid JSON Web Token"""
+        provider = tokens.TokenProvider(location=self.key_file)
+        token = provider.get('bob', client_ip='10.1.1.1', version=2)
+
+        claims = jwt.decode(token, 'some-secret-key-that-is-long-enough', algorithms=[tokens.const.AUTH_TOKEN_ALGORITHM])
+
+        self.assertEqual(claims['username'], 'bob')
+        self.assertEqual(claims['client_ip'], '10.1.1.1')
+        self.assertEqual(claims['version'], 2)
+
+    def test_cached(self):
+        """``TokenProvider.get`` reuses a token that's not close to expiring"""
+        provider = tokens.TokenProvider(location=self.key_file)
+        token1 = provider.get('bob', client_ip='10.1.1.1')
+        token2 = provider.get('bob', client_ip='10.1.1.1')
+
+        self.assertTrue(token1 is token2)
+
+    def test_cache_key(self):
+        """``TokenProvider.get`` caches tokens per user, client IP and version"""
+        provider = tokens.TokenProvider(location=self.key_file)
+        token1 = provider.get('bob', client_ip='10.1.1.1')
+        token2 = provider.get('bob', client_ip='10.1.1.2')
+        token3 = provider.get('sam', client_ip='10.1.1.1')
+
+        self.assertEqual(len({token1, token2, token3}), 3)
+
+    def test_refresh(self):
+        """``TokenProvider.get`` creates a new token when the cached one is about to expire"""
+        provider = tokens.TokenProvider(location=self.key_file, refresh_margin=tokens.TOKEN_LIFETIME + 1)
+        provider.get('bob', client_ip='10.1.1.1')
+        with patch.object(tokens.jwt, 'encode') as fake_encode:
+            provider.get('bob', client_ip='10.1.1.1')
+
+        self.assertTrue(fake_encode.called)
+
+    @patch.object(tokens, '_get_secret')
+    def test_key_read_once(self, fake_get_secret):
+        """``TokenProvider`` only reads the signing key once"""
+        fake_get_secret.return_value = 'some-secret-key-that-is-long-enough'
+        provider = tokens.TokenProvider(location=self.key_file)
+        provider.get('bob', client_ip='10.1.1.1')
+        provider.get('sam', client_ip='10.1.1.1')
+
+        self.assertEqual(fake_get_secret.call_count, 1)
+
+    def test_key_reload(self):
+        """``TokenProvider`` reloads the key, and drops cached tokens, when the key file changes"""
+        provider = tokens.TokenProvider(location=self.key_file)
+        token1 = provider.get('bob', client_ip='10.1.1.1')
+        self._change_key('a-whole-new-key-that-is-long-enough')
+        token2 = provider.get('bob', client_ip='10.1.1.1')
+
+        claims = jwt.decode(token2, 'a-whole-new-key-that-is-long-enough', algorithms=[tokens.const.AUTH_TOKEN_ALGORITHM])
+
+        self.assertNotEqual(token1, token2)
+        self.assertEqual(claims['username'], 'bob')
+
+    def test_no_location(self):
+        """``TokenProvider.get`` raises RuntimeError when no key location is configured"""
+        provider = tokens.TokenProvider(location='')
+
+        with self.assertRaises(RuntimeError):
+            provider.get('bob', client_ip='10.1.1.1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``tracing.py`` module"""
+import os
+import unittest
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+
+from vlab_quota.libs import tracing
+
+
+class TestTracingOff(unittest.TestCase):
+    """A suite of test cases for when tracing is not configured"""
+    def test_span(self):
+        """``span`` hands out a span that does nothing"""
+        with tracing.span('testing', user='bob') as span:
+            span.tag(vm='myVM')
+
+        self.assertTrue(span is tracing._NOOP_SPAN)
+
+    def test_propagate(self):
+        """``propagate`` returns the function as-is"""
+        def func():
+            pass
+
+        self.assertTrue(tracing.propagate(func) is func)
+
+
+class TestTracing(unittest.TestCase):
+    """A suite of test cases for exporting spans"""
+    def setUp(self):
+        """Runs before every test case"""
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        tracing.configure(self.path)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        tracing.close()
+        os.remove(self.path)
+
+    def _read_spans(self):
+        """Read back the exported spans"""
+        tracing.close()
+        with open(self.path) as the_file:
+            return [ujson.loads(x) for x in the_file]
+
+    def test_exports(self):
+        """``span`` writes the finished span as a line of JSON"""
+        with tracing.span('testing', user='bob') as span:
+            span.tag(vm='myVM')
+        spans = self._read_spans()
+
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], 'testing')
+        self.assertEqual(spans[0]['tags'], {'user': 'bob', 'vm': 'myVM'})
+        self.assertTrue(spans[0]['duration'] >= 0)
+        self.assertEqual(spans[0]['parent_id'], None)
+
+    def test_children(self):
+        """Spans started inside another span are its children"""
+        with tracing.span('parent'):
+            with tracing.span('child'):
+                pass
+        child, parent = self._read_spans()
+
+        self.assertEqual(child['parent_id'], parent['span_id'])
+        self.assertEqual(child['trace_id'], parent['trace_id'])
+
+    def test_new_trace(self):
+        """Each root span starts a new trace"""
+        with tracing.span('first'):
+            pass
+        with tracing.span('second'):
+            pass
+        first, second = self._read_spans()
+
+        self.assertNotEqual(first['trace_id'], second['trace_id'])
+
+    def test_error(self):
+        """``span`` records the error that ended the span"""
+        try:
+            with tracing.span('testing'):
+                raise RuntimeError('doh')
+        except RuntimeError:
+            pass
+        spans = self._read_spans()
+
+        self.assertEqual(spans[0]['error'], 'RuntimeError: doh')
+
+    def test_propagate(self):
+        """``propagate`` makes spans in another thread children of the current span"""
+        def work():
+            with tracing.span('child'):
+                pass
+
+        with tracing.span('parent'):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                jobs = [pool.submit(tracing.propagate(work)) for _ in range(2)]
+                for job in jobs:
+                    job.result()
+        spans = self._read_spans()
+        parent = [x for x in spans if x['name'] == 'parent'][0]
+        children = [x for x in spans if x['name'] == 'child']
+
+        self.assertEqual(len(children), 2)
+        self.assertTrue(all(x['parent_id'] == parent['span_id'] for x in children))
+
+    def test_propagate_at_submit(self):
+        """``propagate`` uses the span that was current when it was called, and leaves the worker thread as it found it"""
+        def work():
+            with tracing.span('child'):
+                pass
+            return tracing._current()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            with tracing.span('parent'):
+                wrapped = tracing.propagate(work)
+            inside = pool.submit(wrapped).result()
+            after = pool.submit(tracing._current).result()
+        spans = self._read_spans()
+        parent = [x for x in spans if x['name'] == 'parent'][0]
+        child = [x for x in spans if x['name'] == 'child'][0]
+
+        self.assertEqual(child['parent_id'], parent['span_id'])
+        self.assertEqual(inside.span_id, parent['span_id'])
+        self.assertTrue(after is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
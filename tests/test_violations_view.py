@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ViolationsView object"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+from flask import Flask
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_quota.libs.views import violations
+
+
+class TestViolationsView(unittest.TestCase):
+    """A suite of test cases for the ViolationsView object"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.token = generate_v2_test_token(username='sally')
+        cls.non_admin_token = generate_v2_test_token(username='bob')
+
+    @classmethod
+    def setUp(cls):
+        """Run before every test case"""
+        app = Flask(__name__)
+        violations.ViolationsView.register(app)
+        cls.app = app.test_client()
+        violations.const.QUOTA_ADMINS.append('sally')
+
+    @classmethod
+    def tearDown(cls):
+        """Run after every test case"""
+        violations.const.QUOTA_ADMINS.remove('sally')
+
+    @patch.object(violations, 'Database')
+    def test_ndjson(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations returns one JSON document per line"""
+        fake_Database.return_value.iter_violations.return_value = iter([('bob', 1, 2), ('sam', 3, 4)])
+        resp = self.app.get('/api/1/quota/violations', headers={'X-Auth': self.token})
+
+        lines = [ujson.loads(x) for x in resp.get_data(as_text=True).splitlines()]
+        expected = [{'username': 'bob', 'exceeded_on': 1, 'last_notified': 2},
+                    {'username': 'sam', 'exceeded_on': 3, 'last_notified': 4}]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertEqual(lines, expected)
+
+    @patch.object(violations, 'Database')
+    def test_chunks(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations streams the rows in chunks"""
+        rows = [('user{}'.format(x), x, x) for x in range(violations.ROWS_PER_CHUNK + 1)]
+        fake_Database.return_value.iter_violations.return_value = iter(rows)
+
+        chunks = list(violations._stream(fake_Database.return_value, None, None))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(len(chunks[0].splitlines()), violations.ROWS_PER_CHUNK)
+
+    @patch.object(violations, 'Database')
+    def test_keyset(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations supports keyset pagination"""
+        fake_Database.return_value.iter_violations.return_value = iter([])
+        self.app.get('/api/1/quota/violations?after=bob&limit=10', headers={'X-Auth': self.token})
+
+        _, the_kwargs = fake_Database.return_value.iter_violations.call_args
+
+        self.assertEqual(the_kwargs['after'], 'bob')
+        self.assertEqual(the_kwargs['limit'], 10)
+
+    @patch.object(violations, 'Database')
+    def test_bad_limit(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations returns 400 for a bad limit"""
+        resp = self.app.get('/api/1/quota/violations?limit=-1', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(fake_Database.called)
+
+    @patch.object(violations, 'Database')
+    def test_closes_db(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations returns the DB connection once the response is sent"""
+        fake_Database.return_value.iter_violations.return_value = iter([('bob', 1, 2)])
+        resp = self.app.get('/api/1/quota/violations', headers={'X-Auth': self.token})
+        resp.close()
+
+        self.assertTrue(fake_Database.return_value.close.called)
+
+    @patch.object(violations, 'Database')
+    def test_admin_only(self, fake_Database):
+        """ViolationsView - GET on /api/1/quota/violations is only allowed for admins"""
+        resp = self.app.get('/api/1/quota/violations', headers={'X-Auth': self.non_admin_token})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(fake_Database.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
-from vlab_quota.libs import vm
+from vlab_quota.libs import vm, inventory
 
 
 class TestCallApi(unittest.TestCase):
@@ -15,8 +15,8 @@ class TestCallApi(unittest.TestCase):
         cls.token = b'aa.bb.cc'
 
     @patch.object(vm.time, 'sleep')
-    @patch.object(vm.requests, 'get')
-    def test_task_call(self, fake_get, fake_sleep):
+    @patch.object(vm.sessions, 'request')
+    def test_task_call(self, fake_request, fake_sleep):
         """``_call_api`` blocks on the async task API calls when task_call=True"""
         fake_resp1 = MagicMock()
         fake_resp1.ok = True
@@ -26,34 +26,54 @@ class TestCallApi(unittest.TestCase):
         fake_resp2.ok = True
         fake_resp2.status_code = 200
         fake_resp2.json.return_value = {'json-body': True}
-        fake_get.side_effect = [fake_resp1, fake_resp2]
+        fake_request.side_effect = [fake_resp1, fake_resp2]
 
         vm._call_api('https://some-vlab-service', self.token, task_call=True)
 
         self.assertTrue(fake_sleep.called)
 
     @patch.object(vm.time, 'sleep')
-    @patch.object(vm.requests, 'get')
-    def test_no_task_call(self, fake_get, fake_sleep):
+    @patch.object(vm.sessions, 'request')
+    def test_on_task(self, fake_request, fake_sleep):
+        """``_call_api`` hands off the async task instead of blocking when on_task is supplied"""
+        fake_resp = MagicMock()
+        fake_resp.ok = True
+        fake_resp.links = {'status': {'url': 'https://some-url'}}
+        fake_resp.status_code = 202
+        fake_request.return_value = fake_resp
+        on_task = MagicMock()
+
+        vm._call_api('https://some-vlab-service', self.token, task_call=True, on_task=on_task)
+
+        the_args, _ = on_task.call_args
+        task_url = the_args[0]
+
+        self.assertEqual(task_url, 'https://some-url')
+        self.assertEqual(fake_request.call_count, 1)
+        self.assertFalse(fake_sleep.called)
+
+    @patch.object(vm.time, 'sleep')
+    @patch.object(vm.sessions, 'request')
+    def test_no_task_call(self, fake_request, fake_sleep):
         """``_call_api`` does not blocks on the async task API calls when task_call=False"""
         fake_resp = MagicMock()
         fake_resp.ok = True
         fake_resp.status_code = 200
         fake_resp.json.return_value = {'json-body': True}
-        fake_get.return_value = fake_resp
+        fake_request.return_value = fake_resp
 
         vm._call_api('https://some-vlab-service', self.token, task_call=False)
 
         self.assertFalse(fake_sleep.called)
 
-    @patch.object(vm.requests, 'get')
-    def test_returns_json(self, fake_get):
+    @patch.object(vm.sessions, 'request')
+    def test_returns_json(self, fake_request):
         """``_call_api`` returns the deserialized JSON body"""
         fake_resp = MagicMock()
         fake_resp.ok = True
         fake_resp.status_code = 200
         fake_resp.json.return_value = {'json-body': True}
-        fake_get.return_value = fake_resp
+        fake_request.return_value = fake_resp
 
         output = vm._call_api('https://some-vlab-service', self.token, task_call=False)
         expected = {'json-body': True}
@@ -61,61 +81,40 @@ class TestCallApi(unittest.TestCase):
         self.assertEqual(output, expected)
 
     @patch.object(vm, 'log')
-    @patch.object(vm.requests, 'get')
-    def test_raises_exception(self, fake_get, fake_log):
+    @patch.object(vm.sessions, 'request')
+    def test_raises_exception(self, fake_request, fake_log):
         """``_call_api`` returns the deserialized JSON body"""
         fake_resp = MagicMock()
         fake_resp.ok = False
         fake_resp.status_code = 200
         fake_resp.json.return_value = {'json-body': True}
-        fake_get.return_value = fake_resp
+        fake_request.return_value = fake_resp
 
         vm._call_api('https://some-vlab-service', self.token, task_call=False)
 
         self.assertTrue(fake_resp.raise_for_status.called)
 
     @patch.object(vm, 'log')
-    @patch.object(vm.requests, 'get')
-    def test_logs_on_exception(self, fake_get, fake_log):
+    @patch.object(vm.sessions, 'request')
+    def test_logs_on_exception(self, fake_request, fake_log):
         """``_call_api`` returns the deserialized JSON body"""
         fake_resp = MagicMock()
         fake_resp.ok = False
         fake_resp.status_code = 200
         fake_resp.json.return_value = {'json-body': True}
-        fake_get.return_value = fake_resp
+        fake_request.return_value = fake_resp
 
         vm._call_api('https://some-vlab-service', self.token, task_call=False)
 
         self.assertTrue(fake_log.error.called)
 
 
-class TestGetSecret(unittest.TestCase):
-    """A suite of test cases for the ``_get_secret`` function"""
-    def test_no_location(self):
-        """``_get_secret`` raises RuntimeError if the 'location' parameter is not true"""
-        with self.assertRaises(RuntimeError):
-            vm._get_secret(location=None)
-
-    @patch("vlab_quota.libs.vm.open", create=True)
-    def test_reads_file(self, fake_open):
-        """``_get_secret`` reads the secret out of the supplied file"""
-        fake_file = MagicMock()
-        fake_file.read.return_value = 'aa.bb.cc'
-        fake_open.return_value.__enter__.return_value = fake_file
-
-        secret = vm._get_secret(location='/some/path/location')
-        expected = 'aa.bb.cc'
-
-        self.assertEqual(secret, expected)
-
-
 class TestGenerateToken(unittest.TestCase):
     """A suite of tests cases for the ``generate_token`` function"""
-    @patch.object(vm, '_get_secret')
-    @patch.object(vm.jwt, 'encode')
-    def test_token(self, fake_encode, fake_get_secret):
+    @patch.object(vm, '_TOKENS')
+    def test_token(self, fake_TOKENS):
         """``generate_token`` returns an encoded JSON Web Token"""
-        fake_encode.return_value = 'aa.bb.cc'
+        fake_TOKENS.get.return_value = 'aa.bb.cc'
 
         token = vm._generate_token(user='bob')
         expected = 'aa.bb.cc'
@@ -138,16 +137,33 @@ class TestDeleteVM(unittest.TestCase):
 
         self.assertEqual(url, expected_url)
 
+    @patch.object(vm, '_generate_token')
+    @patch.object(vm, '_call_api')
+    def test_delete_vm_tracker(self, fake_call_api, fake_generate_token):
+        """``_delete_vm`` registers the delete task with the tracker when supplied"""
+        fake_generate_token.return_value = b'aa.bb.cc'
+        fake_tracker = MagicMock()
+        vm._delete_vm(user='sam', vm_name='doh', vm_type='OneFS', tracker=fake_tracker)
 
-class TestDeletePortmapRules(unittest.TestCase):
-    """A suite of test cases for the ``_delete_portmap_rules`` function"""
+        _, the_kwargs = fake_call_api.call_args
+        the_kwargs['on_task']('https://some-task', {})
+        _, register_kwargs = fake_tracker.register.call_args
+        get_token = register_kwargs.pop('get_token')
+
+        self.assertEqual(register_kwargs, {'group': 'sam', 'label': 'doh', 'on_done': None})
+        self.assertEqual(get_token(), b'aa.bb.cc')
+
+
+class TestGetPortmapIndex(unittest.TestCase):
+    """A suite of test cases for the ``_get_portmap_index`` function"""
 
     @patch.object(vm, '_generate_token')
     @patch.object(vm, '_call_api')
-    def notest_delete_portmap_rules(self, fake_call_api, fake_generate_token):
-        """``_delete_portmap_rules`` constructs the correct URL to delete portmap rules"""
+    def test_url(self, fake_call_api, fake_generate_token):
+        """``_get_portmap_index`` constructs the correct URL to lookup portmap rules"""
         fake_generate_token.return_value = b'aa.bb.cc'
-        vm._delete_portmap_rules(user='max', vm_name='beer')
+        fake_call_api.return_value = {'content': {'ports': {}}}
+        vm._get_portmap_index(user='max')
 
         the_args, _ = fake_call_api.call_args
         url = the_args[0]
@@ -157,25 +173,136 @@ class TestDeletePortmapRules(unittest.TestCase):
 
     @patch.object(vm, '_generate_token')
     @patch.object(vm, '_call_api')
-    def test_only_deletes_vm_rules(self, fake_call_api, fake_generate_token):
-        """``_delete_portmap_rules`` only deletes portmap rules associated with the VM being deleted"""
+    def test_index(self, fake_call_api, fake_generate_token):
+        """``_get_portmap_index`` maps VM names to their portmap rules"""
         fake_generate_token.return_value = b'aa.bb.cc'
-        data = {'content': {'ports': {'1234': {'name': 'beer'}, '2345': {'name': 'foo'}}}}
+        data = {'content': {'ports': {'1234': {'name': 'beer'}, '2345': {'name': 'foo'}, '3456': {'name': 'beer'}}}}
         fake_call_api.return_value = data
 
-        vm._delete_portmap_rules(user='max', vm_name='beer')
+        index = vm._get_portmap_index(user='max')
+        expected = {'beer': [1234, 3456], 'foo': [2345]}
+
+        self.assertEqual(fake_call_api.call_count, 1)
+        self.assertEqual(index, expected)
+
+
+class TestDeletePortmapRules(unittest.TestCase):
+    """A suite of test cases for the ``_delete_portmap_rules`` function"""
+
+    @patch.object(vm, '_generate_token')
+    @patch.object(vm, '_call_api')
+    def test_deletes_rules(self, fake_call_api, fake_generate_token):
+        """``_delete_portmap_rules`` deletes every supplied portmap rule"""
+        fake_generate_token.return_value = b'aa.bb.cc'
+
+        vm._delete_portmap_rules(user='max', conn_ports=[1234, 2345])
+
+        deleted_ports = set(x[1]['payload']['conn_port'] for x in fake_call_api.call_args_list)
+        expected_ports = {1234, 2345}
+
+        self.assertEqual(deleted_ports, expected_ports)
+
+    @patch.object(vm, '_generate_token')
+    @patch.object(vm, '_call_api')
+    def test_no_rules(self, fake_call_api, fake_generate_token):
+        """``_delete_portmap_rules`` makes no API calls when there are no rules to delete"""
+        vm._delete_portmap_rules(user='max', conn_ports=[])
+
+        self.assertFalse(fake_call_api.called)
+
+
+class TestSlots(unittest.TestCase):
+    """A suite of test cases for reserving in-flight deletion slots"""
+    @patch.object(vm, '_INFLIGHT_DELETES', vm.threading.BoundedSemaphore(2))
+    def test_reserve_without_waiting(self):
+        """``_reserve_slots`` reserves only the free slots, instead of waiting for more"""
+        slots = vm._reserve_slots(3)
+
+        self.assertEqual(len(slots), 2)
+
+    @patch.object(vm, '_INFLIGHT_DELETES', vm.threading.BoundedSemaphore(1))
+    def test_release_once(self):
+        """``_Slot.release`` only hands back the slot the first time it's called"""
+        slot = vm._reserve_slots(1)[0]
+        slot.release()
+        slot.release()
+
+        self.assertEqual(len(vm._reserve_slots(2)), 1)
+
+def _make_details(name, component='InsightIQ', power_state='poweredOn', created=0, size=0):
+    """Create the prefetched details of a VM"""
+    return inventory.VMDetails(name=name,
+                               component=component,
+                               power_state=power_state,
+                               created=created,
+                               size=size)
+
+
+def _raise(error):
+    """Raise an error from within a lambda"""
+    raise error
+
+
+class TestPickVictims(unittest.TestCase):
+    """A suite of test cases for the ``_pick_victims`` function"""
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        cls.user_vms = [_make_details('old', created=100, size=5),
+                        _make_details('big', created=300, size=50),
+                        _make_details('off', created=200, size=1, power_state='poweredOff')]
+
+    def test_random(self):
+        """``_pick_victims`` - the 'random' policy chooses the requested number of VMs"""
+        victims = vm._pick_victims('sam', self.user_vms, 2, policy='random')
+
+        self.assertEqual(len(victims), 2)
+
+    def test_oldest(self):
+        """``_pick_victims`` - the 'oldest' policy chooses the oldest VMs"""
+        victims = vm._pick_victims('sam', self.user_vms, 2, policy='oldest')
+        expected = [('old', 'insightiq'), ('off', 'insightiq')]
 
-        all_args = fake_call_api.call_args_list
-        _, delete_kwarg = all_args[1]
-        deleted_port = delete_kwarg['payload']['conn_port']
-        expected_port = 1234
+        self.assertEqual(victims, expected)
 
-        self.assertEqual(len(all_args), 2) # One to lookup all rules, another to delete
-        self.assertEqual(deleted_port, expected_port)
+    def test_powered_off_first(self):
+        """``_pick_victims`` - the 'powered-off-first' policy chooses powered off VMs first"""
+        victims = vm._pick_victims('sam', self.user_vms, 1, policy='powered-off-first')
+        expected = [('off', 'insightiq')]
 
+        self.assertEqual(victims, expected)
 
+    def test_largest_first(self):
+        """``_pick_victims`` - the 'largest-first' policy chooses the VMs consuming the most storage"""
+        victims = vm._pick_victims('sam', self.user_vms, 1, policy='largest-first')
+        expected = [('big', 'insightiq')]
+
+        self.assertEqual(victims, expected)
+
+    def test_bad_policy(self):
+        """``_pick_victims`` raises ValueError for an unknown policy"""
+        with self.assertRaises(ValueError):
+            vm._pick_victims('sam', self.user_vms, 1, policy='doh')
+
+    def test_check_victim_policy(self):
+        """``check_victim_policy`` raises ValueError for an unknown policy"""
+        with self.assertRaises(ValueError):
+            vm.check_victim_policy('doh')
+
+    @patch.object(vm, 'log')
+    def test_skips_unknown(self, fake_log):
+        """``_pick_victims`` never chooses a VM that's deploying or failed to deploy"""
+        user_vms = self.user_vms + [_make_details('deploying', component='Unknown', created=1)]
+        victims = vm._pick_victims('sam', user_vms, 4, policy='oldest')
+        victim_names = [x[0] for x in victims]
+
+        self.assertEqual(len(victims), 3)
+        self.assertFalse('deploying' in victim_names)
+
+
+@patch.object(vm, '_get_portmap_index', MagicMock(return_value={'someVM': [1234]}))
 @patch.object(vm, 'log')
-@patch.object(vm.virtual_machine, 'get_info')
+@patch.object(vm, 'get_vm_details')
 @patch.object(vm, '_delete_portmap_rules')
 @patch.object(vm, '_delete_vm')
 class TestDestroyVMs(unittest.TestCase):
@@ -183,25 +310,18 @@ class TestDestroyVMs(unittest.TestCase):
     @classmethod
     def setUp(cls):
         """Runs before every test case"""
-        fake_folder = MagicMock()
-        fake_vm1 = MagicMock()
-        fake_vm1.name = 'defaultGateway'
-        cls.fake_vm1 = fake_vm1
-        fake_vm2 = MagicMock()
-        fake_vm2.name = 'someVM'
-        cls.fake_vm2 = fake_vm2
-        fake_vm3 = MagicMock()
-        fake_vm3.name = 'someOtherVM'
-        cls.fake_vm3 = fake_vm3
-        fake_folder.childEntity.__iter__.return_value = [fake_vm1, fake_vm2, fake_vm3]
-        vcenter = MagicMock()
-        vcenter.get_by_name.return_value = fake_folder
-        cls.vcenter = vcenter
+        cls.vcenter = MagicMock()
+        cls.user_vms = [_make_details('defaultGateway', component='defaultGateway'),
+                        _make_details('someVM'),
+                        _make_details('someOtherVM')]
 
     @patch.object(vm, 'const')
-    def test_skips_default_gateway(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_info, fake_log):
+    def test_skips_default_gateway(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
         """``destory_vms`` will not delete a users defaultGateway"""
         fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = self.user_vms
         deleted_vms = []
         for _ in range(50):
             # avoid false negative due to random nature of "which VMs get deleted"
@@ -212,14 +332,15 @@ class TestDestroyVMs(unittest.TestCase):
         self.assertEqual(deleted_vms, expected)
 
     @patch.object(vm, 'const')
-    def test_skips_invalid_vms(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_info, fake_log):
+    def test_skips_invalid_vms(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
         """``destory_vms`` will skip a VM that's deploying or failed to deploy"""
         fake_const.VLAB_QUOTA_LIMIT = 1
-        good_info = {'meta': {'component': 'InsightIQ'}}
-        bad_info = {'meta': {'component': 'Unknown'}}
-        fake_get_info.side_effect = [bad_info, good_info]
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = [_make_details('someVM', component='Unknown'),
+                                            _make_details('someOtherVM')]
 
-        vm.destroy_vms('sandy', self.vcenter)
+        deleted_vms = vm.destroy_vms('sandy', self.vcenter)
 
         all_args = fake_log.info.call_args_list
         skip_positional_args, _ = all_args[0]
@@ -227,7 +348,146 @@ class TestDestroyVMs(unittest.TestCase):
         expected = 'Skipping VM %s owned by %s: VM cannot be deleted at this time'
 
         self.assertEqual(skip_msg, expected)
+        self.assertEqual(deleted_vms, ['someOtherVM'])
+
+    @patch.object(vm, 'const')
+    def test_deletes_overage(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destory_vms`` deletes only enough VMs to resolve the quota violation"""
+        fake_const.VLAB_QUOTA_LIMIT = 1
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = self.user_vms
+
+        deleted_vms = vm.destroy_vms('sandy', self.vcenter)
+
+        self.assertEqual(len(deleted_vms), 1)
+        self.assertEqual(fake_delete_vm.call_count, 1)
+
+    @patch.object(vm, 'const')
+    def test_not_enough_victims(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destory_vms`` returns when not enough VMs can be deleted"""
+        fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = [_make_details('someVM', component='Unknown'),
+                                            _make_details('someOtherVM')]
+
+        deleted_vms = vm.destroy_vms('sandy', self.vcenter)
+
+        self.assertEqual(deleted_vms, ['someOtherVM'])
+
+    @patch.object(vm, 'const')
+    def test_single_prefetch(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destory_vms`` looks up the details of every VM with a single call"""
+        fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = self.user_vms
+
+        vm.destroy_vms('sandy', self.vcenter)
+
+        self.assertEqual(fake_get_vm_details.call_count, 1)
+
+    @patch.object(vm, 'const')
+    def test_deletes_portmap_rules(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destory_vms`` deletes the portmap rules of every VM it deletes in one batch"""
+        fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'random'
+        fake_get_vm_details.return_value = self.user_vms
+
+        vm.destroy_vms('sandy', self.vcenter)
+
+        fake_delete_portmap_rules.assert_called_once_with('sandy', [1234])
+
+    @patch.object(vm, 'const')
+    def test_partial_failure(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destory_vms`` reports the VMs that were deleted when deleting another VM fails"""
+        fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'oldest'
+        fake_get_vm_details.return_value = self.user_vms
+        error = RuntimeError('testing')
+        fake_delete_vm.side_effect = lambda user, vm_name, vm_type, tracker: _raise(error) if vm_name == 'someVM' else None
+
+        with self.assertRaises(vm.DestroyError) as caught:
+            vm.destroy_vms('sandy', self.vcenter)
+
+        self.assertEqual(caught.exception.deleted, ['someOtherVM'])
+        self.assertTrue(caught.exception.error is error)
+
+
+@patch.object(vm, '_get_portmap_index', MagicMock(return_value={}))
+@patch.object(vm, 'log')
+@patch.object(vm, 'get_vm_details')
+@patch.object(vm, '_delete_portmap_rules')
+@patch.object(vm, '_delete_vm')
+@patch.object(vm, 'const')
+class TestDestroyVMsTracker(unittest.TestCase):
+    """A suite of test cases for ``destroy_vms`` when the delete tasks are tracked"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.patcher = patch.object(vm, '_INFLIGHT_DELETES', vm.threading.BoundedSemaphore(1))
+        self.patcher.start()
+        self.vcenter = MagicMock()
+        self.tracker = MagicMock()
+        self.user_vms = [_make_details('someVM', created=1), _make_details('someOtherVM', created=2)]
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+
+    def _setup_const(self, fake_const):
+        """Configure the constants ``destroy_vms`` depends on"""
+        fake_const.VLAB_QUOTA_LIMIT = 0
+        fake_const.QUOTA_USER_DELETE_WORKERS = 2
+        fake_const.QUOTA_VICTIM_POLICY = 'oldest'
+
+    def test_holds_slot(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destroy_vms`` only starts as many deletions as there are free slots, and the slot is held until the task finishes"""
+        self._setup_const(fake_const)
+        fake_get_vm_details.return_value = self.user_vms
+
+        started = vm.destroy_vms('sandy', self.vcenter, self.tracker)
+        slots_while_running = len(vm._reserve_slots(1))
+        _, the_kwargs = fake_delete_vm.call_args
+        the_kwargs['on_done']()
+
+        self.assertEqual(started, ['someVM'])
+        self.assertEqual(slots_while_running, 0)
+        self.assertEqual(len(vm._reserve_slots(1)), 1)
+
+    def test_defers(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destroy_vms`` tells the tracker about the VMs it didn't have a slot to delete"""
+        self._setup_const(fake_const)
+        fake_get_vm_details.return_value = self.user_vms
+
+        vm.destroy_vms('sandy', self.vcenter, self.tracker)
+
+        self.tracker.defer.assert_called_once_with('sandy', 'someOtherVM')
+
+    def test_failed_delete(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destroy_vms`` releases the slot when the delete task could not be started"""
+        self._setup_const(fake_const)
+        fake_get_vm_details.return_value = self.user_vms[:1]
+        fake_delete_vm.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(vm.DestroyError):
+            vm.destroy_vms('sandy', self.vcenter, self.tracker)
+
+        self.assertEqual(len(vm._reserve_slots(1)), 1)
+
+    def test_failed_portmap(self, fake_const, fake_delete_vm, fake_delete_portmap_rules, fake_get_vm_details, fake_log):
+        """``destroy_vms`` releases the slots when the portmap rules could not be deleted"""
+        self._setup_const(fake_const)
+        fake_get_vm_details.return_value = self.user_vms[:1]
+        fake_delete_portmap_rules.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            vm.destroy_vms('sandy', self.vcenter, self.tracker)
 
+        self.assertEqual(len(vm._reserve_slots(1)), 1)
+        self.assertFalse(fake_delete_vm.called)
 
 
 if __name__ == '__main__':
@@ -12,24 +12,15 @@ class TestGetViolators(unittest.TestCase):
     @classmethod
     def setUp(cls):
         """Runs once before every test case"""
-        fake_user1 = MagicMock()
-        fake_user1.name = 'bill'
-        fake_user1.childEntity = [1,2,3,4]
-        cls.fake_user1 = fake_user1
-        fake_user2 = MagicMock()
-        fake_user2.name = 'lisa'
-        fake_user2.childEntity = [1,2,3,4]
-        cls.fake_user2 = fake_user2
-        fake_user3 = MagicMock()
-        fake_user3.name = 'zed'
-        fake_user3.childEntity = [1,2,3,4]
-        cls.fake_user3 = fake_user3
-        fake_users = MagicMock()
-        fake_users.childEntity.__iter__.return_value = [fake_user1, fake_user2, fake_user3]
-        cls.fake_users = fake_users
-        vcenter = MagicMock()
-        vcenter.get_vm_folder.return_value = fake_users
-        cls.vcenter = vcenter
+        cls.vcenter = MagicMock()
+        cls.patcher = patch.object(worker, 'get_vm_counts')
+        cls.fake_get_vm_counts = cls.patcher.start()
+        cls.fake_get_vm_counts.return_value = {'bill': 4, 'lisa': 4, 'zed': 4}
+
+    @classmethod
+    def tearDown(cls):
+        """Runs once after every test case"""
+        cls.patcher.stop()
 
     @patch.object(worker, 'const')
     def test_return_type(self, fake_const):
@@ -40,6 +31,17 @@ class TestGetViolators(unittest.TestCase):
 
         self.assertEqual(violators, expected)
 
+    def test_uses_tracker(self):
+        """``_get_violators`` uses the incrementally tracked inventory when supplied"""
+        fake_tracker = MagicMock()
+        fake_tracker.vm_counts.return_value = {'bill': 400}
+
+        violators = worker._get_violators(self.vcenter, fake_tracker)
+        expected = {'bill': 399}
+
+        self.assertEqual(violators, expected)
+        self.assertFalse(self.fake_get_vm_counts.called)
+
     @patch.object(worker, 'const')
     def test_account_for_default_gateway(self, fake_const):
         """``_get_violators`` doesn't count the defaultGateway towards the quota limit"""
@@ -49,6 +51,18 @@ class TestGetViolators(unittest.TestCase):
 
         self.assertEqual(violators, expected)
 
+    @patch.object(worker, 'const')
+    def test_sharded(self, fake_const):
+        """``_get_violators`` only returns users in the shards this worker owns"""
+        fake_const.VLAB_QUOTA_LIMIT = 2
+        fake_shards = MagicMock()
+        fake_shards.owns.side_effect = lambda user: user != 'lisa'
+
+        violators = worker._get_violators(self.vcenter, shards=fake_shards)
+        expected = {'bill': 3, 'zed': 3}
+
+        self.assertEqual(violators, expected)
+
 
 @patch.object(worker, 'const')
 class TestGracePeriodExceeded(unittest.TestCase):
@@ -76,40 +90,100 @@ class TestGracePeriodExceeded(unittest.TestCase):
         self.assertFalse(answer)
 
 
-class TestGetUserEmail(unittest.TestCase):
-    """A suite of test cases for the ``_get_user_email`` function"""
+def _make_entry(username, mail):
+    """Create a fake LDAP search result entry"""
+    entry = MagicMock()
+    attributes = {'sAMAccountName': MagicMock(value=username), 'mail': MagicMock(value=mail)}
+    entry.__getitem__.side_effect = lambda x: attributes[x]
+    return entry
+
+
+class TestGetUserEmails(unittest.TestCase):
+    """A suite of test cases for the ``_get_user_emails`` function"""
     @classmethod
     def setUp(cls):
         """Runs once before every test case"""
-        cls.fake_entry = MagicMock()
-        cls.ldap_conn = MagicMock()
-        cls.ldap_conn.entries = [cls.fake_entry]
+        worker._EMAIL_CACHE.clear()
+        worker._NO_EMAIL_CACHE.clear()
+        cls.ldap_pool = MagicMock()
+        cls.ldap_pool.search.return_value = [_make_entry('phill', 'some@email.com')]
 
     def test_finds_email(self):
-        """``_get_user_email`` returns the user's email from AD/LDAP"""
-        self.fake_entry.__getitem__.return_value.value = 'some@email.com'
-        email = worker._get_user_email('phill', self.ldap_conn)
-        expected = 'some@email.com'
+        """``_get_user_emails`` returns the user's email from AD/LDAP"""
+        emails = worker._get_user_emails(['phill'], self.ldap_pool)
+        expected = {'phill': 'some@email.com'}
 
-        self.assertEqual(email, expected)
+        self.assertEqual(emails, expected)
 
-    def test_raises_runtime_error(self):
-        """``_get_user_email``raises RuntimeError if user is not found"""
-        self.ldap_conn.entries = []
+    @patch.object(worker, 'log')
+    def test_user_not_found(self, fake_log):
+        """``_get_user_emails``omits users that are not found"""
+        self.ldap_pool.search.return_value = []
 
-        with self.assertRaises(RuntimeError):
-            worker._get_user_email('phill', self.ldap_conn)
+        emails = worker._get_user_emails(['phill'], self.ldap_pool)
+
+        self.assertEqual(emails, {})
+        self.assertTrue(fake_log.error.called)
+
+    @patch.object(worker, 'log')
+    def test_user_not_found_cached(self, fake_log):
+        """``_get_user_emails`` doesn't search again for a user that was not found"""
+        self.ldap_pool.search.return_value = []
+
+        worker._get_user_emails(['phill'], self.ldap_pool)
+        emails = worker._get_user_emails(['phill'], self.ldap_pool)
+
+        self.assertEqual(emails, {})
+        self.assertEqual(self.ldap_pool.search.call_count, 1)
 
     def test_searches_for_email(self):
-        """``_get_user_email`` searches for the correct email attribute"""
-        worker._get_user_email('phill', self.ldap_conn)
+        """``_get_user_emails`` searches for the correct email attribute"""
+        worker._get_user_emails(['phill'], self.ldap_pool)
 
-        _, the_kwargs = self.ldap_conn.search.call_args
+        _, the_kwargs = self.ldap_pool.search.call_args
         searched_attribute = the_kwargs['attributes']
-        expected = ['mail']
+        expected = ['sAMAccountName', 'mail']
 
         self.assertEqual(searched_attribute, expected)
 
+    def test_single_search(self):
+        """``_get_user_emails`` looks up many users with a single search"""
+        self.ldap_pool.search.return_value = [_make_entry('phill', 'phill@email.com'), _make_entry('Bob', 'bob@email.com')]
+
+        emails = worker._get_user_emails(['phill', 'bob'], self.ldap_pool)
+        expected = {'phill': 'phill@email.com', 'bob': 'bob@email.com'}
+        _, the_kwargs = self.ldap_pool.search.call_args
+        search_filter = the_kwargs['search_filter']
+
+        self.assertEqual(emails, expected)
+        self.assertEqual(self.ldap_pool.search.call_count, 1)
+        self.assertEqual(search_filter, '(&(objectclass=User)(|(sAMAccountName=phill)(sAMAccountName=bob)))')
+
+    def test_cached(self):
+        """``_get_user_emails`` caches emails, so LDAP is only searched once per user"""
+        worker._get_user_emails(['phill'], self.ldap_pool)
+        emails = worker._get_user_emails(['phill'], self.ldap_pool)
+        expected = {'phill': 'some@email.com'}
+
+        self.assertEqual(emails, expected)
+        self.assertEqual(self.ldap_pool.search.call_count, 1)
+
+    def test_escapes_filter(self):
+        """``_get_user_emails`` escapes special characters in the search filter"""
+        worker._get_user_emails(['ph*ll'], self.ldap_pool)
+
+        _, the_kwargs = self.ldap_pool.search.call_args
+        search_filter = the_kwargs['search_filter']
+
+        self.assertTrue('ph\\2all' in search_filter)
+
+    @patch.object(worker, 'LDAP_BATCH_SIZE', 2)
+    def test_batches(self):
+        """``_get_user_emails`` splits large lookups into batches"""
+        worker._get_user_emails(['a', 'b', 'c'], self.ldap_pool)
+
+        self.assertEqual(self.ldap_pool.search.call_count, 2)
+
 
 class TestGetLdapPassword(unittest.TestCase):
     """A suite of test cases for the ``_get_ldap_password`` function"""
@@ -144,7 +218,18 @@ class TestGetLdapConn(unittest.TestCase):
 
         self.assertEqual(auto_bind_value, expected)
 
+    def test_timeout(self, fale_get_ldap_password, fake_Connection):
+        """``_get_ldap_conn`` sets a timeout, so a dead server can't hang the worker"""
+        worker._get_ldap_conn()
 
+        _, the_kwargs = fake_Connection.call_args
+        timeout = the_kwargs['receive_timeout']
+        expected = worker.const.QUOTA_LDAP_TIMEOUT
+
+        self.assertEqual(timeout, expected)
+
+
+@patch.object(worker, '_get_user_emails', lambda users, ldap_pool: {x: '{}@vlab.local'.format(x) for x in users})
 @patch.object(worker.notify, 'send_warning')
 @patch.object(worker.notify, 'send_follow_up')
 @patch.object(worker, '_get_violators')
@@ -155,46 +240,94 @@ class TestEnforceQuotas(unittest.TestCase):
     def setUp(cls):
         cls.vcenter = MagicMock()
         cls.db = MagicMock()
-        cls.ldap_conn = MagicMock()
+        cls.ldap_pool = MagicMock()
+
+    def test_one_query(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` looks up every violator with a single query"""
+        now = int(time.time())
+        self.db.users_info.side_effect = lambda users: {x: (now, now) for x in users}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 9, 'sam': 10}
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertEqual(self.db.users_info.call_count, 1)
+        self.assertFalse(self.db.user_info.called)
 
     @patch.object(worker, 'destroy_vms')
     def test_delets_vms(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
         """``_enforce_quotas`` Deletes VMs when the grace period expires"""
-        self.db.user_info.return_value = (100, 100)
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
         fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
 
-        worker._enforce_quotas(self.vcenter, self.db, self.ldap_conn)
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
 
         self.assertTrue(fake_destroy_vms.called)
 
     @patch.object(worker, 'destroy_vms')
     def test_delets_vms_follow_up(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
         """``_enforce_quotas`` Sends a follow up email after deleting VMs"""
-        self.db.user_info.return_value = (100, 100)
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
         fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
 
-        worker._enforce_quotas(self.vcenter, self.db, self.ldap_conn)
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
 
         self.assertTrue(fake_send_follow_up.called)
 
     @patch.object(worker, 'destroy_vms')
     def test_delets_vms_db_cleanup(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
         """``_enforce_quotas`` Removes the user from the DB after deleting VMs"""
-        self.db.user_info.return_value = (100, 100)
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
         fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
 
-        worker._enforce_quotas(self.vcenter, self.db, self.ldap_conn)
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
 
         self.assertTrue(self.db.remove_user.called)
 
+    @patch.object(worker, 'destroy_vms')
+    def test_partial_deletion(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` lets the user know about the VMs that were deleted, even if deleting another failed"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        error = worker.requests.exceptions.ConnectionError('testing')
+        fake_destroy_vms.side_effect = worker.DestroyError('testing', ['vm1'], error)
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        the_args, _ = fake_send_follow_up.call_args
+
+        self.assertEqual(the_args[2], ['vm1'])
+        self.assertFalse(self.db.remove_user.called)
+
+    def test_returns_new_violations(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` returns the violation date of users whose grace period just started"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+
+        output = worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertTrue(output['bob'][0] > 0)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_user_api_error(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` logs, and doesn't raise, a vLab API error hit while deleting a single user's VMs"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 9}
+        fake_destroy_vms.side_effect = [worker.requests.exceptions.ConnectionError('testing'), []]
+
+        output = worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertEqual(set(output), {'bob', 'lisa'})
+        self.assertTrue(fake_log.error.called)
+        self.assertEqual(fake_destroy_vms.call_count, 2)
+
     def test_send_warning(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
         """``_enforce_quotas`` Sends a warning email if enough time has passed since the last notification"""
         violation_date = (int(time.time()) - worker.const.QUOTA_GRACE_PERIOD) + 100
         last_time_notified = violation_date
-        self.db.user_info.return_value = (violation_date, last_time_notified)
+        self.db.users_info.side_effect = lambda users: {x: (violation_date, last_time_notified) for x in users}
         fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
 
-        worker._enforce_quotas(self.vcenter, self.db, self.ldap_conn)
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
 
         self.assertTrue(fake_send_warning.called)
 
@@ -202,55 +335,546 @@ class TestEnforceQuotas(unittest.TestCase):
     def test_set_violation_date(self, fake_time, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
         """``_enforce_quotas`` sets the violation_date if this the first time the user has been detected"""
         fake_time.return_value = 9001
-        self.db.user_info.return_value = (0, 0)
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
         fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
 
-        worker._enforce_quotas(self.vcenter, self.db, self.ldap_conn)
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
 
-        the_args, _ = self.db.upsert_user.call_args
-        violation_date = the_args[1]
+        the_args, _ = self.db.upsert_users.call_args
+        violation_date = the_args[0][0][1]
         expected = 9001
 
         self.assertEqual(violation_date, expected)
 
+    def test_records_first_violation(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` records the first violation, and the warning, of a newly detected user"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        event_log = MagicMock()
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, event_log=event_log)
+
+        recorded = [x[0] + (x[1]['vms'],) for x in event_log.record.call_args_list]
+        expected = [('bob', worker.events.FIRST_VIOLATION, 8), ('bob', worker.events.WARNED, 8)]
+
+        self.assertEqual(recorded, expected)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_records_deletion(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` records how many VMs were deleted"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        fake_destroy_vms.return_value = ['vm1', 'vm2']
+        event_log = MagicMock()
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, event_log=event_log)
+
+        event_log.record.assert_called_once_with('bob', worker.events.DELETED, vms=2)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_returns_violators(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` returns the violation record of every user exceeding their quota"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 3}
+
+        output = worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+        expected = {'bob': (100, 100), 'lisa': (100, 100)}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_error_after_all_processed(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` processes every violator before raising an error hit by one of them"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 3, 'sam': 9}
+        fake_destroy_vms.side_effect = [RuntimeError('testing'), [], []]
+
+        with self.assertRaises(RuntimeError):
+            worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertEqual(fake_destroy_vms.call_count, 3)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_no_action(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does nothing for violators that were recently warned"""
+        now = int(time.time())
+        self.db.users_info.side_effect = lambda users: {x: (now, now) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertFalse(fake_destroy_vms.called)
+        self.assertFalse(fake_send_warning.called)
+
+    def test_only_looks_up_emails_to_send(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does not lookup emails of users that won't be sent an email"""
+        now = int(time.time())
+        self.db.users_info.side_effect = lambda users: {x: (now, now) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+
+        with patch.object(worker, '_get_user_emails') as fake_get_user_emails:
+            worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.assertFalse(fake_get_user_emails.called)
+
+    def test_skips_unknown_emails(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does not warn users whose email could not be found, but still starts their grace period"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+
+        with patch.object(worker, '_get_user_emails') as fake_get_user_emails:
+            fake_get_user_emails.return_value = {}
+            worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+        the_args, _ = self.db.upsert_users.call_args
+        recorded = [(x[0], x[2]) for x in the_args[0]]
+
+        self.assertFalse(fake_send_warning.called)
+        self.assertEqual(recorded, [('bob', 0)])
+
+    def test_unknown_email_known_violation(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does not restart the grace period of users whose email could not be found"""
+        self.db.users_info.side_effect = lambda users: {x: (int(time.time()) - 100, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+
+        with patch.object(worker, '_get_user_emails') as fake_get_user_emails:
+            fake_get_user_emails.return_value = {}
+            worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        self.db.upsert_users.assert_called_with([])
+
+    def test_mailer_failures_not_recorded(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does not record warnings that the Mailer failed to send"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 9}
+        fake_mailer = MagicMock()
+        fake_mailer.flush.return_value = {'bob@vlab.local': RuntimeError('testing')}
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, mailer=fake_mailer)
+
+        the_args, _ = self.db.upsert_users.call_args
+        recorded = [x[0] for x in the_args[0]]
+        expected = ['lisa']
+
+        self.assertEqual(recorded, expected)
+
+    def test_uses_mailer(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` queues warnings on the supplied Mailer"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        fake_mailer = MagicMock()
+        fake_mailer.flush.return_value = {}
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, mailer=fake_mailer)
+
+        _, the_kwargs = fake_send_warning.call_args
+
+        self.assertTrue(the_kwargs['mailer'] is fake_mailer)
+        self.assertTrue(fake_mailer.flush.called)
+
+    def test_outbox_one_transaction(self, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` records warnings in the same transaction that queues them on the Outbox"""
+        self.db.users_info.side_effect = lambda users: {x: (0, 0) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        the_outbox = worker.Outbox(self.db)
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, mailer=the_outbox)
+        the_args, _ = self.db.enqueue_warnings.call_args
+        recorded = [x[0] for x in the_args[1]]
+
+        self.assertEqual(recorded, ['bob'])
+        self.assertFalse(self.db.upsert_users.called)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_records_warnings_on_error(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` records the warnings that were sent, even if deleting another user's VMs fails"""
+        self.db.users_info.side_effect = lambda users: {'bob': (100, 100), 'lisa': (0, 0)}
+        fake_get_violators.return_value = {'bob': 8, 'lisa': 9}
+        fake_destroy_vms.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool)
+
+        the_args, _ = self.db.upsert_users.call_args
+        recorded = [x[0] for x in the_args[0]]
+        expected = ['lisa']
+
+        self.assertEqual(recorded, expected)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_skips_busy_users(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` skips users whose VMs are still being deleted"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        fake_task_tracker = MagicMock()
+        fake_task_tracker.busy.return_value = True
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, task_tracker=fake_task_tracker)
+
+        self.assertFalse(fake_destroy_vms.called)
+
+    @patch.object(worker, 'destroy_vms')
+    def test_tracks_deletions(self, fake_destroy_vms, fake_log, fake_get_violators, fake_send_follow_up, fake_send_warning):
+        """``_enforce_quotas`` does not block on deletions when a task tracker is supplied"""
+        self.db.users_info.side_effect = lambda users: {x: (100, 100) for x in users}
+        fake_get_violators.return_value = {'bob': 8}
+        fake_task_tracker = MagicMock()
+        fake_task_tracker.busy.return_value = False
+
+        worker._enforce_quotas(self.vcenter, self.db, self.ldap_pool, task_tracker=fake_task_tracker)
+
+        the_args, _ = fake_destroy_vms.call_args
+        self.assertTrue(fake_task_tracker in the_args)
+        self.assertFalse(fake_send_follow_up.called)
+        self.assertFalse(self.db.remove_user.called)
+
+
+@patch.object(worker.notify, 'send_follow_up')
+@patch.object(worker, '_get_user_emails')
+@patch.object(worker, 'log')
+class TestResolveDeletions(unittest.TestCase):
+    """A suite of test cases for the ``_resolve_deletions`` function"""
+    @classmethod
+    def setUp(cls):
+        cls.db = MagicMock()
+        cls.ldap_pool = MagicMock()
+        cls.task_tracker = MagicMock()
+
+    def test_follow_up(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` notifies the user about the VMs that were deleted"""
+        self.task_tracker.poll.return_value = {'bob': (['vm1', 'vm2'], [], [])}
+        fake_get_user_emails.return_value = {'bob': 'bob@vlab.local'}
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool)
+
+        the_args, _ = fake_send_follow_up.call_args
+        vms = the_args[2]
+
+        self.assertEqual(vms, ['vm1', 'vm2'])
+
+    def test_removes_user(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` removes the violation record once all deletions succeed"""
+        self.task_tracker.poll.return_value = {'bob': (['vm1', 'vm2'], [], [])}
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool)
+
+        self.db.remove_users.assert_called_with(['bob'])
+
+    def test_records_deletion(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` records how many VMs were deleted"""
+        self.task_tracker.poll.return_value = {'bob': (['vm1', 'vm2'], [], [])}
+        event_log = MagicMock()
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool, event_log=event_log)
+
+        event_log.record.assert_called_once_with('bob', worker.events.DELETED, vms=2)
+
+    def test_keeps_user(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` keeps the violation record when a deletion fails"""
+        self.task_tracker.poll.return_value = {'bob': (['vm1'], ['vm2'], [])}
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool)
+
+        self.db.remove_users.assert_called_with([])
+
+    def test_deferred(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` keeps the violation record of a user with deferred deletions, without logging an error"""
+        self.task_tracker.poll.return_value = {'bob': (['vm1'], [], ['vm2'])}
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool)
+
+        self.db.remove_users.assert_called_with([])
+        self.assertFalse(fake_log.error.called)
+
+    def test_nothing_deleted(self, fake_log, fake_get_user_emails, fake_send_follow_up):
+        """``_resolve_deletions`` does not email a user when every deletion failed"""
+        self.task_tracker.poll.return_value = {'bob': ([], ['vm1'], [])}
+
+        worker._resolve_deletions(self.task_tracker, self.db, self.ldap_pool)
+
+        self.assertFalse(fake_send_follow_up.called)
+
+
+class TestPause(unittest.TestCase):
+    """A suite of test cases for the ``_pause`` function"""
+    @patch.object(worker.time, 'sleep')
+    def test_sleeps(self, fake_sleep):
+        """``_pause`` sleeps when the inventory is not tracked incrementally"""
+        worker._pause(7)
+
+        fake_sleep.assert_called_with(7)
+
+    @patch.object(worker.time, 'sleep')
+    def test_waits_on_tracker(self, fake_sleep):
+        """``_pause`` waits on inventory changes when the inventory is tracked incrementally"""
+        fake_tracker = MagicMock()
+        worker._pause(7, fake_tracker)
+
+        fake_tracker.update.assert_called_with(max_wait=7)
+        self.assertFalse(fake_sleep.called)
+
+
+@patch.object(worker, 'InventoryTracker')
+@patch.object(worker, 'vCenter')
+class TestConnectVcenter(unittest.TestCase):
+    """A suite of test cases for the ``_connect_vcenter`` function"""
+    @patch.object(worker, 'const')
+    def test_full(self, fake_const, fake_vCenter, fake_InventoryTracker):
+        """``_connect_vcenter`` doesn't track the inventory in 'full' mode"""
+        fake_const.QUOTA_INVENTORY_MODE = 'full'
+
+        vcenter, tracker = worker._connect_vcenter()
+
+        self.assertTrue(vcenter is fake_vCenter.return_value)
+        self.assertTrue(tracker is None)
+
+    @patch.object(worker, 'const')
+    def test_incremental(self, fake_const, fake_vCenter, fake_InventoryTracker):
+        """``_connect_vcenter`` loads the whole inventory in 'incremental' mode"""
+        fake_const.QUOTA_INVENTORY_MODE = 'incremental'
+
+        vcenter, tracker = worker._connect_vcenter()
+
+        self.assertTrue(tracker is fake_InventoryTracker.return_value)
+        fake_InventoryTracker.return_value.update.assert_called_with()
+
+    @patch.object(worker, 'const')
+    def test_incremental_error(self, fake_const, fake_vCenter, fake_InventoryTracker):
+        """``_connect_vcenter`` ends the new session if loading the inventory fails"""
+        fake_const.QUOTA_INVENTORY_MODE = 'incremental'
+        fake_InventoryTracker.return_value.update.side_effect = worker.vim.fault.NotAuthenticated()
+
+        with self.assertRaises(worker.vim.fault.NotAuthenticated):
+            worker._connect_vcenter()
+
+        self.assertTrue(fake_vCenter.return_value.close.called)
+
+
+@patch.object(worker, 'log', MagicMock())
+@patch.object(worker, '_connect_vcenter')
+class TestReconnectVcenter(unittest.TestCase):
+    """A suite of test cases for the ``_reconnect_vcenter`` function"""
+    def test_reconnects(self, fake_connect_vcenter):
+        """``_reconnect_vcenter`` closes the old session and tracker, and returns new ones"""
+        fake_vcenter, fake_tracker = MagicMock(), MagicMock()
+        fake_connect_vcenter.return_value = ('new vcenter', 'new tracker')
+
+        result = worker._reconnect_vcenter(fake_vcenter, fake_tracker)
+
+        self.assertEqual(result, ('new vcenter', 'new tracker'))
+        self.assertTrue(fake_tracker.close.called)
+        self.assertTrue(fake_vcenter.close.called)
+
+    def test_close_error(self, fake_connect_vcenter):
+        """``_reconnect_vcenter`` still reconnects if closing the dead session fails"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.close.side_effect = ConnectionResetError('testing')
+        fake_connect_vcenter.return_value = ('new vcenter', None)
+
+        result = worker._reconnect_vcenter(fake_vcenter, None)
+
+        self.assertEqual(result, ('new vcenter', None))
+
+    def test_unreachable(self, fake_connect_vcenter):
+        """``_reconnect_vcenter`` returns the old session if vCenter is still unreachable"""
+        fake_vcenter, fake_tracker = MagicMock(), MagicMock()
+        fake_connect_vcenter.side_effect = ConnectionRefusedError('testing')
+
+        result = worker._reconnect_vcenter(fake_vcenter, fake_tracker)
+
+        self.assertEqual(result, (fake_vcenter, fake_tracker))
+
+
+class TestFailedBackend(unittest.TestCase):
+    """A suite of test cases for the ``_failed_backend`` function"""
+    def test_db(self):
+        """``_failed_backend`` blames the database for DatabaseError"""
+        self.assertEqual(worker._failed_backend(worker.DatabaseError('testing', pgcode=None)), 'db')
+
+    def test_ldap(self):
+        """``_failed_backend`` blames LDAP for ldap3 errors"""
+        self.assertEqual(worker._failed_backend(worker.LDAPException('testing')), 'ldap')
+
+    def test_smtp(self):
+        """``_failed_backend`` blames SMTP for smtplib errors"""
+        self.assertEqual(worker._failed_backend(worker.smtplib.SMTPServerDisconnected('testing')), 'smtp')
+
+    def test_vlab_api(self):
+        """``_failed_backend`` blames the vLab API for requests errors"""
+        self.assertEqual(worker._failed_backend(worker.requests.exceptions.ConnectionError('testing')), 'vlab_api')
+
+    def test_vcenter(self):
+        """``_failed_backend`` blames vCenter for pyVmomi faults"""
+        self.assertEqual(worker._failed_backend(worker.vim.fault.NotAuthenticated()), 'vcenter')
+
+    def test_network(self):
+        """``_failed_backend`` blames the network for bare socket errors"""
+        self.assertEqual(worker._failed_backend(ConnectionResetError('testing')), 'network')
+
+    def test_not_backend_errors(self):
+        """``BACKEND_ERRORS`` excludes local OSErrors, like a missing file"""
+        self.assertFalse(isinstance(FileNotFoundError('testing'), worker.BACKEND_ERRORS))
+        self.assertFalse(isinstance(PermissionError('testing'), worker.BACKEND_ERRORS))
+
+
+class TestNextGraceExpiry(unittest.TestCase):
+    """A suite of test cases for the ``_next_grace_expiry`` function"""
+    @patch.object(worker.time, 'time')
+    def test_soonest(self, fake_time):
+        """``_next_grace_expiry`` returns the soonest grace period to expire"""
+        fake_time.return_value = 1000
+
+        expiry = worker._next_grace_expiry({'bob': (900, 900), 'sam': (950, 950)})
+
+        self.assertEqual(expiry, 900 + worker.const.QUOTA_GRACE_PERIOD)
+
+    @patch.object(worker.time, 'time')
+    def test_ignores_expired(self, fake_time):
+        """``_next_grace_expiry`` ignores grace periods that already expired"""
+        fake_time.return_value = 1000 + worker.const.QUOTA_GRACE_PERIOD
+
+        expiry = worker._next_grace_expiry({'bob': (900, 900)})
+
+        self.assertTrue(expiry is None)
+
+    def test_no_violators(self):
+        """``_next_grace_expiry`` returns None when there are no violators"""
+        expiry = worker._next_grace_expiry({})
+
+        self.assertTrue(expiry is None)
+
+
+class TestGetMailer(unittest.TestCase):
+    """A suite of test cases for the ``_get_mailer`` function"""
+    @patch.object(worker, 'const')
+    def test_outbox(self, fake_const):
+        """``_get_mailer`` queues emails in the outbox by default"""
+        fake_const.QUOTA_EMAIL_DELIVERY = 'outbox'
+        mailer = worker._get_mailer(MagicMock())
+
+        self.assertTrue(isinstance(mailer, worker.Outbox))
+
+    @patch.object(worker, 'const')
+    def test_direct(self, fake_const):
+        """``_get_mailer`` can send emails directly"""
+        fake_const.QUOTA_EMAIL_DELIVERY = 'direct'
+        mailer = worker._get_mailer(MagicMock())
+
+        self.assertTrue(isinstance(mailer, worker.notify.Mailer))
+
 
 class TestCleanupReconciledUsers(unittest.TestCase):
     """A suite of test cases for the ``_cleanup_reconciled_users`` function"""
-    def test_initial_state(self):
-        """``_cleanup_reconciled_users`` Makes no DB calls when no previous violators exist"""
+    def test_reconciles(self):
+        """``_cleanup_reconciled_users`` keeps only the records of users currently exceeding their quota"""
         fake_db = MagicMock()
-        current_users_in_violation = {'bob', 'jill'}
-        users_in_violation = set()
-        worker._cleanup_reconciled_users(current_users_in_violation, users_in_violation, fake_db)
+        current_users_in_violation = {'bob'}
+        worker._cleanup_reconciled_users(current_users_in_violation, fake_db)
 
+        fake_db.reconcile_users.assert_called_with({'bob'})
         self.assertFalse(fake_db.remove_user.called)
 
-    def test_good_user(self):
-        """``_cleanup_reconciled_users`` Makes no DB calls when no previous violators exist"""
+    def test_sharded(self):
+        """``_cleanup_reconciled_users`` only removes the records of users in the shards this worker owns"""
         fake_db = MagicMock()
-        current_users_in_violation = {'bob'}
-        users_in_violation = {'bob', 'jill'}
-        worker._cleanup_reconciled_users(current_users_in_violation, users_in_violation, fake_db)
+        fake_db.iter_violations.return_value = [('bob', 1, 1), ('lisa', 1, 1), ('sam', 1, 1)]
+        fake_shards = MagicMock()
+        fake_shards.owns.side_effect = lambda user: user != 'sam'
 
-        the_args, _ = fake_db.remove_user.call_args
-        removed_user = the_args[0]
-        expected = 'jill'
+        worker._cleanup_reconciled_users({'bob'}, fake_db, fake_shards)
 
-        self.assertEqual(removed_user, expected)
+        fake_db.remove_users.assert_called_with(['lisa'])
+        self.assertFalse(fake_db.reconcile_users.called)
 
+    def test_records_reconciled(self):
+        """``_cleanup_reconciled_users`` records every user that got back under their quota"""
+        fake_db = MagicMock()
+        fake_db.reconcile_users.return_value = ['lisa']
+        event_log = MagicMock()
 
+        worker._cleanup_reconciled_users({'bob'}, fake_db, event_log=event_log)
+
+        event_log.record.assert_called_once_with('lisa', worker.events.RECONCILED)
+
+
+@patch.object(worker, '_cleanup_reconciled_users')
+@patch.object(worker, '_enforce_quotas')
+@patch.object(worker, '_resolve_deletions')
+class TestRunCycle(unittest.TestCase):
+    """A suite of test cases for the ``_run_cycle`` function"""
+    def test_rebalances(self, fake_resolve_deletions, fake_enforce_quotas, fake_cleanup_reconciled_users):
+        """``_run_cycle`` rebalances the shards, keeping the ones with VM deletions in flight"""
+        fake_enforce_quotas.return_value = {}
+        fake_task_tracker = MagicMock()
+        fake_task_tracker.groups.return_value = {'bob'}
+        fake_shards = MagicMock()
+
+        worker._run_cycle(MagicMock(), MagicMock(), MagicMock(), None, fake_task_tracker, fake_shards)
+
+        fake_shards.rebalance.assert_called_with(keep={'bob'})
+        self.assertTrue(fake_enforce_quotas.call_args[0][6] is fake_shards)
+
+    def test_reuses_violators_info(self, fake_resolve_deletions, fake_enforce_quotas, fake_cleanup_reconciled_users):
+        """``_run_cycle`` finds the next grace period to expire without querying the database again"""
+        fake_enforce_quotas.return_value = {'bob': (int(time.time()), 0)}
+        fake_db = MagicMock()
+
+        violators, next_expiry = worker._run_cycle(MagicMock(), fake_db, MagicMock(), None, MagicMock())
+
+        self.assertEqual(violators, {'bob'})
+        self.assertTrue(next_expiry is not None)
+        self.assertFalse(fake_db.users_info.called)
+
+    @patch.object(worker, 'EventLog')
+    @patch.object(worker, 'const')
+    def test_no_history(self, fake_const, fake_EventLog, fake_resolve_deletions, fake_enforce_quotas, fake_cleanup_reconciled_users):
+        """``_run_cycle`` doesn't record the quota history unless it's turned on"""
+        fake_const.QUOTA_EVENT_HISTORY = 'off'
+        fake_enforce_quotas.return_value = {}
+
+        worker._run_cycle(MagicMock(), MagicMock(), MagicMock(), None, MagicMock())
+
+        self.assertFalse(fake_EventLog.called)
+        self.assertTrue(fake_enforce_quotas.call_args[0][7] is None)
+
+    @patch.object(worker, 'EventLog')
+    @patch.object(worker, 'const')
+    def test_history_on_error(self, fake_const, fake_EventLog, fake_resolve_deletions, fake_enforce_quotas, fake_cleanup_reconciled_users):
+        """``_run_cycle`` records the quota history, even when the cycle is cut short"""
+        fake_const.QUOTA_EVENT_HISTORY = 'on'
+        fake_enforce_quotas.side_effect = worker.DatabaseError('testing', pgcode=None)
+
+        with self.assertRaises(worker.DatabaseError):
+            worker._run_cycle(MagicMock(), MagicMock(), MagicMock(), None, MagicMock())
+
+        self.assertTrue(fake_EventLog.return_value.flush.called)
+
+    def test_shard_error(self, fake_resolve_deletions, fake_enforce_quotas, fake_cleanup_reconciled_users):
+        """``_run_cycle`` doesn't enforce quotas if it's unknown which shards this worker owns"""
+        fake_shards = MagicMock()
+        fake_shards.rebalance.side_effect = worker.DatabaseError('testing', pgcode=None)
+
+        with self.assertRaises(worker.DatabaseError):
+            worker._run_cycle(MagicMock(), MagicMock(), MagicMock(), None, MagicMock(), fake_shards)
+
+        self.assertFalse(fake_enforce_quotas.called)
+
+
+@patch.object(worker.metrics, 'serve', MagicMock())
+@patch.object(worker, 'OutboxSender', MagicMock())
+@patch.object(worker, '_resolve_deletions', MagicMock())
+@patch.object(worker, 'InventoryTracker')
 @patch.object(worker, '_enforce_quotas')
 @patch.object(worker, 'Database')
 @patch.object(worker, '_get_ldap_conn')
 @patch.object(worker, 'vCenter')
 @patch.object(worker, 'log')
-@patch.object(worker.time, 'sleep')
+@patch.object(worker, '_pause')
 class TestMain(unittest.TestCase):
     """A suite of test cases for the ``main`` function"""
     # Raising RuntimeError in the test allows for the test to break the
     # while True loop of ``main``.
 
-    def notest_enforce_quotas(self, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_enforce_quotas(self, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` calls ``_enforce_quotas``"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         try:
@@ -264,7 +888,7 @@ class TestMain(unittest.TestCase):
         self.assertTrue(fake_enforce_quotas.called)
 
     @patch.object(worker.time, 'time')
-    def notest_loop_sleep_positive(self, fake_time, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_loop_sleep_positive(self, fake_time, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` sleeps for a positive value between zero and LOOP_INTERVAL"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         loop_takes = int(worker.LOOP_INTERVAL / 2 ) + 100
@@ -281,13 +905,11 @@ class TestMain(unittest.TestCase):
 
         self.assertTrue(postive_sleep)
 
-    @patch.object(worker.time, 'time')
-    def test_loop_sleep_negitive(self, fake_time, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
-        """``main`` the sleep at the end of the loop is always positive, even if the clock moves backwards"""
+    @patch.object(worker, 'Scheduler')
+    def test_pauses_for_scheduler(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` pauses for as long as the scheduler says to"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
-        loop_takes = int(worker.LOOP_INTERVAL * 2 ) + 100
-        # Need 4 to mock until the sleep side_effect
-        fake_time.side_effect = [100, 95, 85, 75]
+        fake_Scheduler.return_value.finish_cycle.return_value = 4.2
         try:
             worker.main()
         except RuntimeError as doh:
@@ -296,12 +918,134 @@ class TestMain(unittest.TestCase):
             else:
                 raise
         first_sleep = fake_sleep.call_args_list[0][0][0]
-        expected = 10
 
-        self.assertEqual(first_sleep, expected)
+        self.assertEqual(first_sleep, 4.2)
+
+    @patch.object(worker, 'const')
+    def test_bad_victim_policy(self, fake_const, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` refuses to start with an unknown victim policy"""
+        fake_const.QUOTA_VICTIM_POLICY = 'doh'
+
+        with self.assertRaises(ValueError):
+            worker.main()
+
+        self.assertFalse(fake_vCenter.called)
+
+    @patch.object(worker, 'Scheduler')
+    def test_backend_error(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` keeps running, and backs off, when a backend has an error"""
+        fake_sleep.side_effect = [RuntimeError('testing')]
+        fake_enforce_quotas.side_effect = worker.DatabaseError('testing', pgcode=None)
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+
+        fake_Scheduler.return_value.failed.assert_called_with('db')
+        self.assertFalse(fake_Scheduler.return_value.succeeded.called)
+
+    @patch.object(worker, 'Scheduler')
+    def test_pause_error(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` keeps running, and backs off, when vCenter has an error while waiting for the next cycle"""
+        fake_sleep.side_effect = [worker.vim.fault.NotAuthenticated(), RuntimeError('testing')]
+        fake_Scheduler.return_value.delay.return_value = 60
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+        backoff = fake_sleep.call_args_list[1][0][0]
+
+        fake_Scheduler.return_value.failed.assert_called_with('vcenter')
+        self.assertEqual(backoff, 60)
+
+    @patch.object(worker, 'Scheduler')
+    def test_pause_error_reconnects(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` logs into vCenter again when the session fails while waiting for the next cycle"""
+        fake_sleep.side_effect = [worker.vim.fault.NotAuthenticated(), RuntimeError('testing')]
+        fake_Scheduler.return_value.delay.return_value = 60
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+
+        self.assertEqual(fake_vCenter.call_count, 2)
+        self.assertTrue(fake_vCenter.return_value.close.called)
+
+    @patch.object(worker, 'Scheduler')
+    def test_vcenter_error_reconnects(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` logs into vCenter again when a cycle fails on a vCenter error"""
+        fake_sleep.side_effect = [RuntimeError('testing')]
+        fake_enforce_quotas.side_effect = worker.vim.fault.NotAuthenticated()
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+
+        self.assertEqual(fake_vCenter.call_count, 2)
+
+    @patch.object(worker, 'Scheduler')
+    def test_other_backend_keeps_vcenter(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` keeps the vCenter session when a different backend fails"""
+        fake_sleep.side_effect = [RuntimeError('testing')]
+        fake_enforce_quotas.side_effect = worker.DatabaseError('testing', pgcode=None)
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+
+        self.assertEqual(fake_vCenter.call_count, 1)
+
+    @patch.object(worker, 'Scheduler')
+    def test_min_interval(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` keeps cycles at least the min interval apart, even if the wait ended early"""
+        fake_sleep.side_effect = [None, RuntimeError('testing')]
+        fake_Scheduler.return_value.min_delay.return_value = 3
+        try:
+            worker.main()
+        except RuntimeError as doh:
+            if '{}'.format(doh) == 'testing':
+                pass
+            else:
+                raise
+        min_wait = fake_sleep.call_args_list[1][0][0]
+
+        self.assertEqual(min_wait, 3)
+
+    @patch.object(worker, 'Scheduler')
+    def test_other_error(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` does not hide errors that aren't from a backend"""
+        fake_enforce_quotas.side_effect = TypeError('testing')
+
+        with self.assertRaises(TypeError):
+            worker.main()
+
+    @patch.object(worker, 'Scheduler')
+    def test_local_os_error(self, fake_Scheduler, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
+        """``main`` does not back off on an OSError that isn't from the network, like a missing file"""
+        fake_enforce_quotas.side_effect = FileNotFoundError('testing')
+
+        with self.assertRaises(FileNotFoundError):
+            worker.main()
+
+        self.assertFalse(fake_Scheduler.return_value.failed.called)
 
     @patch.object(worker.time, 'time')
-    def notest_loop_sleep_zero(self, fake_time, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_loop_sleep_zero(self, fake_time, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` doesn't pause if enforcing quotas takes longer than the loop interval"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         loop_takes = int(worker.LOOP_INTERVAL * 2 ) + 100
@@ -320,7 +1064,7 @@ class TestMain(unittest.TestCase):
         self.assertEqual(first_sleep, expected)
 
     @patch.object(worker.atexit, 'register')
-    def notest_closes_vcenter(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_closes_vcenter(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` closes vCenter connection when the script exits"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         try:
@@ -337,7 +1081,7 @@ class TestMain(unittest.TestCase):
         self.assertTrue(closes_vcenter)
 
     @patch.object(worker.atexit, 'register')
-    def notest_closes_db(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_closes_db(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` closes Database connection when the script exits"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         try:
@@ -354,7 +1098,7 @@ class TestMain(unittest.TestCase):
         self.assertTrue(closes_db)
 
     @patch.object(worker.atexit, 'register')
-    def notest_closes_ldap(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas):
+    def notest_closes_ldap(self, fake_register, fake_sleep, fake_log, fake_vCenter, fake_get_ldap_conn, fake_Database, fake_enforce_quotas, fake_InventoryTracker):
         """``main`` closes LDAP connection when the script exits"""
         fake_sleep.side_effect = [None, RuntimeError('testing')]
         try:
@@ -0,0 +1,25 @@
+#!/bin/sh
+set -e
+
+# Add the tables that newer versions of vLab Quota use to an existing quota
+# database; setup-db.sh only runs when the database is first created.
+# Safe to run more than once. Run it before setting QUOTA_EMAIL_DELIVERY=outbox
+# or QUOTA_EVENT_HISTORY=on.
+psql -v ON_ERROR_STOP=1 --username ${POSTGRES_USER} --dbname quota <<-EOSQL
+  CREATE TABLE IF NOT EXISTS quota_outbox(
+    id BIGSERIAL PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    mail TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt BIGINT NOT NULL,
+    created BIGINT NOT NULL
+  );
+  CREATE INDEX IF NOT EXISTS quota_outbox_next_attempt ON quota_outbox (next_attempt);
+  CREATE TABLE IF NOT EXISTS quota_events(
+    created BIGINT NOT NULL,
+    username TEXT NOT NULL,
+    event TEXT NOT NULL,
+    vms INTEGER NOT NULL DEFAULT 0
+  );
+  CREATE INDEX IF NOT EXISTS quota_events_created ON quota_events USING BRIN (created);
+EOSQL
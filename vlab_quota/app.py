@@ -4,11 +4,15 @@ from flask import Flask
 from vlab_quota.libs import const
 from vlab_quota.libs.views import HealthView
 from vlab_quota.libs.views import QuotaView
+from vlab_quota.libs.views import ViolationsView
+from vlab_quota.libs.views import EventsView
 
 app = Flask(__name__)
 
 QuotaView.register(app)
 HealthView.register(app)
+ViolationsView.register(app)
+EventsView.register(app)
 
 
 if __name__ == '__main__':
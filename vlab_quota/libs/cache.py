@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+"""A small, thread-safe, in-memory cache"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A least-recently-used cache, where entries also expire after a while.
+
+    :param maxsize: The most entries to keep; the least recently used are evicted first.
+    :type maxsize: Integer
+
+    :param ttl: How long (in seconds) an entry is valid for.
+    :type ttl: Integer
+    """
+    def __init__(self, maxsize, ttl):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        """Lookup an entry.
+
+        :Returns: Object
+
+        :param key: The entry to lookup
+        :type key: Object
+
+        :param default: What to return if the entry is missing or expired
+        :type default: Object
+        """
+        now = time.monotonic()
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+            if now >= expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Add or replace an entry.
+
+        :Returns: None
+
+        :param key: The name of the entry
+        :type key: Object
+
+        :param value: The data to cache
+        :type value: Object
+        """
+        expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """Remove an entry, if it exists.
+
+        :Returns: None
+
+        :param key: The entry to remove
+        :type key: Object
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every entry.
+
+        :Returns: None
+        """
+        with self._lock:
+            self._data.clear()
@@ -22,13 +22,31 @@ DEFINED = OrderedDict([
             ('INF_VCENTER_USER', environ.get('INF_VCENTER_USER', 'tester')),
             ('INF_VCENTER_PASSWORD', environ.get('INF_VCENTER_PASSWORD', 'a')),
             ('INF_VCENTER_TOP_LVL_DIR', environ.get('INF_VCENTER_TOP_LVL_DIR', '/vlab')),
+            ('QUOTA_INVENTORY_MODE', environ.get('QUOTA_INVENTORY_MODE', 'full')), # or 'incremental'
             ('DB_USER', environ.get('DB_USER', 'postgres')),
             ('DB_PASSWORD', environ.get('DB_PASSWORD', 'testing')),
             ('DB_DATABASE_NAME', environ.get('DB_DATABASE_NAME', 'quota')),
             ('DB_HOST', environ.get('DB_HOST', 'quota-db')),
+            ('DB_POOL_MIN', int(environ.get('DB_POOL_MIN', 1))),
+            ('DB_POOL_MAX', int(environ.get('DB_POOL_MAX', 10))),
+            ('DB_POOL_TIMEOUT', float(environ.get('DB_POOL_TIMEOUT', 5))), # seconds
+            ('QUOTA_API_CACHE_SIZE', int(environ.get('QUOTA_API_CACHE_SIZE', 10000))),
+            ('QUOTA_API_CACHE_TTL', int(environ.get('QUOTA_API_CACHE_TTL', 300))), # seconds
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
             ('VLAB_QUOTA_LIMIT', int(environ.get('VLAB_QUOTA_LIMIT', 30))),
+            ('QUOTA_ADMINS', [x for x in environ.get('QUOTA_ADMINS', '').split(',') if x]), # comma-separated usernames
             ('QUOTA_GRACE_PERIOD', int(environ.get('QUOTA_GRACE_PERIOD', 1209600))), # 2 weeks, in seconds
+            ('QUOTA_DELETE_WORKERS', int(environ.get('QUOTA_DELETE_WORKERS', 4))),
+            ('QUOTA_NOTIFY_WORKERS', int(environ.get('QUOTA_NOTIFY_WORKERS', 8))),
+            ('QUOTA_USER_DELETE_WORKERS', int(environ.get('QUOTA_USER_DELETE_WORKERS', 4))),
+            ('QUOTA_MAX_INFLIGHT_DELETES', int(environ.get('QUOTA_MAX_INFLIGHT_DELETES', 10))),
+            ('QUOTA_VICTIM_POLICY', environ.get('QUOTA_VICTIM_POLICY', 'random')), # or oldest, powered-off-first, largest-first
+            ('QUOTA_TASK_TIMEOUT', int(environ.get('QUOTA_TASK_TIMEOUT', 1200))), # in seconds
+            ('QUOTA_TASK_MAX_BACKOFF', int(environ.get('QUOTA_TASK_MAX_BACKOFF', 30))),
+            ('QUOTA_HTTP_CONNECT_TIMEOUT', float(environ.get('QUOTA_HTTP_CONNECT_TIMEOUT', 5))),
+            ('QUOTA_HTTP_READ_TIMEOUT', float(environ.get('QUOTA_HTTP_READ_TIMEOUT', 60))),
+            ('QUOTA_HTTP_POOL_HOSTS', int(environ.get('QUOTA_HTTP_POOL_HOSTS', 50))),
+            ('QUOTA_HTTP_POOL_SIZE', int(environ.get('QUOTA_HTTP_POOL_SIZE', 10))),
             ('QUOTA_EMAIL_SERVER', environ.get('QUOTA_EMAIL_SERVER', 'localhost')),
             ('QUOTA_EMAIL_FROM_DOMAIN', 'noreply@{}'.format(environ.get('QUOTA_EMAIL_FROM_DOMAIN', 'vlab.local'))),
             ('QUOTA_EMAIL_BCC', environ.get('QUOTA_EMAIL_BCC', '')),
@@ -36,13 +54,38 @@ DEFINED = OrderedDict([
             ('QUOTA_EMAIL_SSL_VERIFY', environ.get('QUOTA_EMAIL_SSL_VERIFY', False)),
             ('QUOTA_EMAIL_USERNAME', environ.get('QUOTA_EMAIL_USERNAME', '')),
             ('QUOTA_EMAIL_PASSWORD', environ.get('QUOTA_EMAIL_PASSWORD', '')),
+            ('QUOTA_EMAIL_DELIVERY', environ.get('QUOTA_EMAIL_DELIVERY', 'direct')), # or 'outbox'; needs the quota_outbox table
+            ('QUOTA_EVENT_HISTORY', environ.get('QUOTA_EVENT_HISTORY', 'off')), # or 'on'; needs the quota_events table
+            ('QUOTA_OUTBOX_SENDERS', int(environ.get('QUOTA_OUTBOX_SENDERS', 4))),
+            ('QUOTA_OUTBOX_BATCH_SIZE', int(environ.get('QUOTA_OUTBOX_BATCH_SIZE', 100))),
+            ('QUOTA_OUTBOX_MAX_ATTEMPTS', int(environ.get('QUOTA_OUTBOX_MAX_ATTEMPTS', 10))),
+            ('QUOTA_OUTBOX_MAX_BACKOFF', int(environ.get('QUOTA_OUTBOX_MAX_BACKOFF', 3600))), # seconds
+            ('QUOTA_OUTBOX_LEASE', int(environ.get('QUOTA_OUTBOX_LEASE', 300))), # seconds
             ('AUTH_TOKEN_VERSION', int(environ.get('AUTH_TOKEN_VERSION', 2))),
             ('AUTH_PRIVATE_KEY_LOCATION', environ.get('AUTH_PRIVATE_KEY_LOCATION', '/etc/vlab/auth_private.key')),
             ('AUTH_TOKEN_ALGORITHM', environ.get('AUTH_TOKEN_ALGORITHM', 'HS256')),
+            ('QUOTA_TOKEN_REFRESH_MARGIN', int(environ.get('QUOTA_TOKEN_REFRESH_MARGIN', 120))), # seconds
             ('AUTH_BIND_USER', environ.get('AUTH_BIND_USER', 'noone')),
             ('AUTH_BIND_PASSWORD_LOCATION', environ.get('AUTH_BIND_PASSWORD', '/etc/vlab/ldap_creds.txt')),
             ('AUTH_SEARCH_BASE', environ.get('AUTH_SEARCH_BASE', 'DC=localhost,DC=local')),
             ('AUTH_LDAP_URL', environ.get('AUTH_LDAP_URL', 'ldaps://localhost')),
+            ('QUOTA_EMAIL_CACHE_SIZE', int(environ.get('QUOTA_EMAIL_CACHE_SIZE', 10000))),
+            ('QUOTA_EMAIL_CACHE_TTL', int(environ.get('QUOTA_EMAIL_CACHE_TTL', 3600))), # seconds
+            ('QUOTA_EMAIL_MISS_TTL', int(environ.get('QUOTA_EMAIL_MISS_TTL', 900))), # seconds
+            ('QUOTA_LDAP_POOL_SIZE', int(environ.get('QUOTA_LDAP_POOL_SIZE', 4))),
+            ('QUOTA_LDAP_POOL_TIMEOUT', int(environ.get('QUOTA_LDAP_POOL_TIMEOUT', 30))), # seconds
+            ('QUOTA_LDAP_MAX_IDLE', int(environ.get('QUOTA_LDAP_MAX_IDLE', 300))), # seconds
+            ('QUOTA_LDAP_PROBE_IDLE', int(environ.get('QUOTA_LDAP_PROBE_IDLE', 30))), # seconds
+            ('QUOTA_LDAP_TIMEOUT', int(environ.get('QUOTA_LDAP_TIMEOUT', 10))), # seconds
+            ('QUOTA_METRICS_PORT', int(environ.get('QUOTA_METRICS_PORT', 9100))), # 0 to disable
+            ('QUOTA_TRACE_FILE', environ.get('QUOTA_TRACE_FILE', '')), # empty to disable
+            ('QUOTA_LOOP_MIN_INTERVAL', float(environ.get('QUOTA_LOOP_MIN_INTERVAL', 2))), # seconds
+            ('QUOTA_LOOP_MAX_INTERVAL', float(environ.get('QUOTA_LOOP_MAX_INTERVAL', 60))), # seconds
+            ('QUOTA_LOOP_MAX_BACKOFF', float(environ.get('QUOTA_LOOP_MAX_BACKOFF', 300))), # seconds
+            ('QUOTA_LOOP_JITTER', float(environ.get('QUOTA_LOOP_JITTER', 0.1))), # fraction of the delay
+            ('QUOTA_WORKER_MODE', environ.get('QUOTA_WORKER_MODE', 'single')), # single or sharded
+            ('QUOTA_SHARD_COUNT', int(environ.get('QUOTA_SHARD_COUNT', 256))), # same on every worker
+            ('QUOTA_SHARD_VNODES', int(environ.get('QUOTA_SHARD_VNODES', 64))), # ring points per worker
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
@@ -1,9 +1,86 @@
 # -*- coding: UTF-8 -*-
 """Abstracts the database and SQL"""
+import os
+import time
+import threading
+
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from vlab_api_common import get_logger
 
-from vlab_quota.libs import const
+from vlab_quota.libs import const, metrics, tracing
+
+BATCH_SIZE = 500 # rows per multi-row VALUES statement
+# Every change to a user's quota_violations row is announced here, with the username as the payload
+NOTIFY_CHANNEL = 'quota_violations'
+# The first key of the (two key) advisory locks used to shard work between workers
+MEMBER_LOCK_SPACE = 0x51554f01 # held by each worker, for as long as it's connected
+SHARD_LOCK_SPACE = 0x51554f02 # held by the worker that owns the shard
+# Process-wide connection pools, keyed by the connection parameters
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+_UPSERT_USERS_SQL = """WITH changed AS (
+                          INSERT INTO quota_violations (username, triggered, last_notified)
+                          VALUES %s
+                          ON CONFLICT (username)
+                          DO UPDATE SET
+                             (triggered, last_notified)
+                             = (EXCLUDED.triggered, EXCLUDED.last_notified)
+                          RETURNING username
+                       )
+                       SELECT pg_notify('{}', username) FROM changed;
+""".format(NOTIFY_CHANNEL)
+_ENQUEUE_EMAILS_SQL = """INSERT INTO quota_outbox (recipient, mail, next_attempt, created) VALUES %s;"""
+
+
+def _get_pool(**conn_params):
+    """Obtain the connection pool for this process, creating it if needed.
+
+    The pool is created lazily, and re-created if the process ID changes, so
+    connections are never shared between the uWSGI master and its workers.
+
+    :Returns: Tuple - (psycopg2.pool.ThreadedConnectionPool, threading.BoundedSemaphore)
+
+    :param conn_params: The parameters for ``psycopg2.connect``
+    :type conn_params: Dictionary
+    """
+    key = tuple(sorted(conn_params.items()))
+    pid = os.getpid()
+    with _POOLS_LOCK:
+        pool, slots, owner = _POOLS.get(key, (None, None, None))
+        if owner != pid:
+            # Any pool from before a fork belongs to the parent; don't close
+            # its connections, just stop using them.
+            pool = ThreadedConnectionPool(const.DB_POOL_MIN, const.DB_POOL_MAX, **conn_params)
+            # ThreadedConnectionPool errors immediately when exhausted; the
+            # semaphore lets callers wait (a bounded amount) for a connection.
+            slots = threading.BoundedSemaphore(const.DB_POOL_MAX)
+            _POOLS[key] = (pool, slots, pid)
+    return pool, slots
+
+
+def _outbox_rows(emails):
+    """Convert emails into rows for the outbox table; every email is due now.
+
+    :Returns: List
+
+    :param emails: The (recipient, mail) of each email
+    :type emails: Iterable
+    """
+    now = int(time.time())
+    return [(to, mail, now, now) for to, mail in emails]
+
+
+def _summarize(sql):
+    """Collapse a SQL statement onto one, reasonably short, line for a tracing span.
+
+    :Returns: String
+
+    :param sql: The SQL syntax
+    :type sql: String
+    """
+    return ' '.join(sql.split())[:200]
 
 
 class Database:
@@ -20,21 +97,40 @@ class Database:
 
     :param host: The IP/FQDN of the database server
     :type host: String
+
+    :param pooled: Set to borrow a connection from a process-wide pool, instead
+                   of opening a new one. The connection is returned to the pool
+                   upon ``close``.
+    :type pooled: Boolean
     """
     def __init__(self, user=const.DB_USER, password=const.DB_PASSWORD,
-                 database=const.DB_DATABASE_NAME, host=const.DB_HOST):
+                 database=const.DB_DATABASE_NAME, host=const.DB_HOST, pooled=False):
         self.logger = get_logger(__name__, loglevel=const.QUOTA_LOG_LEVEL)
-        self._connection = psycopg2.connect(database=database,
-                                     host=host,
-                                     user=user,
-                                     password=password)
+        self._pool = None
+        self._slots = None
+        if pooled:
+            self._pool, self._slots = _get_pool(database=database, host=host, user=user, password=password)
+            if not self._slots.acquire(timeout=const.DB_POOL_TIMEOUT):
+                raise DatabaseError(message='Timed out waiting for a database connection', pgcode=None)
+            try:
+                self._connection = self._pool.getconn()
+            except psycopg2.Error as doh:
+                self._slots.release()
+                raise DatabaseError(message=doh.pgerror, pgcode=doh.pgcode)
+        else:
+            self._connection = psycopg2.connect(database=database,
+                                         host=host,
+                                         user=user,
+                                         password=password)
         self._cursor = self._connection.cursor()
+        # The cursor is shared, so threads must take turns using it
+        self._lock = threading.Lock()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        self._connection.close()
+        self.close()
 
     def execute(self, sql, params=None):
         """Run a single SQL command
@@ -47,22 +143,65 @@ class Database:
         :param params: The values to use in a parameterized SQL query
         :type params: Iterable
         """
-        try:
-            self._cursor.execute(sql, params)
-            self._connection.commit()
-        except psycopg2.Error as doh:
-            # All psycopg2 Exceptions are subclassed from psycopg2.Error
-            self._connection.rollback()
-            raise DatabaseError(message=doh.pgerror, pgcode=doh.pgcode)
-        else:
-            if self._cursor.description is None:
-                return []
+        with self._lock, metrics.STAGE_SECONDS.time(stage='db'), tracing.span('Database.execute', sql=_summarize(sql)):
+            try:
+                self._cursor.execute(sql, params)
+                self._connection.commit()
+            except psycopg2.Error as doh:
+                # All psycopg2 Exceptions are subclassed from psycopg2.Error
+                self._connection.rollback()
+                raise DatabaseError(message=doh.pgerror, pgcode=doh.pgcode)
             else:
-                return self._cursor.fetchall()
+                if self._cursor.description is None:
+                    return []
+                else:
+                    return self._cursor.fetchall()
+
+    def execute_values(self, sql, argslist):
+        """Run a single SQL command for many rows of values, i.e. a multi-row
+        ``INSERT ... VALUES %s``.
+
+        :Returns: None
+
+        :param sql: **Required** The SQL syntax to execute; must contain a single ``%s`` for the VALUES
+        :type sql: String
+
+        :param argslist: The rows of values to use
+        :type argslist: Iterable
+        """
+        self.execute_values_many([(sql, argslist)])
+
+    def execute_values_many(self, statements):
+        """Run several ``execute_values`` commands in a single transaction; either
+        every one is committed, or none are.
+
+        :Returns: None
+
+        :param statements: The (sql, argslist) of each command
+        :type statements: List
+        """
+        summary = _summarize('; '.join(x for x, _ in statements))
+        with self._lock, metrics.STAGE_SECONDS.time(stage='db'), tracing.span('Database.execute_values', sql=summary):
+            try:
+                for sql, argslist in statements:
+                    execute_values(self._cursor, sql, argslist, page_size=BATCH_SIZE)
+                self._connection.commit()
+            except psycopg2.Error as doh:
+                self._connection.rollback()
+                raise DatabaseError(message=doh.pgerror, pgcode=doh.pgcode)
 
     def close(self):
-        """Disconnect from the database"""
-        self._connection.close()
+        """Disconnect from the database, or return the connection to the pool"""
+        if self._pool is None:
+            self._connection.close()
+        elif self._slots is not None:
+            # A broken connection is closed by psycopg2; the pool discards it
+            broken = bool(self._connection.closed)
+            if not broken:
+                self._cursor.close()
+            self._pool.putconn(self._connection, close=broken)
+            self._slots.release()
+            self._slots = None
 
     def user_info(self, username):
         """Obtain the EPOCH timestamp when a user exceeded their quota. A value
@@ -73,12 +212,74 @@ class Database:
         :param username: The name of the user
         :type username: String
         """
-        sql = """SELECT triggered, last_notified FROM quota_violations WHERE username LIKE (%s);"""
+        sql = """SELECT triggered, last_notified FROM quota_violations WHERE username = %s;"""
         exceeded_on = self.execute(sql, (username,))
         if exceeded_on:
             return exceeded_on[0] # because it's a list of tuples, i.e. [(12345,)]
         return (0, 0)
 
+    def users_info(self, usernames):
+        """Obtain the quota violation info for many users with a single query.
+        Users without a quota violation are mapped to ``(0, 0)``.
+
+        :Returns: Dictionary - username to (triggered, last_notified)
+
+        :param usernames: The names of the users
+        :type usernames: Iterable
+        """
+        usernames = list(usernames)
+        info = {x: (0, 0) for x in usernames}
+        if not usernames:
+            return info
+        sql = """SELECT username, triggered, last_notified FROM quota_violations WHERE username = ANY(%s);"""
+        for username, triggered, last_notified in self.execute(sql, (usernames,)):
+            info[username] = (triggered, last_notified)
+        return info
+
+    def iter_violations(self, after=None, limit=None, chunk_size=BATCH_SIZE):
+        """Stream the quota violation records, ordered by username.
+
+        Rows are read through a server-side cursor, ``chunk_size`` at a time,
+        so memory use doesn't depend on how many rows there are. Supply the
+        last username you got as ``after`` to fetch the next page.
+
+        :Returns: Generator - (username, triggered, last_notified)
+
+        :Raises: DatabaseError
+
+        :param after: Only return users whose name sorts after this one.
+        :type after: String
+
+        :param limit: The most records to return. Supply None for all of them.
+        :type limit: Integer
+
+        :param chunk_size: How many rows to fetch from the database at a time.
+        :type chunk_size: Integer
+        """
+        sql = """SELECT username, triggered, last_notified FROM quota_violations"""
+        params = []
+        if after is not None:
+            sql += """ WHERE username > %s"""
+            params.append(after)
+        sql += """ ORDER BY username"""
+        if limit is not None:
+            sql += """ LIMIT %s"""
+            params.append(limit)
+        with self._lock:
+            # A named cursor lives on the server
+            cursor = self._connection.cursor(name='quota_violations_stream')
+            cursor.itersize = chunk_size
+            try:
+                cursor.execute(sql, params)
+                for row in cursor:
+                    yield row
+            except psycopg2.Error as doh:
+                raise DatabaseError(message=doh.pgerror, pgcode=doh.pgcode)
+            finally:
+                # ends the transaction the server-side cursor needed
+                if not self._connection.closed:
+                    self._connection.rollback()
+
     def remove_user(self, username):
         """Remove a user from the violations database
 
@@ -87,8 +288,41 @@ class Database:
         :param username: The name of the user
         :type username: String
         """
-        sql = """DELETE FROM quota_violations WHERE username LIKE (%s)"""
-        self.execute(sql, (username,))
+        self.remove_users([username])
+
+    def remove_users(self, usernames):
+        """Remove many users from the violations database with a single statement
+
+        :Returns: List - The names of the users that had a record to remove
+
+        :param usernames: The names of the users
+        :type usernames: Iterable
+        """
+        usernames = list(usernames)
+        if not usernames:
+            return []
+        sql = """WITH changed AS (
+                    DELETE FROM quota_violations WHERE username = ANY(%s) RETURNING username
+                 )
+                 SELECT username, pg_notify('{}', username) FROM changed;
+        """.format(NOTIFY_CHANNEL)
+        return [x[0] for x in self.execute(sql, (usernames,))]
+
+    def reconcile_users(self, usernames):
+        """Remove every user from the violations database that is not in the
+        supplied group of users currently exceeding their quota.
+
+        :Returns: List - The names of the users that were removed
+
+        :param usernames: The names of the users currently exceeding their quota
+        :type usernames: Iterable
+        """
+        sql = """WITH changed AS (
+                    DELETE FROM quota_violations WHERE username <> ALL(%s) RETURNING username
+                 )
+                 SELECT username, pg_notify('{}', username) FROM changed;
+        """.format(NOTIFY_CHANNEL)
+        return [x[0] for x in self.execute(sql, (list(usernames),))]
 
     def upsert_user(self, username, violation_date, last_time_notified):
         """Insert or Update a user in the violations database
@@ -104,16 +338,225 @@ class Database:
         :param last_time_notified: The EPOCH timestamp of when the last notification was sent
         :type last_time_notified: Integer
         """
-        sql = """INSERT INTO quota_violations (username, triggered, last_notified)
-                 VALUES (%s, %s, %s)
-                 ON CONFLICT (username)
-                 DO UPDATE SET
-                    (triggered, last_notified)
-                    = (EXCLUDED.triggered, EXCLUDED.last_notified);
-        """
+        sql = """WITH changed AS (
+                    INSERT INTO quota_violations (username, triggered, last_notified)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (username)
+                    DO UPDATE SET
+                       (triggered, last_notified)
+                       = (EXCLUDED.triggered, EXCLUDED.last_notified)
+                    RETURNING username
+                 )
+                 SELECT pg_notify('{}', username) FROM changed;
+        """.format(NOTIFY_CHANNEL)
         # The EXCLUDED keyword lets you access the values passed to INSERT
         self.execute(sql, (username, violation_date, last_time_notified))
 
+    def upsert_users(self, users):
+        """Insert or Update many users in the violations database with a single statement
+
+        :Returns: None
+
+        :param users: The (username, violation_date, last_time_notified) of each user
+        :type users: Iterable
+        """
+        users = list(users)
+        if not users:
+            return
+        self.execute_values(_UPSERT_USERS_SQL, users)
+
+    def enqueue_emails(self, emails):
+        """Add many emails to the outbox with a single statement
+
+        :Returns: None
+
+        :param emails: The (recipient, mail) of each email
+        :type emails: Iterable
+        """
+        emails = _outbox_rows(emails)
+        if not emails:
+            return
+        self.execute_values(_ENQUEUE_EMAILS_SQL, emails)
+
+    def enqueue_warnings(self, emails, users):
+        """Add many emails to the outbox, and insert or update the users they
+        warn, in a single transaction. Otherwise a warning could be queued but
+        never recorded, and it would be sent again by the next loop.
+
+        :Returns: None
+
+        :param emails: The (recipient, mail) of each email
+        :type emails: Iterable
+
+        :param users: The (username, violation_date, last_time_notified) of each user
+        :type users: Iterable
+        """
+        statements = [(_ENQUEUE_EMAILS_SQL, _outbox_rows(emails)), (_UPSERT_USERS_SQL, list(users))]
+        statements = [x for x in statements if x[1]]
+        if not statements:
+            return
+        self.execute_values_many(statements)
+
+    def claim_emails(self, limit, lease):
+        """Claim emails from the outbox that are due to be sent.
+
+        Claimed emails are hidden from other callers for ``lease`` seconds, so
+        an email is sent again if whoever claimed it dies before finishing.
+
+        :Returns: List - (id, recipient, mail, attempts)
+
+        :param limit: The most emails to claim.
+        :type limit: Integer
+
+        :param lease: How long (in seconds) to hide the emails from other callers.
+        :type lease: Integer
+        """
+        now = int(time.time())
+        sql = """UPDATE quota_outbox SET next_attempt = %s, attempts = attempts + 1
+                 WHERE id IN (
+                    SELECT id FROM quota_outbox
+                    WHERE next_attempt <= %s
+                    ORDER BY next_attempt
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                 )
+                 RETURNING id, recipient, mail, attempts;
+        """
+        return self.execute(sql, (now + lease, now, limit))
+
+    def delete_emails(self, ids):
+        """Remove many emails from the outbox with a single statement
+
+        :Returns: None
+
+        :param ids: The IDs of the emails
+        :type ids: Iterable
+        """
+        ids = list(ids)
+        if not ids:
+            return
+        sql = """DELETE FROM quota_outbox WHERE id = ANY(%s);"""
+        self.execute(sql, (ids,))
+
+    def retry_emails(self, retries):
+        """Reschedule many emails in the outbox with a single statement
+
+        :Returns: None
+
+        :param retries: The (id, next_attempt) of each email
+        :type retries: Iterable
+        """
+        retries = list(retries)
+        if not retries:
+            return
+        sql = """UPDATE quota_outbox SET next_attempt = retries.next_attempt
+                 FROM (VALUES %s) AS retries (id, next_attempt)
+                 WHERE quota_outbox.id = retries.id;
+        """
+        self.execute_values(sql, retries)
+
+    def record_events(self, events):
+        """Append many events to the quota history with a single statement
+
+        :Returns: None
+
+        :param events: The (created, username, event, vms) of each event
+        :type events: Iterable
+        """
+        events = list(events)
+        if not events:
+            return
+        sql = """INSERT INTO quota_events (created, username, event, vms) VALUES %s;"""
+        self.execute_values(sql, events)
+
+    def event_aggregates(self, start, end, bucket):
+        """Summarize the quota history between two points in time, grouped into
+        fixed-size buckets of time. The BRIN index on ``created`` means only the
+        part of the table within the range is read.
+
+        :Returns: List - (bucket start, event, events, distinct users, VMs), ordered by time
+
+        :param start: The EPOCH timestamp to start at (inclusive)
+        :type start: Integer
+
+        :param end: The EPOCH timestamp to end at (exclusive)
+        :type end: Integer
+
+        :param bucket: How many seconds of history each bucket covers
+        :type bucket: Integer
+        """
+        sql = """SELECT (created / %s) * %s AS bucket, event, count(*), count(DISTINCT username), sum(vms)
+                 FROM quota_events
+                 WHERE created >= %s AND created < %s
+                 GROUP BY bucket, event
+                 ORDER BY bucket, event;
+        """
+        return self.execute(sql, (bucket, bucket, start, end))
+
+    def join_shard_group(self, member):
+        """Try to become a member of the group of workers sharing the work.
+        Membership lasts until the connection closes.
+
+        :Returns: Boolean - False if another worker is already using ``member``
+
+        :param member: The (non-negative, 32 bit) ID of this worker
+        :type member: Integer
+        """
+        sql = """SELECT pg_try_advisory_lock(%s, %s);"""
+        rows = self.execute(sql, (MEMBER_LOCK_SPACE, member))
+        return rows[0][0]
+
+    def shard_group_members(self):
+        """List the members of the group of workers sharing the work.
+
+        :Returns: List
+        """
+        sql = """SELECT objid::bigint FROM pg_locks
+                 WHERE locktype = 'advisory' AND granted AND classid = %s AND objsubid = 2
+                 AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+                 ORDER BY objid;
+        """
+        return [x[0] for x in self.execute(sql, (MEMBER_LOCK_SPACE,))]
+
+    def held_shards(self):
+        """List the shards this connection holds the lock of.
+
+        :Returns: List
+        """
+        sql = """SELECT objid::bigint FROM pg_locks
+                 WHERE locktype = 'advisory' AND granted AND classid = %s AND objsubid = 2
+                 AND pid = pg_backend_pid();
+        """
+        return [x[0] for x in self.execute(sql, (SHARD_LOCK_SPACE,))]
+
+    def lock_shards(self, shards):
+        """Try to lock many shards, without waiting on ones locked by another worker.
+
+        :Returns: List - The shards that were locked
+
+        :param shards: The shards to lock
+        :type shards: Iterable
+        """
+        shards = list(shards)
+        if not shards:
+            return []
+        sql = """SELECT shard FROM unnest(%s::int[]) AS shard WHERE pg_try_advisory_lock(%s, shard);"""
+        return [x[0] for x in self.execute(sql, (shards, SHARD_LOCK_SPACE))]
+
+    def unlock_shards(self, shards):
+        """Unlock many shards, so another worker can take them over.
+
+        :Returns: None
+
+        :param shards: The shards to unlock
+        :type shards: Iterable
+        """
+        shards = list(shards)
+        if not shards:
+            return
+        sql = """SELECT pg_advisory_unlock(%s, shard) FROM unnest(%s::int[]) AS shard;"""
+        self.execute(sql, (SHARD_LOCK_SPACE, shards))
+
 
 class DatabaseError(Exception):
     """Raised when an error occurs when interacting with the database
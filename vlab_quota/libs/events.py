@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+"""Records what quota enforcement did, in the append-only quota_events table.
+
+Unlike quota_violations, which only holds the current state, the history is
+never updated or deleted, so it can answer questions like "how many VMs were
+deleted last month".
+"""
+import time
+import threading
+
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const
+from vlab_quota.libs.database import DatabaseError
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+FIRST_VIOLATION = 'first_violation' # a user exceeded their quota, and was warned for the first time
+WARNED = 'warned'
+DELETED = 'deleted'
+RECONCILED = 'reconciled' # a user got back under their quota, on their own
+EVENTS = (FIRST_VIOLATION, WARNED, DELETED, RECONCILED)
+
+
+class EventLog:
+    """Queues events during an enforcement cycle, and writes them all with a
+    single statement. Using the EventLog as a context manager flushes it
+    upon exit.
+
+    The history is a record of enforcement, not part of it; failing to write
+    it is logged, and never fails the enforcement cycle.
+
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+    """
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # The events still happened, even if the cycle was cut short
+        self.flush()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def record(self, username, event, vms=0):
+        """Queue an event to be written by the next ``flush``. Safe to call
+        from multiple threads.
+
+        :Returns: None
+
+        :Raises: ValueError
+
+        :param username: The user the event is about.
+        :type username: String
+
+        :param event: What happened; one of ``EVENTS``
+        :type event: String
+
+        :param vms: How many VMs were involved, i.e. how many were deleted.
+        :type vms: Integer
+        """
+        if event not in EVENTS:
+            raise ValueError('Unknown quota event {}, must be one of {}'.format(event, EVENTS))
+        with self._lock:
+            self._pending.append((int(time.time()), username, event, vms))
+
+    def flush(self):
+        """Write every queued event to the database with a single statement.
+
+        Returns how many events were written; a database error is logged, and
+        the events are dropped.
+
+        :Returns: Integer
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        try:
+            self._db.record_events(pending)
+        except DatabaseError as doh:
+            log.error('Unable to record %s quota events: %s', len(pending), doh)
+            return 0
+        return len(pending)
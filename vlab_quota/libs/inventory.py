@@ -0,0 +1,279 @@
+# -*- coding: UTF-8 -*-
+"""Bulk queries of the vCenter inventory via the PropertyCollector API"""
+import math
+from collections import namedtuple
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+
+
+VMDetails = namedtuple('VMDetails', 'name component power_state created size')
+
+
+def _children_spec(parent, vimtype, properties):
+    """Build the filter that selects the direct children of a folder, along with
+    the requested properties of those children.
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param parent: The folder whose children to select.
+    :type parent: vim.Folder
+
+    :param vimtype: The category of child object to select.
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+    :param properties: The property paths to retrieve for each child.
+    :type properties: List
+    """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(name='children',
+                                                            type=vim.Folder,
+                                                            path='childEntity',
+                                                            skip=False)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=parent,
+                                                        skip=True, # we only want the children
+                                                        selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=properties)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+
+def _user_folders_spec(top_folder):
+    """Build the filter that selects every user folder directly under the top
+    level vLab directory, along with the properties needed to count VMs.
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param top_folder: The folder that contains all the user folders.
+    :type top_folder: vim.Folder
+    """
+    return _children_spec(top_folder, vim.Folder, ['name', 'childEntity'])
+
+
+def _vm_details_spec(user_folder):
+    """Build the filter that selects every VM in a user's folder, along with the
+    properties needed to choose which VMs to delete.
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param user_folder: The folder that contains the user's VMs.
+    :type user_folder: vim.Folder
+    """
+    return _children_spec(user_folder, vim.VirtualMachine, ['name',
+                                                            'config.annotation',
+                                                            'config.createDate',
+                                                            'runtime.powerState',
+                                                            'summary.storage.committed'])
+
+
+def _to_props(obj_content):
+    """Convert the ``propSet`` of an ObjectContent into a dictionary.
+
+    :Returns: Dictionary
+
+    :param obj_content: A single result from the PropertyCollector.
+    :type obj_content: vmodl.query.PropertyCollector.ObjectContent
+    """
+    return {x.name: x.val for x in obj_content.propSet}
+
+
+def _retrieve(vcenter, spec):
+    """Run a single PropertyCollector retrieval, following the continuation
+    token of paged results.
+
+    :Returns: Generator of Dictionaries
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param spec: Defines what objects and properties to retrieve.
+    :type spec: vmodl.query.PropertyCollector.FilterSpec
+    """
+    collector = vcenter.content.propertyCollector
+    result = collector.RetrievePropertiesEx(specSet=[spec],
+                                            options=vmodl.query.PropertyCollector.RetrieveOptions())
+    while result:
+        for obj_content in result.objects:
+            yield _to_props(obj_content)
+        if not result.token:
+            break
+        # vCenter pages large results; the token fetches the next page
+        result = collector.ContinueRetrievePropertiesEx(token=result.token)
+
+
+def get_vm_counts(vcenter, path=const.INF_VCENTER_TOP_LVL_DIR):
+    """Obtain the number of items within every user folder, via a single
+    PropertyCollector retrieval (instead of one lazy round-trip per folder).
+
+    The count includes the user's defaultGateway.
+
+    :Returns: Dictionary
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param path: The folder that contains all the user folders.
+    :type path: String
+    """
+    top_folder = vcenter.get_vm_folder(path=path)
+    spec = _user_folders_spec(top_folder)
+    return {x['name']: len(x.get('childEntity', [])) for x in _retrieve(vcenter, spec)}
+
+
+def _get_component(annotation):
+    """Parse the vLab meta data stored in the VM notes. Mirrors the logic of
+    ``vlab_inf_common.vmware.virtual_machine.get_info``.
+
+    :Returns: Dictionary
+
+    :param annotation: The notes of the VM
+    :type annotation: String
+    """
+    try:
+        return ujson.loads(annotation)
+    except (ValueError, TypeError):
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created, or is being deployed; notes are None
+        return {'component': 'Unknown', 'created': 0}
+
+
+def get_vm_details(vcenter, user_folder):
+    """Obtain the details needed to choose which of a user's VMs to delete, for
+    every VM the user owns, via a single PropertyCollector retrieval.
+
+    :Returns: List of VMDetails
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param user_folder: The folder that contains the user's VMs.
+    :type user_folder: vim.Folder
+    """
+    details = []
+    for props in _retrieve(vcenter, _vm_details_spec(user_folder)):
+        meta = _get_component(props.get('config.annotation'))
+        created = meta.get('created', 0)
+        if not created and props.get('config.createDate'):
+            created = props['config.createDate'].timestamp()
+        details.append(VMDetails(name=props['name'],
+                                 component=meta.get('component', 'Unknown'),
+                                 power_state=props.get('runtime.powerState', 'poweredOff'),
+                                 created=created,
+                                 size=props.get('summary.storage.committed', 0)))
+    return details
+
+
+class InventoryTracker:
+    """Keeps an in-memory count of items per user folder, and keeps it current
+    by applying only the deltas reported by ``WaitForUpdatesEx``.
+
+    Once the initial sync is done, vCenter only sends data when a user folder is
+    created, deleted, renamed or has VMs added/removed. If the update version
+    is lost (i.e. vCenter restarted, or the collector was destroyed), the
+    tracker falls back to a full resync.
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param path: The folder that contains all the user folders.
+    :type path: String
+    """
+    def __init__(self, vcenter, path=const.INF_VCENTER_TOP_LVL_DIR):
+        self._vcenter = vcenter
+        self._path = path
+        self._collector = None
+        self._version = ''
+        self._folders = {}
+
+    def vm_counts(self):
+        """The number of items within every user folder; includes the user's
+        defaultGateway.
+
+        :Returns: Dictionary
+        """
+        return {x['name']: x['count'] for x in self._folders.values() if 'name' in x}
+
+    def update(self, max_wait=0):
+        """Apply any changes vCenter has reported since the last call.
+
+        The call returns as soon as some changes are applied, or after ``max_wait``
+        seconds if nothing changed. The first call performs the initial sync.
+
+        :Returns: Boolean - True if any user folder changed
+
+        :param max_wait: How long (in seconds) to block while waiting on a change;
+                         rounded up to a whole second, because that's all vCenter accepts.
+        :type max_wait: Float
+        """
+        if self._collector is None:
+            self._resync()
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=int(math.ceil(max_wait)))
+        try:
+            update_set = self._collector.WaitForUpdatesEx(version=self._version, options=options)
+            changed = False
+            while update_set:
+                for filter_update in update_set.filterSet:
+                    for obj_update in filter_update.objectSet:
+                        self._apply(obj_update)
+                        changed = True
+                self._version = update_set.version
+                if not update_set.truncated:
+                    break
+                # vCenter splits large change sets; fetch the rest without waiting
+                options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+                update_set = self._collector.WaitForUpdatesEx(version=self._version, options=options)
+        except (vmodl.query.InvalidCollectorVersion, vmodl.fault.ManagedObjectNotFound) as doh:
+            log.warning('Lost inventory update version, performing full resync: %s', doh)
+            self._resync()
+            return self.update(max_wait=0)
+        return changed
+
+    def close(self):
+        """Release the PropertyCollector used for tracking changes"""
+        if self._collector is not None:
+            try:
+                self._collector.DestroyPropertyCollector()
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+            self._collector = None
+
+    def _resync(self):
+        """Discard all tracked state, and start tracking from scratch. The next
+        ``WaitForUpdatesEx`` call will return the whole inventory.
+
+        :Returns: None
+        """
+        self.close()
+        top_folder = self._vcenter.get_vm_folder(path=self._path)
+        # A dedicated collector avoids clobbering the version of any other
+        # filters that use the session's default PropertyCollector
+        self._collector = self._vcenter.content.propertyCollector.CreatePropertyCollector()
+        self._collector.CreateFilter(_user_folders_spec(top_folder), partialUpdates=False)
+        self._version = ''
+        self._folders = {}
+
+    def _apply(self, obj_update):
+        """Update the tracked state of a single user folder.
+
+        :Returns: None
+
+        :param obj_update: The change vCenter reported for a user folder
+        :type obj_update: vmodl.query.PropertyCollector.ObjectUpdate
+        """
+        key = obj_update.obj._moId
+        if obj_update.kind == 'leave':
+            self._folders.pop(key, None)
+            return
+        folder = self._folders.setdefault(key, {'count': 0})
+        for change in obj_update.changeSet:
+            if change.name == 'name':
+                folder['name'] = change.val
+            elif change.name == 'childEntity':
+                if change.op == 'assign':
+                    folder['count'] = len(change.val or [])
+                else:
+                    folder['count'] = 0
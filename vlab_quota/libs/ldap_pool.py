@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+"""A small pool of bound LDAP connections that heals itself"""
+import time
+import queue
+import threading
+import contextlib
+
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const, metrics
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+
+
+class LdapPoolTimeout(LDAPException):
+    """No LDAP connection freed up in time; i.e. the LDAP server is too slow"""
+    pass
+
+
+class LdapPool:
+    """Hands out bound LDAP connections, one thread at a time per connection.
+
+    Connections are created on demand (up to ``size``), and checked before
+    being handed out; a connection that's closed, unbound, or has sat idle for
+    longer than ``max_idle`` is thrown away and replaced. A connection that's
+    sat idle for longer than ``probe_idle`` must also answer a "Who am I?"
+    request first, because the client flags don't notice a connection the
+    server (or a firewall) silently dropped. A connection that hits a network
+    error while in use is also thrown away.
+
+    :param factory: Creates a new, bound LDAP connection.
+    :type factory: Callable
+
+    :param size: The most connections to have open at once.
+    :type size: Integer
+
+    :param timeout: How long (in seconds) to wait for a free connection.
+    :type timeout: Integer
+
+    :param max_idle: How long (in seconds) a connection can sit unused before it's replaced.
+    :type max_idle: Integer
+
+    :param probe_idle: How long (in seconds) a connection can sit unused before it's probed.
+    :type probe_idle: Integer
+    """
+    def __init__(self, factory, size=const.QUOTA_LDAP_POOL_SIZE, timeout=const.QUOTA_LDAP_POOL_TIMEOUT,
+                 max_idle=const.QUOTA_LDAP_MAX_IDLE, probe_idle=const.QUOTA_LDAP_PROBE_IDLE):
+        self._factory = factory
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self._probe_idle = probe_idle
+        self._slots = threading.BoundedSemaphore(size)
+        # LIFO, so the most recently used (i.e. least likely dropped) conn is reused first
+        self._idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Checkout a bound connection; it's returned to the pool when done.
+
+        :Returns: ldap3.core.connection.Connection
+
+        :Raises: LdapPoolTimeout if no connection frees up within the timeout.
+        """
+        if not self._slots.acquire(timeout=self._timeout):
+            raise LdapPoolTimeout('Timed out waiting for an LDAP connection after {} seconds'.format(self._timeout))
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except LDAPCommunicationError:
+            self._discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put((conn, time.monotonic()))
+            self._slots.release()
+
+    def search(self, **kwargs):
+        """Run an LDAP search, and return the matching entries. If the connection
+        was dropped by the server, the search is retried once on a new connection.
+
+        :Returns: List
+
+        :param kwargs: The parameters for ``ldap3.Connection.search``
+        :type kwargs: Dictionary
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as conn, metrics.STAGE_SECONDS.time(stage='ldap'):
+                    conn.search(**kwargs)
+                    return conn.entries
+            except LDAPCommunicationError as doh:
+                if attempt:
+                    raise
+                log.warning('Lost connection to LDAP server, retrying: %s', doh)
+
+    def close(self):
+        """Unbind every idle connection.
+
+        :Returns: None
+        """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _checkout(self):
+        """Obtain a healthy connection, reusing an idle one when possible.
+
+        :Returns: ldap3.core.connection.Connection
+        """
+        now = time.monotonic()
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._factory()
+            idle = now - last_used
+            if conn.closed or not conn.bound or idle > self._max_idle:
+                self._discard(conn)
+            elif idle > self._probe_idle and not self._alive(conn):
+                log.info('Replacing stale LDAP connection, idle for %.0f seconds', idle)
+                self._discard(conn)
+            else:
+                return conn
+
+    def _alive(self, conn):
+        """Make a round trip to the LDAP server on a connection.
+
+        :Returns: Boolean
+
+        :param conn: The connection to check.
+        :type conn: ldap3.core.connection.Connection
+        """
+        try:
+            conn.extend.standard.who_am_i()
+        except (LDAPException, OSError):
+            return False
+        return (conn.result or {}).get('result') == 0
+
+    def _discard(self, conn):
+        """Close a connection, ignoring any errors because it's likely already broken.
+
+        :Returns: None
+
+        :param conn: The connection to close.
+        :type conn: ldap3.core.connection.Connection
+        """
+        if conn is None:
+            return
+        try:
+            conn.unbind()
+        except (LDAPException, OSError):
+            pass
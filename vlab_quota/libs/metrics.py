@@ -0,0 +1,278 @@
+# -*- coding: UTF-8 -*-
+"""In-process metrics for the quota worker, exposed in the Prometheus text format"""
+import time
+import threading
+import socketserver
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+# seconds; spans a fast DB query up to a loop that blew way past LOOP_INTERVAL
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+_REGISTRY = []
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    """Render the ``{name="value",...}`` part of a sample line.
+
+    :Returns: String
+
+    :param labelnames: The names of the labels
+    :type labelnames: Tuple
+
+    :param labelvalues: The values of the labels, in the same order as ``labelnames``
+    :type labelvalues: Tuple
+
+    :param extra: Additional (name, value) pairs, like a histogram's ``le``
+    :type extra: Tuple
+    """
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        escaped.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """Render a sample value the way Prometheus expects.
+
+    :Returns: String
+
+    :param value: The sample value
+    :type value: Integer or Float
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    """The parts shared by every type of metric.
+
+    :param name: The name of the metric, i.e. ``vlab_quota_violators``
+    :type name: String
+
+    :param documentation: What the metric measures
+    :type documentation: String
+
+    :param labelnames: Optional - The names of the labels the metric is broken down by
+    :type labelnames: Tuple
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            self._values[()] = self._initial()
+        _REGISTRY.append(self)
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        """Convert keyword labels into the key for ``_values``
+
+        :Returns: Tuple
+
+        :Raises: ValueError
+
+        :param labels: The value of every label
+        :type labels: Dictionary
+        """
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError('Metric {} requires labels {}, supplied: {}'.format(self.name, self.labelnames, list(labels.keys())))
+        return tuple(labels[x] for x in self.labelnames)
+
+    def _samples(self):
+        """Yield the sample lines of the metric
+
+        :Returns: Generator
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield '{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues), _format_value(value))
+
+    def render(self):
+        """Render the metric in the Prometheus text format
+
+        :Returns: String
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        lines += list(self._samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """A value that only ever goes up, like the number of emails sent."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter.
+
+        :Returns: None
+
+        :Raises: ValueError
+
+        :param amount: How much to increase the counter by; cannot be negative
+        :type amount: Integer or Float
+        """
+        if amount < 0:
+            raise ValueError('Counters can only go up, supplied: {}'.format(amount))
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, like the number of users over quota."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Record the current value.
+
+        :Returns: None
+
+        :param value: The current value
+        :type value: Integer or Float
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts observations (like how long something took) into buckets, so the
+    distribution, not just the average, can be graphed.
+
+    :param buckets: Optional - The upper bound of each bucket, in ascending order
+    :type buckets: Tuple
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        # [count per bucket, sum]
+        return [[0] * len(self.buckets), 0.0]
+
+    def observe(self, value, **labels):
+        """Record an observation.
+
+        :Returns: None
+
+        :param value: The observed value, i.e. seconds something took
+        :type value: Float
+        """
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, self._initial())
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][idx] += 1
+                    break
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long (in seconds) the body of a ``with`` block takes,
+        even if it raises an exception.
+
+        :Returns: None
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, extra=(('le', _format_value(bound)),))
+                yield '{}_bucket{} {}'.format(self.name, labels, cumulative)
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield '{}_sum{} {}'.format(self.name, labels, _format_value(total))
+            yield '{}_count{} {}'.format(self.name, labels, cumulative)
+
+
+def render():
+    """Render every metric in the Prometheus text format
+
+    :Returns: String
+    """
+    return ''.join(x.render() for x in _REGISTRY)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Answers every GET with the current metrics"""
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are frequent; don't spam the worker's log
+        log.debug(format, *args)
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Answers each scrape in its own thread; http.server.ThreadingHTTPServer is Python 3.7+"""
+    daemon_threads = True
+
+
+def serve(port=const.QUOTA_METRICS_PORT, address=''):
+    """Serve the metrics over HTTP from a background thread.
+
+    :Returns: http.server.HTTPServer
+
+    :param port: The TCP port to listen on
+    :type port: Integer
+
+    :param address: Optional - The IP to listen on; all IPs by default
+    :type address: String
+    """
+    server = _MetricsServer((address, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
+
+
+CYCLE_SECONDS = Histogram('vlab_quota_cycle_seconds',
+                          'How long an enforcement loop took to run')
+STAGE_SECONDS = Histogram('vlab_quota_stage_seconds',
+                          'How long each call to a backend took',
+                          labelnames=('stage',))
+VIOLATORS = Gauge('vlab_quota_violators',
+                  'Users exceeding their quota, as of the last loop')
+DELETIONS = Counter('vlab_quota_vm_deletions_total',
+                    'VMs deleted for exceeding the quota')
+EMAILS_SENT = Counter('vlab_quota_emails_sent_total',
+                      'Warning and follow-up emails sent')
+LOOP_OVERRUNS = Counter('vlab_quota_loop_overruns_total',
+                        'Enforcement loops that ran longer than the loop interval')
+BACKEND_FAILURES = Counter('vlab_quota_backend_failures_total',
+                           'Enforcement loops cut short by a backend error',
+                           labelnames=('backend',))
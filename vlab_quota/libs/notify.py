@@ -3,7 +3,7 @@
 import ssl
 import time
 import smtplib
-import os.path
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timezone
@@ -11,9 +11,13 @@ from datetime import datetime, timezone
 import jinja2
 from vlab_api_common.std_logger import get_logger
 
-from vlab_quota.libs import const
+from vlab_quota.libs import const, metrics, tracing
 
 log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+# Templates are compiled once, and only recompiled if the file changes (auto_reload)
+_TEMPLATES = jinja2.Environment(loader=jinja2.PackageLoader('vlab_quota', 'libs'),
+                                bytecode_cache=jinja2.FileSystemBytecodeCache(),
+                                auto_reload=True)
 
 
 class NotifyError(Exception):
@@ -36,17 +40,6 @@ def _get_ssl_context():
     return context
 
 
-def _get_template_abs(template):
-    """Avoids issues where a current-working dir is not the same as this module.
-
-    :Returns: String
-
-    :param template: The name of the jinja2 templates
-    :type template: String
-    """
-    return os.path.join(os.path.dirname(__file__), template)
-
-
 def _generate_warning(vm_count, exp_date, template='violation_warning.html'):
     """Create the HTML email body to warn users about a quota violation.
 
@@ -58,13 +51,11 @@ def _generate_warning(vm_count, exp_date, template='violation_warning.html'):
     :param exp_date: When the soft quota grace period will expire (EPOCH).
     :type exp_date: Integer
     """
-    with open(_get_template_abs(template)) as the_file:
-        template_data = the_file.read()
     vm_delta = vm_count - const.VLAB_QUOTA_LIMIT
-    message = jinja2.Template(template_data).render(vm_quota=const.VLAB_QUOTA_LIMIT,
-                                                    vm_count=vm_count,
-                                                    vm_delta=vm_delta,
-                                                    exp_date=datetime.fromtimestamp(exp_date, timezone.utc))
+    message = _TEMPLATES.get_template(template).render(vm_quota=const.VLAB_QUOTA_LIMIT,
+                                                       vm_count=vm_count,
+                                                       vm_delta=vm_delta,
+                                                       exp_date=datetime.fromtimestamp(exp_date, timezone.utc))
     return message
 
 
@@ -79,10 +70,8 @@ def _generate_follow_up(the_date, vms, template='delete_followup.html'):
     :param vms: The names of the VM(s) deleted.
     :type vms: List
     """
-    with open(_get_template_abs(template)) as the_file:
-        template_data = the_file.read()
-    message = jinja2.Template(template_data).render(the_date=datetime.fromtimestamp(the_date, timezone.utc),
-                                                    vms=vms)
+    message = _TEMPLATES.get_template(template).render(the_date=datetime.fromtimestamp(the_date, timezone.utc),
+                                                       vms=vms)
     return message
 
 
@@ -105,18 +94,10 @@ def _make_email(to, body):
     return mail.as_string()
 
 
-def _send_email(to, mail):
-    """Connect to the SMTP server and send an email.
-
-    :Returns: None
+def _connect():
+    """Open an (authenticated, if configured) session with the SMTP server.
 
-    :Raises: NotifyError
-
-    :param to: The email address of the recipient.
-    :type to: String
-
-    :param mail: The constructed email to send
-    :type mail: String
+    :Returns: smtplib.SMTP
     """
     if const.QUOTA_EMAIL_SSL:
         log.debug('Sending email with SSL connection to server')
@@ -127,27 +108,174 @@ def _send_email(to, mail):
 
     if const.QUOTA_EMAIL_USERNAME and const.QUOTA_EMAIL_PASSWORD:
         log.debug('Authenticating to SMTP server with user %s', const.QUOTA_EMAIL_USERNAME)
-        mailer.login(const.QUOTA_EMAIL_USERNAME, const.QUOTA_EMAIL_PASSWORD)
+        try:
+            mailer.login(const.QUOTA_EMAIL_USERNAME, const.QUOTA_EMAIL_PASSWORD)
+        except OSError:
+            mailer.close()
+            raise
     else:
         log.debug('Username & Password not provided, assuming no auth needed')
+    return mailer
+
+
+def _get_recipients(to):
+    """Determine who an email should be delivered to.
 
+    :Returns: List
+
+    :param to: The email address of the recipient.
+    :type to: String
+    """
     if const.QUOTA_EMAIL_BCC:
         log.debug("BCCing %s", const.QUOTA_EMAIL_BCC)
         recipients = [to, const.QUOTA_EMAIL_BCC]
     else:
         recipients = [to]
+    return recipients
 
-    errors = None
-    try:
-        errors = mailer.sendmail(const.QUOTA_EMAIL_FROM_DOMAIN, recipients, mail)
-    finally:
-        mailer.close()
+
+def _send_email(to, mail):
+    """Connect to the SMTP server and send an email.
+
+    :Returns: None
+
+    :Raises: NotifyError
+
+    :param to: The email address of the recipient.
+    :type to: String
+
+    :param mail: The constructed email to send
+    :type mail: String
+    """
+    with metrics.STAGE_SECONDS.time(stage='smtp'), tracing.span('notify._send_email', to=to):
+        mailer = _connect()
+        errors = None
+        try:
+            errors = mailer.sendmail(const.QUOTA_EMAIL_FROM_DOMAIN, _get_recipients(to), mail)
+        finally:
+            mailer.close()
 
     if errors:
         raise NotifyError('Failure sending all emails', errors)
+    metrics.EMAILS_SENT.inc()
 
 
-def send_warning(to, vm_count, exp_date):
+def _is_disconnect(error):
+    """Determine if an error means the SMTP session is no longer usable.
+
+    :Returns: Boolean
+
+    :param error: The error raised while sending an email.
+    :type error: OSError
+    """
+    # smtplib.SMTPException is a subclass of OSError; anything else is a socket error
+    return isinstance(error, smtplib.SMTPServerDisconnected) or not isinstance(error, smtplib.SMTPException)
+
+
+class Mailer:
+    """Sends many emails over a single SMTP session, instead of connecting (and
+    authenticating) once per email.
+
+    Emails are queued with ``enqueue`` (safe to call from multiple threads), and
+    sent by ``flush``. If the server drops the session, the Mailer reconnects
+    and tries the email again. Using the Mailer as a context manager flushes and
+    closes it upon exit.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outbox = []
+        self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+    def enqueue(self, to, mail):
+        """Queue an email to be sent by the next ``flush``.
+
+        :Returns: None
+
+        :param to: The email address of the recipient.
+        :type to: String
+
+        :param mail: The constructed email to send
+        :type mail: String
+        """
+        with self._lock:
+            self._outbox.append((to, mail))
+
+    def flush(self):
+        """Send every queued email. An email that cannot be sent is logged and
+        dropped, so one bad address doesn't hold up everyone else.
+
+        Returns a mapping of recipient to error, for every email that failed.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            outbox, self._outbox = self._outbox, []
+        failed = {}
+        for to, mail in outbox:
+            try:
+                self.send(to, mail)
+            except (NotifyError, OSError) as doh:
+                log.error('Failed to email %s: %s', to, doh)
+                failed[to] = doh
+        return failed
+
+    def close(self):
+        """End the SMTP session.
+
+        :Returns: None
+        """
+        if self._session is not None:
+            try:
+                self._session.quit()
+            except OSError:
+                # the server already hung up; just free the socket
+                self._session.close()
+            self._session = None
+
+    def send(self, to, mail):
+        """Send one email right now over the current session, reconnecting once if needed.
+
+        :Returns: None
+
+        :Raises: NotifyError, OSError
+
+        :param to: The email address of the recipient.
+        :type to: String
+
+        :param mail: The constructed email to send
+        :type mail: String
+        """
+        with metrics.STAGE_SECONDS.time(stage='smtp'), tracing.span('notify.Mailer.send', to=to):
+            for attempt in range(2):
+                if self._session is None:
+                    self._session = _connect()
+                try:
+                    errors = self._session.sendmail(const.QUOTA_EMAIL_FROM_DOMAIN, _get_recipients(to), mail)
+                except OSError as doh:
+                    if not _is_disconnect(doh):
+                        raise
+                    self._session.close()
+                    self._session = None
+                    if attempt:
+                        raise
+                    log.warning('Lost connection to SMTP server, reconnecting: %s', doh)
+                else:
+                    if errors:
+                        raise NotifyError('Failure sending all emails', errors)
+                    metrics.EMAILS_SENT.inc()
+                    return
+
+
+def send_warning(to, vm_count, exp_date, mailer=None):
     """Email the user letting them know when their soft-quota grace period will
     expire, and as a result, vLab will randomly delete VMs from their lab.
 
@@ -161,13 +289,19 @@ def send_warning(to, vm_count, exp_date):
 
     :param exp_date: The EPOCH timestamp when the grace period expires.
     :type exp_date: Integer
+
+    :param mailer: Optional - Queue the email on this Mailer instead of sending it now.
+    :type mailer: Mailer
     """
     body = _generate_warning(vm_count, exp_date)
     mail = _make_email(to, body)
-    _send_email(to, mail)
+    if mailer is None:
+        _send_email(to, mail)
+    else:
+        mailer.enqueue(to, mail)
 
 
-def send_follow_up(to, the_date, vms):
+def send_follow_up(to, the_date, vms, mailer=None):
     """Email the user about the VMs that were deleted due to the grace period
     of their soft-quota expiring.
 
@@ -181,10 +315,16 @@ def send_follow_up(to, the_date, vms):
 
     :param vms: The VMs deleted
     :type vms: List
+
+    :param mailer: Optional - Queue the email on this Mailer instead of sending it now.
+    :type mailer: Mailer
     """
     body = _generate_follow_up(the_date, vms)
     mail = _make_email(to, body)
-    _send_email(to, mail)
+    if mailer is None:
+        _send_email(to, mail)
+    else:
+        mailer.enqueue(to, mail)
 
 
 def should_send_warning(violation_date, last_time_notified, grace_period=const.QUOTA_GRACE_PERIOD):
@@ -0,0 +1,217 @@
+# -*- coding: UTF-8 -*-
+"""A durable, database-backed queue of emails, and the sender that drains it"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const, notify
+from vlab_quota.libs.database import DatabaseError
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+POLL_INTERVAL = 5 # seconds
+
+
+class Outbox:
+    """Queues emails in the database instead of sending them, so a slow or
+    unreachable mail relay never holds up quota enforcement.
+
+    It has the same interface as ``notify.Mailer``, so it can be passed as the
+    ``mailer`` to ``notify.send_warning`` and ``notify.send_follow_up``.
+
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+    """
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.flush()
+
+    def enqueue(self, to, mail):
+        """Queue an email to be written to the outbox by the next ``flush``.
+        Safe to call from multiple threads.
+
+        :Returns: None
+
+        :param to: The email address of the recipient.
+        :type to: String
+
+        :param mail: The constructed email to send
+        :type mail: String
+        """
+        with self._lock:
+            self._pending.append((to, mail))
+
+    def flush(self, users=None):
+        """Write every queued email to the outbox with a single statement.
+
+        Returns the emails that could not be queued, which is always empty;
+        unlike ``notify.Mailer``, an error here is a database error, and it's raised.
+
+        :Returns: Dictionary
+
+        :Raises: DatabaseError
+
+        :param users: Optional - The (username, violation_date, last_time_notified)
+                      of users to record in the same transaction as the emails.
+        :type users: List
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if users:
+            self._db.enqueue_warnings(pending, users)
+        else:
+            self._db.enqueue_emails(pending)
+        return {}
+
+    def close(self):
+        """Nothing to close; here so an Outbox can be used just like a Mailer.
+
+        :Returns: None
+        """
+        pass
+
+
+def _send_batch(emails):
+    """Send a group of emails over a single SMTP session.
+
+    :Returns: Tuple - (IDs of emails sent, emails that failed)
+
+    :param emails: The (id, recipient, mail, attempts) of each email
+    :type emails: List
+    """
+    sent = []
+    failed = []
+    mailer = notify.Mailer()
+    try:
+        for email in emails:
+            email_id, to, mail, _ = email
+            try:
+                mailer.send(to, mail)
+            except (notify.NotifyError, OSError) as doh:
+                log.warning('Failed to email %s: %s', to, doh)
+                failed.append(email)
+            else:
+                sent.append(email_id)
+    finally:
+        mailer.close()
+    return sent, failed
+
+
+class OutboxSender:
+    """Drains the outbox in a background thread, sending with a pool of
+    concurrent SMTP sessions. Emails that fail are retried with an exponential
+    backoff, up to ``max_attempts`` times.
+
+    :param db: A connection to the Quota database; it should not be shared with
+               the enforcement loop, so a slow query can't block either one.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param senders: How many SMTP sessions to send with at once.
+    :type senders: Integer
+
+    :param batch_size: The most emails to claim from the outbox at a time.
+    :type batch_size: Integer
+
+    :param max_attempts: How many times to try sending an email before giving up.
+    :type max_attempts: Integer
+
+    :param max_backoff: The longest (in seconds) to wait before retrying an email.
+    :type max_backoff: Integer
+
+    :param lease: How long (in seconds) before a claimed, unsent email can be claimed again.
+    :type lease: Integer
+    """
+    def __init__(self, db, senders=const.QUOTA_OUTBOX_SENDERS, batch_size=const.QUOTA_OUTBOX_BATCH_SIZE,
+                 max_attempts=const.QUOTA_OUTBOX_MAX_ATTEMPTS, max_backoff=const.QUOTA_OUTBOX_MAX_BACKOFF,
+                 lease=const.QUOTA_OUTBOX_LEASE):
+        self._db = db
+        self._senders = senders
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._max_backoff = max_backoff
+        self._lease = lease
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sending emails in a background thread.
+
+        :Returns: None
+        """
+        self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending emails, once the current batch is done.
+
+        :Returns: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def send_due(self):
+        """Send a batch of the emails that are due.
+
+        Returns how many emails were claimed from the outbox.
+
+        :Returns: Integer
+        """
+        emails = self._db.claim_emails(self._batch_size, self._lease)
+        if not emails:
+            return 0
+        # round-robin, so each sender gets about the same number of emails
+        batches = [emails[x::self._senders] for x in range(self._senders)]
+        with ThreadPoolExecutor(max_workers=self._senders) as pool:
+            results = list(pool.map(_send_batch, [x for x in batches if x]))
+        done = [] # sent, or given up on
+        retries = []
+        now = int(time.time())
+        for batch_sent, batch_failed in results:
+            done += batch_sent
+            for email_id, to, _, attempts in batch_failed:
+                if attempts >= self._max_attempts:
+                    log.error('Giving up on emailing %s after %s attempts', to, attempts)
+                    done.append(email_id)
+                else:
+                    retries.append((email_id, now + self._backoff(attempts)))
+        self._db.delete_emails(done)
+        self._db.retry_emails(retries)
+        return len(emails)
+
+    def _backoff(self, attempts):
+        """Determine how long to wait before trying to send an email again.
+
+        :Returns: Integer
+
+        :param attempts: How many times sending the email has been tried.
+        :type attempts: Integer
+        """
+        return min(2 ** attempts, self._max_backoff)
+
+    def _run(self):
+        """Keep sending emails until told to stop.
+
+        :Returns: None
+        """
+        while not self._stop.is_set():
+            try:
+                claimed = self.send_due()
+            except DatabaseError as doh:
+                log.error('Unable to process the email outbox: %s', doh)
+                claimed = 0
+            except Exception:
+                # Never let a bug silently stop every email from being sent
+                log.exception('Unexpected error processing the email outbox')
+                claimed = 0
+            if claimed < self._batch_size:
+                # caught up; no need to hammer the database
+                self._stop.wait(POLL_INTERVAL)
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+"""An in-process cache of quota violation records, kept fresh by Postgres NOTIFY"""
+import os
+import select
+import threading
+
+import psycopg2
+from vlab_api_common import get_logger
+
+from vlab_quota.libs import const
+from vlab_quota.libs.cache import TTLCache
+from vlab_quota.libs.database import NOTIFY_CHANNEL
+
+log = get_logger(__name__, loglevel=const.QUOTA_LOG_LEVEL)
+RECONNECT_MAX_BACKOFF = 30 # seconds
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+class QuotaCache:
+    """Caches the quota violation info of users, and drops a user's entry when
+    the database announces (via LISTEN/NOTIFY) that their record changed.
+
+    Entries are only served while the listener is connected; while it's not,
+    every lookup goes to the database, because a change could be missed.
+
+    :param maxsize: The most users to cache.
+    :type maxsize: Integer
+
+    :param ttl: How long (in seconds) to cache an entry, as a safety net.
+    :type ttl: Integer
+
+    :param conn_params: The parameters for ``psycopg2.connect``
+    :type conn_params: Dictionary
+    """
+    def __init__(self, maxsize=const.QUOTA_API_CACHE_SIZE, ttl=const.QUOTA_API_CACHE_TTL, **conn_params):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._conn_params = conn_params or {'database': const.DB_DATABASE_NAME,
+                                            'host': const.DB_HOST,
+                                            'user': const.DB_USER,
+                                            'password': const.DB_PASSWORD}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so a lookup that raced with a change
+        # doesn't cache the (possibly) outdated value it read.
+        self._generation = 0
+        self._listening = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start listening for changes in a background thread.
+
+        :Returns: None
+        """
+        self._thread = threading.Thread(target=self._listen, name='quota-cache-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop listening for changes. Lookups are no longer cached.
+
+        :Returns: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get(self, username, loader):
+        """Lookup the quota violation info for a user.
+
+        :Returns: Tuple - (triggered, last_notified)
+
+        :param username: The name of the user
+        :type username: String
+
+        :param loader: Looks up the info in the database when it's not cached
+        :type loader: Callable
+        """
+        with self._lock:
+            listening = self._listening
+            generation = self._generation
+        if not listening:
+            return loader(username)
+        info = self._entries.get(username)
+        if info is None:
+            info = loader(username)
+            with self._lock:
+                if self._listening and generation == self._generation:
+                    self._entries.set(username, info)
+        return info
+
+    def invalidate(self, username=None):
+        """Drop the cached info for a user, or for every user.
+
+        :Returns: None
+
+        :param username: The user whose record changed. Supply None to drop everything.
+        :type username: String
+        """
+        with self._lock:
+            self._generation += 1
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username)
+
+    def _set_listening(self, listening):
+        """Flag if changes are being tracked; nothing cached can be trusted
+        across a gap in tracking, so the cache is always emptied.
+
+        :Returns: None
+
+        :param listening: True if the listener is connected.
+        :type listening: Boolean
+        """
+        with self._lock:
+            self._listening = listening
+            self._generation += 1
+            self._entries.clear()
+
+    def _listen(self):
+        """Receive change notifications, reconnecting whenever the connection drops.
+
+        :Returns: None
+        """
+        backoff = 1
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._conn_params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute('LISTEN {};'.format(NOTIFY_CHANNEL))
+                self._set_listening(True)
+                backoff = 1
+                while not self._stop.is_set():
+                    # wake up periodically to check if we should stop
+                    if select.select([conn], [], [], 1) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.invalidate(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError) as doh:
+                log.warning('Quota cache listener lost connection to database: %s', doh)
+            finally:
+                self._set_listening(False)
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_BACKOFF)
+
+
+def get_cache():
+    """Obtain the quota cache for this process, starting it if needed.
+
+    The cache is created lazily, and re-created if the process ID changes, so
+    the listener thread runs inside each uWSGI worker, not just the master.
+
+    :Returns: QuotaCache
+    """
+    global _CACHE
+    pid = os.getpid()
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE[1] != pid:
+            cache = QuotaCache()
+            cache.start()
+            _CACHE = (cache, pid)
+        return _CACHE[0]
@@ -0,0 +1,171 @@
+# -*- coding: UTF-8 -*-
+"""Decides when the next quota enforcement cycle should run"""
+import time
+import random
+
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const, metrics
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+# Any more, and a float interval overflows long before it's capped
+MAX_DOUBLINGS = 16
+
+
+class Scheduler:
+    """Paces the enforcement loop, using monotonic time.
+
+    The next cycle normally starts ``interval`` seconds after the last one
+    started. The interval is:
+
+    - stretched (doubling, up to ``max_interval``) while there's nothing to do,
+    - shortened (down to ``min_interval``) so the next cycle runs right as a
+      user's grace period expires,
+    - backed off exponentially (up to ``max_backoff``) while a backend is failing.
+
+    Every delay is randomly lengthened by up to ``jitter`` (a fraction) of
+    it, so many workers don't end up hitting the backends in lockstep. It's
+    never shortened, so a cycle never runs before a grace period expires.
+
+    :param interval: The normal number of seconds between the start of each cycle.
+    :type interval: Float
+
+    :param min_interval: The fewest seconds between the start of each cycle.
+    :type min_interval: Float
+
+    :param max_interval: The most seconds between cycles while idle.
+    :type max_interval: Float
+
+    :param max_backoff: The most seconds between cycles while a backend is failing.
+    :type max_backoff: Float
+
+    :param jitter: How much to randomly lengthen each delay by, as a fraction of it.
+    :type jitter: Float
+    """
+    def __init__(self, interval, min_interval=const.QUOTA_LOOP_MIN_INTERVAL,
+                 max_interval=const.QUOTA_LOOP_MAX_INTERVAL, max_backoff=const.QUOTA_LOOP_MAX_BACKOFF,
+                 jitter=const.QUOTA_LOOP_JITTER):
+        self._interval = interval
+        self._min_interval = min(min_interval, interval)
+        self._max_interval = max(max_interval, interval)
+        self._max_backoff = max_backoff
+        self._jitter = jitter
+        self._started = None
+        self._idle_cycles = 0
+        self._next_expiry = None
+        # backend name -> consecutive failures
+        self._failures = {}
+        self.overruns = 0
+
+    def start_cycle(self):
+        """Mark the start of an enforcement cycle.
+
+        :Returns: None
+        """
+        self._started = time.monotonic()
+
+    def succeeded(self, idle=False, next_expiry=None):
+        """Record that the cycle finished without a backend error.
+
+        :Returns: None
+
+        :param idle: True if there were no violators, and no VM deletions in flight.
+        :type idle: Boolean
+
+        :param next_expiry: The EPOCH timestamp of the soonest grace period to
+                            expire, if any user is in their grace period.
+        :type next_expiry: Integer
+        """
+        for backend in self._failures:
+            log.info('Backend %s recovered', backend)
+        self._failures = {}
+        self._idle_cycles = self._idle_cycles + 1 if idle else 0
+        self._next_expiry = next_expiry
+
+    def failed(self, backend):
+        """Record that the cycle was cut short by a backend error.
+
+        :Returns: None
+
+        :param backend: The name of the backend that failed, i.e. ``vcenter``
+        :type backend: String
+        """
+        self._failures[backend] = self._failures.get(backend, 0) + 1
+        self._idle_cycles = 0
+        metrics.BACKEND_FAILURES.inc(backend=backend)
+
+    def healthy(self, backend=None):
+        """Check if a backend (or every backend) worked during the last cycle.
+
+        :Returns: Boolean
+
+        :param backend: Optional - The name of the backend, i.e. ``vcenter``
+        :type backend: String
+        """
+        if backend is None:
+            return not self._failures
+        return backend not in self._failures
+
+    def finish_cycle(self):
+        """Mark the end of an enforcement cycle, and determine how long to
+        wait before starting the next one.
+
+        A cycle that runs longer than ``interval`` is an overrun; the next
+        cycle starts right away, and missed cycles are skipped, not made up
+        in a burst.
+
+        :Returns: Float
+        """
+        elapsed = time.monotonic() - self._started
+        metrics.CYCLE_SECONDS.observe(elapsed)
+        if elapsed > self._interval:
+            self.overruns += 1
+            metrics.LOOP_OVERRUNS.inc()
+            log.warning('Enforcement cycle took %.1f seconds; longer than the %s second interval', elapsed, self._interval)
+        return self.delay()
+
+    def delay(self):
+        """How long to wait, from now, before starting the next cycle.
+
+        :Returns: Float
+        """
+        elapsed = time.monotonic() - self._started
+        return max(0, self._jittered(self._target()) - elapsed)
+
+    def min_delay(self):
+        """How much longer to wait so cycles start at least ``min_interval``
+        seconds apart; i.e. after a wait was cut short by an inventory change.
+
+        :Returns: Float
+        """
+        return max(0, self._min_interval - (time.monotonic() - self._started))
+
+    def _target(self):
+        """The seconds from the start of the last cycle to the start of the next one.
+
+        :Returns: Float
+        """
+        if self._failures:
+            worst = max(self._failures.values())
+            return min(self._interval * (2 ** min(worst, MAX_DOUBLINGS)), self._max_backoff)
+        if self._idle_cycles:
+            target = min(self._interval * (2 ** min(self._idle_cycles, MAX_DOUBLINGS)), self._max_interval)
+        else:
+            target = self._interval
+        if self._next_expiry is not None:
+            # +1 because a grace period has only expired once it's *over*
+            until_expiry = self._next_expiry + 1 - time.time()
+            # the target is measured from the start of the cycle, not from now
+            since_start = time.monotonic() - self._started
+            target = min(target, max(self._min_interval, since_start + until_expiry))
+        return target
+
+    def _jittered(self, seconds):
+        """Randomly lengthen a delay by up to ``jitter`` of it.
+
+        :Returns: Float
+
+        :param seconds: The delay
+        :type seconds: Float
+        """
+        return seconds * (1 + random.uniform(0, self._jitter))
@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+"""A shared, keep-alive HTTP session for calling the vLab APIs"""
+import threading
+
+import urllib3
+import requests
+from requests.adapters import HTTPAdapter
+
+from vlab_quota.libs import const, metrics
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+TIMEOUT = (const.QUOTA_HTTP_CONNECT_TIMEOUT, const.QUOTA_HTTP_READ_TIMEOUT)
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _make_session():
+    """Create a session that keeps connections open, with a pool of connections
+    per host (i.e. one for VLAB_FQDN, and one per user gateway).
+
+    :Returns: requests.Session
+    """
+    session = requests.Session()
+    session.verify = False
+    adapter = HTTPAdapter(pool_connections=const.QUOTA_HTTP_POOL_HOSTS,
+                          pool_maxsize=const.QUOTA_HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Obtain the process-wide HTTP session, creating it on first use.
+
+    :Returns: requests.Session
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = _make_session()
+    return _SESSION
+
+
+def request(method, url, **kwargs):
+    """Make an HTTP request over the shared session. Unless the caller supplies
+    one, the connect and read timeouts from the config are always applied so
+    a hung server cannot block the caller forever.
+
+    :Returns: requests.Response
+
+    :Raises: requests.exceptions.RequestException
+
+    :param method: The HTTP method to envoke
+    :type method: String
+
+    :param url: The complete URL to call
+    :type url: String
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    with metrics.STAGE_SECONDS.time(stage='vlab_api'):
+        return get_session().request(method, url, **kwargs)
+
+
+def close():
+    """Close all pooled connections.
+
+    :Returns: None
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
@@ -0,0 +1,179 @@
+# -*- coding: UTF-8 -*-
+"""Splits quota enforcement between many worker replicas.
+
+Users are hashed into a fixed number of shards, and the shards are spread
+between the live workers with a consistent hash ring; so when a worker joins
+or leaves, only the shards on its part of the ring move.
+
+Workers coordinate via Postgres advisory locks. Each worker holds a
+"member" lock for as long as it's connected, which is how the workers find
+each other, and the lock of every shard it owns, which guarantees only one
+worker acts on a user at a time. Locks are released when a connection
+closes, so the shards of a worker that dies are taken over automatically.
+"""
+import zlib
+import bisect
+import random
+import hashlib
+
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const
+from vlab_quota.libs.database import Database, DatabaseError
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+MAX_MEMBER_ID = 2**31 - 1
+
+
+def _hash(value):
+    """A stable hash; Python's ``hash`` differs between processes.
+
+    :Returns: Integer
+
+    :param value: The value to hash
+    :type value: String
+    """
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+def shard_of(username, shards=const.QUOTA_SHARD_COUNT):
+    """Determine which shard a user belongs to.
+
+    :Returns: Integer
+
+    :param username: The name of the user
+    :type username: String
+
+    :param shards: The total number of shards
+    :type shards: Integer
+    """
+    # usernames are case-insensitive in AD
+    return zlib.crc32(username.lower().encode()) % shards
+
+
+class HashRing:
+    """Maps keys to members, such that adding or removing a member only moves
+    the keys on its part of the ring.
+
+    :param members: The members to spread the keys between
+    :type members: Iterable
+
+    :param vnodes: How many points each member gets on the ring; more points
+                   spreads the keys more evenly.
+    :type vnodes: Integer
+    """
+    def __init__(self, members, vnodes=const.QUOTA_SHARD_VNODES):
+        points = sorted((_hash('{}-{}'.format(member, idx)), member) for member in members for idx in range(vnodes))
+        self._hashes = [x[0] for x in points]
+        self._members = [x[1] for x in points]
+
+    def owner(self, key):
+        """Find the member a key belongs to.
+
+        :Returns: Object - None if there are no members
+
+        :param key: The key to lookup
+        :type key: Object
+        """
+        if not self._members:
+            return None
+        idx = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._members[idx]
+
+
+class ShardCoordinator:
+    """Tracks which shards this worker owns.
+
+    Call ``rebalance`` at the start of every enforcement cycle; it takes over
+    the shards that (according to the ring) belong to this worker, and hands
+    back the ones that don't.
+
+    :param db_factory: Creates the connection that holds the locks; it must
+                       not be shared, or pooled.
+    :type db_factory: Callable
+
+    :param shards: The total number of shards
+    :type shards: Integer
+    """
+    def __init__(self, db_factory=Database, shards=const.QUOTA_SHARD_COUNT):
+        self._db_factory = db_factory
+        self._shards = shards
+        self._db = None
+        self.member = None
+        self.owned = set()
+
+    def rebalance(self, keep=()):
+        """Take over, and hand back, shards so this worker owns its part of the ring.
+
+        If the connection to the database has an error, every shard is
+        considered lost, and the group is re-joined on the next call.
+
+        :Returns: Set - The shards this worker owns
+
+        :Raises: DatabaseError
+
+        :param keep: Users whose shard should not be handed back, i.e. because
+                     their VMs are still being deleted.
+        :type keep: Iterable
+        """
+        try:
+            if self._db is None:
+                self._join()
+            ring = HashRing(self._db.shard_group_members())
+            wanted = {x for x in range(self._shards) if ring.owner(x) == self.member}
+            held = set(self._db.held_shards())
+            release = held - wanted - {shard_of(x, self._shards) for x in keep}
+            self._db.unlock_shards(release)
+            acquired = set(self._db.lock_shards(wanted - held))
+        except DatabaseError:
+            self._reset()
+            raise
+        owned = (held - release) | acquired
+        if owned != self.owned:
+            log.info('Worker %s now owns %s of %s shards (%s wanted)', self.member, len(owned), self._shards, len(wanted))
+        self.owned = owned
+        return owned
+
+    def owns(self, username):
+        """Check if this worker should enforce the quota of a user.
+
+        :Returns: Boolean
+
+        :param username: The name of the user
+        :type username: String
+        """
+        return shard_of(username, self._shards) in self.owned
+
+    def close(self):
+        """Leave the group, handing back every shard.
+
+        :Returns: None
+        """
+        self._reset()
+
+    def _join(self):
+        """Connect, and join the group under a random, unused, member ID.
+
+        :Returns: None
+        """
+        self._db = self._db_factory()
+        while True:
+            member = random.randint(0, MAX_MEMBER_ID)
+            if self._db.join_shard_group(member):
+                break
+        self.member = member
+        log.info('Joined the group of workers as member %s', member)
+
+    def _reset(self):
+        """Close the connection, which releases every lock.
+
+        :Returns: None
+        """
+        if self._db is not None:
+            try:
+                self._db.close()
+            except DatabaseError:
+                pass
+        self._db = None
+        self.member = None
+        self.owned = set()
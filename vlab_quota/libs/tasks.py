@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""Tracks async tasks of the vLab API without blocking on them"""
+import time
+import threading
+
+import requests
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const, sessions
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+
+
+class _Task:
+    """The state of a single outstanding vLab API task"""
+    __slots__ = ('url', 'headers', 'group', 'label', 'deadline', 'backoff', 'next_poll', 'on_done', 'get_token')
+
+    def __init__(self, url, headers, group, label, deadline, backoff, next_poll, on_done=None, get_token=None):
+        self.url = url
+        self.headers = headers
+        self.group = group
+        self.label = label
+        self.deadline = deadline
+        self.backoff = backoff
+        self.next_poll = next_poll
+        self.on_done = on_done
+        self.get_token = get_token
+
+
+class TaskTracker:
+    """Keeps track of outstanding vLab API tasks, and polls their status with an
+    exponential backoff so the caller never blocks on a task.
+
+    Tasks are registered under a ``group`` (i.e. the user who owns the VMs being
+    deleted). Once every task in a group has finished, ``poll`` reports the
+    labels of the tasks that succeeded, failed, and were deferred for that group.
+
+    :param timeout: How long (in seconds) a task can run before it's considered failed.
+    :type timeout: Integer
+
+    :param min_backoff: How long (in seconds) to wait before the first status check.
+    :type min_backoff: Integer
+
+    :param max_backoff: The longest (in seconds) to wait between status checks.
+    :type max_backoff: Integer
+    """
+    def __init__(self, timeout=const.QUOTA_TASK_TIMEOUT, min_backoff=1, max_backoff=const.QUOTA_TASK_MAX_BACKOFF):
+        self._timeout = timeout
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._results = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def register(self, url, headers, group, label, on_done=None, get_token=None):
+        """Start tracking a task. Safe to call from multiple threads.
+
+        :Returns: None
+
+        :param url: The URL to check the status of the task.
+        :type url: String
+
+        :param headers: The HTTP headers to use when checking the task status.
+        :type headers: Dictionary
+
+        :param group: The collection of tasks this task belongs to.
+        :type group: String
+
+        :param label: A human-friendly identifier for the task.
+        :type label: String
+
+        :param on_done: Optional - Called (with no arguments) once the task
+                        finishes, succeeds or fails.
+        :type on_done: Function
+
+        :param get_token: Optional - Called (with no arguments) before every status
+                          check to obtain the auth token to send. Tasks can outlive
+                          the token in ``headers``.
+        :type get_token: Function
+        """
+        now = time.monotonic()
+        task = _Task(url, headers, group, label,
+                     deadline=now + self._timeout,
+                     backoff=self._min_backoff,
+                     next_poll=now + self._min_backoff,
+                     on_done=on_done,
+                     get_token=get_token)
+        with self._lock:
+            self._tasks.append(task)
+            self._results.setdefault(group, ([], [], []))
+
+    def defer(self, group, label):
+        """Record work that could not be started yet (i.e. too many tasks are
+        already running). It's reported as deferred once the rest of the group
+        finishes, so the caller knows to try again later.
+
+        :Returns: None
+
+        :param group: The collection of tasks this work belongs to.
+        :type group: String
+
+        :param label: A human-friendly identifier for the work.
+        :type label: String
+        """
+        with self._lock:
+            self._results.setdefault(group, ([], [], []))[2].append(label)
+
+    def busy(self, group):
+        """Determine if any task within a group is still running.
+
+        :Returns: Boolean
+
+        :param group: The collection of tasks to check.
+        :type group: String
+        """
+        with self._lock:
+            return group in self._results
+
+    def groups(self):
+        """Find every group that still has a task running.
+
+        :Returns: Set
+        """
+        with self._lock:
+            return set(self._results)
+
+    def poll(self):
+        """Check on every task that's due for a status check.
+
+        Returns a mapping of group to a tuple of (succeeded labels, failed labels,
+        deferred labels) for every group whose tasks have all finished.
+
+        :Returns: Dictionary
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [x for x in self._tasks if x.next_poll <= now]
+        finished = []
+        for task in due:
+            succeeded = self._check(task, now)
+            if succeeded is not None:
+                finished.append((task, succeeded))
+
+        with self._lock:
+            for task, succeeded in finished:
+                self._tasks.remove(task)
+                self._results[task.group][0 if succeeded else 1].append(task.label)
+            running = set(x.group for x in self._tasks)
+            done = {x: self._results.pop(x) for x in list(self._results) if x not in running}
+        for task, _ in finished:
+            if task.on_done is not None:
+                task.on_done()
+        return done
+
+    def _check(self, task, now):
+        """Lookup the status of a single task.
+
+        :Returns: Boolean or None - None means the task is still running
+
+        :param task: The task to check
+        :type task: _Task
+
+        :param now: The current monotonic time
+        :type now: Float
+        """
+        headers = task.headers
+        if task.get_token is not None:
+            headers = dict(task.headers, **{'X-Auth': task.get_token()})
+        try:
+            resp = sessions.request('GET', task.url, headers=headers)
+        except requests.exceptions.RequestException as doh:
+            log.warning('Unable to check task %s for %s: %s', task.url, task.group, doh)
+            status = None
+        else:
+            status = resp.status_code
+
+        if status == 202 or status is None:
+            if now > task.deadline:
+                log.error('Task %s for %s (%s) timed out', task.url, task.group, task.label)
+                return False
+            task.backoff = min(max(task.backoff * 2, 1), self._max_backoff)
+            task.next_poll = now + task.backoff
+            return None
+        elif resp.ok:
+            return True
+        else:
+            log.error('Task %s for %s (%s) failed - %s', task.url, task.group, task.label, resp.content)
+            return False
@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+"""Creates (and caches) the auth tokens used to call the vLab APIs"""
+import os
+import time
+import threading
+
+import jwt
+
+from vlab_quota.libs import const
+
+TOKEN_LIFETIME = 1800 # 30 minutes
+
+
+def _get_secret(location):
+    """Reads a file containing some sort of secret/password
+
+    :Returns: String
+
+    :Raises: RuntimeError
+
+    :param location: The filesystem path to the auth token secret.
+    """
+    if not location:
+        raise RuntimeError('Must supply location of auth secret, supplied: {}'.format(location))
+    else:
+        with open(location) as the_file:
+            secret = the_file.read().strip()
+    return secret
+
+
+class TokenProvider:
+    """Signs auth tokens, and reuses them until shortly before they expire.
+
+    The signing key is read once, and only re-read if the file changes. Changing
+    the key also discards every cached token.
+
+    :param location: The filesystem path to the auth token secret.
+    :type location: String
+
+    :param refresh_margin: How long (in seconds) before a token expires to stop using it.
+    :type refresh_margin: Integer
+    """
+    def __init__(self, location=const.AUTH_PRIVATE_KEY_LOCATION, refresh_margin=const.QUOTA_TOKEN_REFRESH_MARGIN):
+        self._location = location
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._key = None
+        self._key_mtime = None
+        self._tokens = {}
+
+    def get(self, user, client_ip, version=const.AUTH_TOKEN_VERSION):
+        """Obtain a valid auth token. Safe to call from multiple threads.
+
+        :Returns: String
+
+        :param user: The user the token is for
+        :type user: String
+
+        :param client_ip: The IP of the machine that will send requests
+        :type client_ip: String
+
+        :param version: The version of the auth token to create
+        :type version: Integer
+        """
+        now = time.time()
+        cache_key = (user, client_ip, version)
+        with self._lock:
+            key = self._load_key()
+            token, expires_at = self._tokens.get(cache_key, (None, 0))
+            if now < (expires_at - self._refresh_margin):
+                return token
+            # drop expired tokens, so the cache doesn't grow without bound
+            self._tokens = {k: v for k, v in self._tokens.items() if v[1] > now}
+            expires_at = now + TOKEN_LIFETIME
+            claims = {'exp' : expires_at,
+                      'iat' : now,
+                      'iss' : const.VLAB_URL,
+                      'username' : user,
+                      'version' : version,
+                      'client_ip' : client_ip,
+                     }
+            token = jwt.encode(claims, key, algorithm=const.AUTH_TOKEN_ALGORITHM)
+            self._tokens[cache_key] = (token, expires_at)
+            return token
+
+    def _load_key(self):
+        """Read the signing key, if it's not already loaded or if the file changed.
+
+        :Returns: String
+        """
+        if not self._location:
+            raise RuntimeError('Must supply location of auth secret, supplied: {}'.format(self._location))
+        mtime = os.stat(self._location).st_mtime_ns
+        if mtime != self._key_mtime:
+            self._key = _get_secret(self._location)
+            self._key_mtime = mtime
+            self._tokens = {}
+        return self._key
@@ -0,0 +1,216 @@
+# -*- coding: UTF-8 -*-
+"""Lightweight tracing spans, exported as JSON lines to a local file.
+
+Each line in the file is a finished span; spans with the same ``trace_id``
+belong to the same enforcement loop, and ``parent_id`` links a span to the one
+it ran inside of. Tracing is off (and spans cost next to nothing) until
+``configure`` is called.
+"""
+import time
+import uuid
+import threading
+import functools
+from contextlib import contextmanager
+
+import ujson
+from vlab_api_common.std_logger import get_logger
+
+from vlab_quota.libs import const
+
+log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+# The span each thread is currently inside of; contextvars is Python 3.7+
+_LOCAL = threading.local()
+_EXPORTER = None
+
+
+class Span:
+    """A timed unit of work.
+
+    :param name: What the work is, i.e. ``vm.destroy_vms``
+    :type name: String
+
+    :param trace_id: The trace the span belongs to
+    :type trace_id: String
+
+    :param parent_id: The span this one ran inside of; None for the root span
+    :type parent_id: String
+
+    :param tags: Details about the work, like the user and VM involved
+    :type tags: Dictionary
+    """
+    def __init__(self, name, trace_id, parent_id, tags):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.tags = dict(tags)
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self._started = time.monotonic()
+
+    def tag(self, **tags):
+        """Add details about the work, once they're known.
+
+        :Returns: None
+        """
+        self.tags.update(tags)
+
+    def finish(self):
+        """Record how long the work took.
+
+        :Returns: None
+        """
+        self.duration = time.monotonic() - self._started
+
+    def to_dict(self):
+        """The span, as something that can be serialized to JSON.
+
+        :Returns: Dictionary
+        """
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'duration': self.duration,
+                'error': self.error,
+                'thread': threading.current_thread().name,
+                'tags': {k: str(v) for k, v in self.tags.items()}}
+
+
+class _NoopSpan:
+    """Handed out while tracing is off, so callers never have to check."""
+    def tag(self, **tags):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class FileExporter:
+    """Appends every finished span to a file, one JSON object per line.
+
+    :param path: The file to write the spans to
+    :type path: String
+    """
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def export(self, span):
+        """Write a finished span to the file.
+
+        :Returns: None
+
+        :param span: The finished span
+        :type span: Span
+        """
+        line = ujson.dumps(span.to_dict()) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        """Flush and close the file.
+
+        :Returns: None
+        """
+        with self._lock:
+            self._file.close()
+
+
+def configure(path):
+    """Start exporting spans to a file.
+
+    :Returns: None
+
+    :param path: The file to write the spans to
+    :type path: String
+    """
+    global _EXPORTER
+    _EXPORTER = FileExporter(path)
+
+
+def close():
+    """Stop exporting spans.
+
+    :Returns: None
+    """
+    global _EXPORTER
+    exporter, _EXPORTER = _EXPORTER, None
+    if exporter is not None:
+        exporter.close()
+
+
+@contextmanager
+def span(name, **tags):
+    """Time the body of a ``with`` block as a span. Spans started inside the
+    block (in the same thread, or in a function wrapped by ``propagate``)
+    become children of this span.
+
+    :Returns: Span
+
+    :param name: What the work is, i.e. ``vm.destroy_vms``
+    :type name: String
+
+    :param tags: Details about the work, like the user and VM involved
+    :type tags: Dictionary
+    """
+    exporter = _EXPORTER
+    if exporter is None:
+        yield _NOOP_SPAN
+        return
+    parent = _current()
+    if parent is None:
+        the_span = Span(name, trace_id=uuid.uuid4().hex, parent_id=None, tags=tags)
+    else:
+        the_span = Span(name, trace_id=parent.trace_id, parent_id=parent.span_id, tags=tags)
+    _LOCAL.span = the_span
+    try:
+        yield the_span
+    except BaseException as doh:
+        the_span.error = '{}: {}'.format(type(doh).__name__, doh)
+        raise
+    finally:
+        _LOCAL.span = parent
+        the_span.finish()
+        try:
+            exporter.export(the_span)
+        except (OSError, ValueError) as doh:
+            # ValueError if the file was closed while a span was in flight
+            log.warning('Unable to export span %s: %s', name, doh)
+
+
+def _current():
+    """The span this thread is currently inside of.
+
+    :Returns: Span or None
+    """
+    return getattr(_LOCAL, 'span', None)
+
+
+def propagate(func):
+    """Make spans started by ``func`` children of the current span, even when
+    it's run in another thread (i.e. submitted to a ThreadPoolExecutor).
+
+    The current span is captured when ``propagate`` is called, so call it at
+    submission time, not from inside the other thread.
+
+    :Returns: Callable
+
+    :param func: The function that will run in another thread
+    :type func: Callable
+    """
+    if _EXPORTER is None:
+        return func
+    parent = _current()
+
+    @functools.wraps(func)
+    def run_in_span(*args, **kwargs):
+        previous = _current()
+        _LOCAL.span = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _LOCAL.span = previous
+    return run_in_span
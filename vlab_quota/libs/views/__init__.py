@@ -1,3 +1,5 @@
 # -*- coding: UTF-8 -*-
 from .healthcheck import HealthView
 from .quota import QuotaView
+from .violations import ViolationsView
+from .events import EventsView
@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+"""Defines the API for summarizing the history of quota enforcement"""
+import time
+
+import ujson
+from flask_classy import request, Response
+from vlab_api_common import BaseView, get_logger, describe, requires
+
+from vlab_quota.libs import const, Database
+
+logger = get_logger(__name__, loglevel=const.QUOTA_LOG_LEVEL)
+DEFAULT_BUCKET = 86400 # seconds; one day
+DEFAULT_RANGE = 30 * 86400 # seconds; the last 30 days
+MAX_BUCKETS = 1000 # keeps the response (and the GROUP BY) a sane size
+
+
+def _int_arg(name, default):
+    """Read an integer from the query string.
+
+    :Returns: Integer
+
+    :Raises: ValueError
+
+    :param name: The name of the query parameter
+    :type name: String
+
+    :param default: The value to use when the parameter isn't supplied
+    :type default: Integer
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('{} must be an integer, supplied: {}'.format(name, value))
+
+
+def _bad_request(message):
+    """Create a 400 response.
+
+    :Returns: flask.wrappers.Response
+
+    :param message: What was wrong with the request
+    :type message: String
+    """
+    resp = Response(ujson.dumps({'error': message}))
+    resp.status_code = 400
+    return resp
+
+
+class EventsView(BaseView):
+    """API end point for summarizing the quota history over time"""
+    route_base = '/api/1/quota/events'
+    GET_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                  "description": "Return the number of quota events, per type of event, within each bucket of time"
+                 }
+
+    # version=None because ``acl_in_token`` stops checking at the first ACL
+    # that's an int, and would let any v2 token through.
+    @requires(username=const.QUOTA_ADMINS, version=None, verify=const.VLAB_VERIFY_TOKEN)
+    @describe(get=GET_SCHEMA)
+    def get(self, *args, **kwargs):
+        """Count the quota events between ``start`` and ``end`` (EPOCH timestamps),
+        in buckets of ``bucket`` seconds. Defaults to daily buckets for the last 30 days.
+        """
+        now = int(time.time())
+        try:
+            end = _int_arg('end', now)
+            start = _int_arg('start', end - DEFAULT_RANGE)
+            bucket = _int_arg('bucket', DEFAULT_BUCKET)
+        except ValueError as doh:
+            return _bad_request('{}'.format(doh))
+        if start < 0 or start >= end:
+            return _bad_request('start must be a positive EPOCH timestamp before end')
+        if bucket < 1 or (end - start) / bucket > MAX_BUCKETS:
+            return _bad_request('bucket must be positive, and split the range into at most {} buckets'.format(MAX_BUCKETS))
+        with Database(pooled=True) as db:
+            rows = db.event_aggregates(start, end, bucket)
+        aggregates = [{'start': bucket_start, 'event': event, 'count': count, 'users': users, 'vms': vms}
+                      for bucket_start, event, count, users, vms in rows]
+        resp_data = {'content': {'start': start,
+                                 'end': end,
+                                 'bucket': bucket,
+                                 'aggregates': aggregates}}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 200
+        return resp
@@ -4,11 +4,23 @@ import ujson
 from flask_classy import request, Response
 from vlab_api_common import BaseView, get_logger, describe, requires
 
-from vlab_quota.libs import const, Database
+from vlab_quota.libs import const, Database, quota_cache
 
 logger = get_logger(__name__, loglevel=const.QUOTA_LOG_LEVEL)
 
 
+def _lookup_user(username):
+    """Obtain the quota violation info of a user from the database.
+
+    :Returns: Tuple
+
+    :param username: The name of the user
+    :type username: String
+    """
+    with Database(pooled=True) as db:
+        return db.user_info(username)
+
+
 class QuotaView(BaseView):
     """API end point for checking on quota violations"""
     route_base = '/api/1/quota'
@@ -21,8 +33,7 @@ class QuotaView(BaseView):
     def get(self, *args, **kwargs):
         """Obtain quota information"""
         username = kwargs['token']['username']
-        with Database() as db:
-            exceeded_on, last_notified = db.user_info(username)
+        exceeded_on, last_notified = quota_cache.get_cache().get(username, _lookup_user)
         resp_data = {'content': {
                         'exceeded_on': exceeded_on,
                         'last_notified': last_notified,
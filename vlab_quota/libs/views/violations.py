@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+"""Defines the API for listing every user that has exceeded their inventory quota"""
+import ujson
+from flask_classy import FlaskView, request, Response
+from vlab_api_common import get_logger, requires
+
+from vlab_quota.libs import const, Database
+
+logger = get_logger(__name__, loglevel=const.QUOTA_LOG_LEVEL)
+ROWS_PER_CHUNK = 500
+
+
+def _stream(db, after, limit):
+    """Yield the quota violations as newline-delimited JSON, a chunk of rows at a time.
+
+    :Returns: Generator
+
+    :param db: A connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param after: Only list users whose name sorts after this one.
+    :type after: String
+
+    :param limit: The most users to list.
+    :type limit: Integer
+    """
+    chunk = []
+    for username, exceeded_on, last_notified in db.iter_violations(after=after, limit=limit, chunk_size=ROWS_PER_CHUNK):
+        chunk.append(ujson.dumps({'username': username,
+                                  'exceeded_on': exceeded_on,
+                                  'last_notified': last_notified}))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+class ViolationsView(FlaskView):
+    """API end point for listing every quota violation.
+
+    The response is streamed, so it's a plain FlaskView; BaseView buffers the
+    whole response body to add the standard JSON envelope.
+    """
+    route_base = '/api/1/quota/violations'
+    trailing_slash = False
+
+    # version=None because ``acl_in_token`` stops checking at the first ACL
+    # that's an int, and would let any v2 token through.
+    @requires(username=const.QUOTA_ADMINS, version=None, verify=const.VLAB_VERIFY_TOKEN)
+    def get(self, *args, **kwargs):
+        """List every quota violation, as newline-delimited JSON, ordered by username.
+
+        Supply ``limit`` to page through the results, and the last username of
+        the previous page as ``after`` to get the next page.
+        """
+        after = request.args.get('after')
+        limit = request.args.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError()
+            except ValueError:
+                resp = Response(ujson.dumps({'error': 'limit must be a positive integer, supplied: {}'.format(limit)}))
+                resp.status_code = 400
+                resp.headers['Content-Type'] = 'application/json'
+                return resp
+        db = Database(pooled=True)
+        resp = Response(_stream(db, after, limit), mimetype='application/x-ndjson')
+        # Runs once the response is sent, even if the client disconnects early
+        resp.call_on_close(db.close)
+        resp.status_code = 200
+        return resp
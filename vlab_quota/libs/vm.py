@@ -3,20 +3,77 @@
 import uuid
 import time
 import random
-import urllib3
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import jwt
-import requests
 from vlab_api_common.std_logger import get_logger
-from vlab_inf_common.vmware import vCenter, vim, virtual_machine
+from vlab_inf_common.vmware import vCenter, vim
 
-from vlab_quota.libs import const
+from vlab_quota.libs import const, sessions, tracing
+from vlab_quota.libs.tokens import TokenProvider
+from vlab_quota.libs.inventory import get_vm_details
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+# Caps the number of VM deletions in flight, across all users. With a
+# TaskTracker, a slot is held until the delete task finishes, not just
+# while the DELETE request is sent.
+_INFLIGHT_DELETES = threading.BoundedSemaphore(const.QUOTA_MAX_INFLIGHT_DELETES)
+_TOKENS = TokenProvider()
 
 
-def _call_api(url, token, method='get', payload=None, task_call=True):
+class DestroyError(Exception):
+    """Raised when some of a user's VMs could not be deleted.
+
+    :attribute deleted: The names of the VMs that were deleted (or started
+                        being deleted) before the error.
+    :attribute error: The first error hit while deleting the other VMs.
+    """
+    def __init__(self, message, deleted, error):
+        super(DestroyError, self).__init__(message)
+        self.deleted = deleted
+        self.error = error
+
+
+class _Slot:
+    """An in-flight deletion slot, reserved from ``_INFLIGHT_DELETES``.
+    Releasing it more than once is harmless, so both the TaskTracker and the
+    error handling can release it without double-counting.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = True
+
+    def release(self):
+        """Hand the slot back, if it hasn't been already.
+
+        :Returns: None
+        """
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        _INFLIGHT_DELETES.release()
+
+
+def _reserve_slots(count):
+    """Reserve up to ``count`` in-flight deletion slots, without waiting for any.
+
+    Waiting isn't an option with a TaskTracker; slots are only released when
+    the worker polls the tracker, which it can't do while it waits.
+
+    :Returns: List of _Slot
+
+    :param count: How many slots are wanted
+    :type count: Integer
+    """
+    slots = []
+    while len(slots) < count and _INFLIGHT_DELETES.acquire(blocking=False):
+        slots.append(_Slot())
+    return slots
+
+
+def _call_api(url, token, method='get', payload=None, task_call=True, on_task=None):
     """Make an HTTP request to a vLab API, and return the response body.
 
     :Returns: Dictionary
@@ -37,45 +94,40 @@ def _call_api(url, token, method='get', payload=None, task_call=True):
 
     :param task_call: Set to False if the initial request does not return a job task
     :type task_call: Boolean
+
+    :param on_task: Optional - Instead of blocking on the job task, call this with
+                    the task URL and HTTP headers, and return the initial response.
+    :type on_task: Function
     """
     headers = {'User-Agent': 'vLab Quota',
                'X-Auth': token,
                'X-REQUEST-ID' : uuid.uuid4().hex}
-    caller = getattr(requests, method.lower())
-    resp = caller(url, headers=headers, json=payload, verify=False)
-    task_url = None
-    if task_call and resp.ok:
-        task_url = resp.links['status']['url']
-        while resp.status_code == 202:
-            resp = requests.get(task_url, headers=headers, verify=False)
-            time.sleep(1)
-    if not resp.ok:
-        url_used = task_url if task_url else url
-        error = 'Failure for {} on {} - {}'.format(method, url_used, resp.content)
-        log.error(error)
-        resp.raise_for_status()
-    return resp.json()
-
-
-def _get_secret(location=const.AUTH_PRIVATE_KEY_LOCATION):
-    """Reads a file containing some sort of secret/password
-
-    :Returns: String
-
-    :Raises: RuntimeError
-
-    :param location: The filesystem path to the auth token secret.
-    """
-    if not location:
-        raise RuntimeError('Must supply location of auth secret, supplied: {}'.format(location))
-    else:
-        with open(location) as the_file:
-            secret = the_file.read().strip()
-    return secret
+    with tracing.span('vm._call_api', method=method.upper(), url=url, request_id=headers['X-REQUEST-ID']) as span:
+        resp = sessions.request(method.upper(), url, headers=headers, json=payload)
+        span.tag(status=resp.status_code)
+        task_url = None
+        if task_call and resp.ok:
+            task_url = resp.links['status']['url']
+            if on_task is not None:
+                on_task(task_url, headers)
+                return resp.json()
+            with tracing.span('vm.poll_task', url=task_url) as poll_span:
+                polls = 0
+                while resp.status_code == 202:
+                    resp = sessions.request('GET', task_url, headers=headers)
+                    polls += 1
+                    time.sleep(1)
+                poll_span.tag(polls=polls, status=resp.status_code)
+        if not resp.ok:
+            url_used = task_url if task_url else url
+            error = 'Failure for {} on {} - {}'.format(method, url_used, resp.content)
+            log.error(error)
+            resp.raise_for_status()
+        return resp.json()
 
 
 def _generate_token(user, version=const.AUTH_TOKEN_VERSION, client_ip=const.VLAB_SERVER_IP):
-    """Create an auth token
+    """Obtain an auth token; tokens are cached until shortly before they expire.
 
     :Returns: String
 
@@ -88,18 +140,10 @@ def _generate_token(user, version=const.AUTH_TOKEN_VERSION, client_ip=const.VLAB
     :param client_ip: The IP of the machine that will send requests
     :type client_ip: String
     """
-    issued_at_timestamp = time.time()
-    claims = {'exp' : issued_at_timestamp + 1800, # 30 minutes
-              'iat' : issued_at_timestamp,
-              'iss' : const.VLAB_URL,
-              'username' : user,
-              'version' : version,
-              'client_ip' : client_ip,
-             }
-    return jwt.encode(claims, _get_secret(), algorithm=const.AUTH_TOKEN_ALGORITHM)
+    return _TOKENS.get(user, client_ip=client_ip, version=version)
 
 
-def _delete_vm(user, vm_name, vm_type):
+def _delete_vm(user, vm_name, vm_type, tracker=None, on_done=None):
     """Delete the actual virtual machine
 
     :Returns: None
@@ -113,67 +157,286 @@ def _delete_vm(user, vm_name, vm_type):
     :param vm_type: The category of VM beging deleted. Provided so the correct
                     API can be called.
     :type vm_type: String
+
+    :param tracker: Optional - Register the delete task here instead of blocking on it.
+    :type tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param on_done: Optional - Called by the ``tracker`` once the delete task finishes.
+    :type on_done: Function
     """
     vm_url = 'https://{}/api/2/inf/{}'.format(const.VLAB_FQDN, vm_type.lower())
     token = _generate_token(user, client_ip=const.VLAB_LOCAL_IP)
     payload = {'name': vm_name}
-    _call_api(vm_url, token, method='DELETE', payload=payload, task_call=True)
+    on_task = None
+    if tracker is not None:
+        # A fresh token for every status check; the task can outlive this one
+        get_token = functools.partial(_generate_token, user, client_ip=const.VLAB_LOCAL_IP)
+        on_task = functools.partial(tracker.register, group=user, label=vm_name, on_done=on_done,
+                                    get_token=get_token)
+    _call_api(vm_url, token, method='DELETE', payload=payload, task_call=True, on_task=on_task)
+
+
+def _portmap_url(user):
+    """The URL for the portmapping rules API of a user's defaultGateway.
+
+    :Returns: String
+
+    :param user: The user that owns the defaultGateway
+    :type user: String
+    """
+    return 'https://{}.{}/api/1/ipam/portmap'.format(user, const.VLAB_FQDN)
+
+
+def _get_portmap_index(user):
+    """Download a user's portmapping rules once, and index them by VM name.
+
+    :Returns: Dictionary - VM name to list of conn_port
+
+    :param user: The user that's getting some VMs deleted
+    :type user: String
+    """
+    token = _generate_token(user)
+    portmap_data = _call_api(_portmap_url(user), token, method='GET', task_call=False)
+    index = {}
+    for conn_port, info in portmap_data['content']['ports'].items():
+        index.setdefault(info['name'], []).append(int(conn_port))
+    return index
 
 
-def _delete_portmap_rules(user, vm_name):
-    """Delete all portmapping rules associated to the VM getting deleted.
+def _delete_portmap_rules(user, conn_ports):
+    """Concurrently delete a batch of a user's portmapping rules. The requests
+    share the pooled, keep-alive connection(s) to the user's gateway.
 
     :Returns: None
 
     :param user: The user that's getting some VMs deleted
     :type user: String
 
+    :param conn_ports: The portmapping rules to delete
+    :type conn_ports: List
+    """
+    if not conn_ports:
+        return
+    user_gateway_url = _portmap_url(user)
+    token = _generate_token(user)
+    with ThreadPoolExecutor(max_workers=min(len(conn_ports), const.QUOTA_HTTP_POOL_SIZE)) as pool:
+        jobs = [pool.submit(tracing.propagate(_call_api), user_gateway_url, token, method='DELETE',
+                            payload={'conn_port': x}, task_call=False) for x in conn_ports]
+        for job in jobs:
+            job.result()
+
+
+def _random_first(vms):
+    """Order VMs randomly.
+
+    :Returns: List
+
+    :param vms: The VMs that could be deleted
+    :type vms: List of vlab_quota.libs.inventory.VMDetails
+    """
+    return random.sample(vms, len(vms))
+
+
+def _oldest_first(vms):
+    """Order VMs from the oldest to the newest.
+
+    :Returns: List
+
+    :param vms: The VMs that could be deleted
+    :type vms: List of vlab_quota.libs.inventory.VMDetails
+    """
+    return sorted(vms, key=lambda x: x.created)
+
+
+def _powered_off_first(vms):
+    """Order VMs so that powered off VMs come first; ties are broken randomly.
+
+    :Returns: List
+
+    :param vms: The VMs that could be deleted
+    :type vms: List of vlab_quota.libs.inventory.VMDetails
+    """
+    return sorted(_random_first(vms), key=lambda x: x.power_state == 'poweredOn')
+
+
+def _largest_first(vms):
+    """Order VMs from the most to the least amount of storage consumed.
+
+    :Returns: List
+
+    :param vms: The VMs that could be deleted
+    :type vms: List of vlab_quota.libs.inventory.VMDetails
+    """
+    return sorted(vms, key=lambda x: x.size, reverse=True)
+
+
+VICTIM_POLICIES = {'random': _random_first,
+                   'oldest': _oldest_first,
+                   'powered-off-first': _powered_off_first,
+                   'largest-first': _largest_first,
+                  }
+
+
+def check_victim_policy(policy=const.QUOTA_VICTIM_POLICY):
+    """Make sure a victim policy is defined, so a typo fails at startup instead
+    of the first time a VM needs to be deleted.
+
+    :Returns: Function - Orders VMs by which to delete first
+
+    :Raises: ValueError - If the policy is not defined
+
+    :param policy: The name of the policy that decides which VMs get deleted first.
+    :type policy: String
+    """
+    try:
+        return VICTIM_POLICIES[policy]
+    except KeyError:
+        raise ValueError('Unknown victim policy {}, valid options are: {}'.format(policy, list(VICTIM_POLICIES.keys())))
+
+
+def _pick_victims(user, user_vms, count, policy=const.QUOTA_VICTIM_POLICY):
+    """Choose which VMs to delete, in a single pass. VMs that are deploying, or
+    failed to deploy, are skipped because the vLab API cannot delete them.
+
+    :Returns: List of (vm_name, vm_type) tuples
+
+    :Raises: ValueError - If the policy is not defined
+
+    :param user: The user that's getting some VMs deleted
+    :type user: String
+
+    :param user_vms: The VMs owned by the user (excluding their defaultGateway)
+    :type user_vms: List of vlab_quota.libs.inventory.VMDetails
+
+    :param count: How many VMs to choose
+    :type count: Integer
+
+    :param policy: The name of the policy that decides which VMs get deleted first.
+    :type policy: String
+    """
+    order = check_victim_policy(policy)
+    deletable = []
+    for the_vm in user_vms:
+        if the_vm.component == 'Unknown':
+            log.info("Skipping VM %s owned by %s: VM cannot be deleted at this time", the_vm.name, user)
+        else:
+            deletable.append(the_vm)
+    victims = [(x.name, x.component.lower()) for x in order(deletable)[:max(0, count)]]
+    if len(victims) < count:
+        log.warning("Only able to delete %s of %s VMs owned by %s", len(victims), count, user)
+    return victims
+
+
+def _destroy_vm(user, vm_name, vm_type, tracker=None, slot=None):
+    """Delete a single VM.
+
+    :Returns: String - The name of the deleted VM
+
+    :param user: The user that's getting some VMs deleted
+    :type user: String
+
     :param vm_name: The name of the VM being deleted
     :type vm_name: String
+
+    :param vm_type: The category of VM beging deleted.
+    :type vm_type: String
+
+    :param tracker: Optional - Register the delete task here instead of blocking on it.
+    :type tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param slot: Optional - An in-flight deletion slot that's already reserved;
+                 the ``tracker`` releases it once the delete task finishes.
+    :type slot: _Slot
     """
-    user_gateway_url = 'https://{}.{}/api/1/ipam/portmap'.format(user, const.VLAB_FQDN)
-    token = _generate_token(user)
-    portmap_data = _call_api(user_gateway_url, token, method='GET', task_call=False)
-    for conn_port, info in portmap_data['content']['ports'].items():
-        if info['name'] == vm_name:
-            payload = {'conn_port': int(conn_port)}
-            _call_api(user_gateway_url, token, method='DELETE', payload=payload, task_call=False)
+    with tracing.span('vm._destroy_vm', user=user, vm=vm_name, vm_type=vm_type) as span:
+        if slot is None:
+            queued = time.monotonic()
+            with _INFLIGHT_DELETES:
+                # time spent waiting behind other deletions, not on the vLab API
+                span.tag(queued_for=time.monotonic() - queued)
+                _delete_vm(user, vm_name, vm_type, tracker)
+        else:
+            registered = False
+            try:
+                _delete_vm(user, vm_name, vm_type, tracker, on_done=slot.release)
+                registered = True
+            finally:
+                if not registered:
+                    slot.release()
+        if tracker is None:
+            log.info("Deleted VM %s, owned by %s", vm_name, user)
+        else:
+            log.info("Started deleting VM %s, owned by %s", vm_name, user)
+    return vm_name
 
 
-def destroy_vms(user, vcenter):
+def destroy_vms(user, vcenter, tracker=None):
     """Delete enough VMs to resolve the soft-quota violation.
 
-    The VMs deleted are randomly chosen, and this function returns a list of VM
-    names that were deleted.
+    The VMs deleted are chosen up front (randomly, unless QUOTA_VICTIM_POLICY
+    says otherwise), then deleted concurrently. This function returns a list of VM names that were deleted. When a ``tracker`` is
+    supplied, the delete tasks are registered with it instead of blocking until
+    they complete, and the list is of VMs that started being deleted. Only as
+    many deletions start as there are free QUOTA_MAX_INFLIGHT_DELETES slots;
+    the rest are left for a later loop.
 
     :Returns: List
 
+    :Raises: DestroyError - If any VM could not be deleted; it holds the VMs that were.
+
     :param user: The user that's getting some VMs deleted
     :type user: String
 
     :param vcenter: An object for interacting with the vCenter API.
     :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param tracker: Optional - Register the delete tasks here instead of blocking on them.
+    :type tracker: vlab_quota.libs.tasks.TaskTracker
     """
-    user_folder = vcenter.get_by_name(name=user, vimtype=vim.Folder)
-    user_vms = set([x for x in user_folder.childEntity if not x.name == 'defaultGateway'])
-    deleted_vms = []
-    while len(user_vms) > const.VLAB_QUOTA_LIMIT:
-        unlucky_vm = random.sample(user_vms, 1)[0] # b/c random.sample returns a list
-        vm_info = virtual_machine.get_info(vcenter, unlucky_vm, user)
-        vm_name = unlucky_vm.name
-        if vm_info['meta']['component'] == 'Unknown':
-            log.info("Skipping VM %s owned by %s: VM cannot be deleted at this time", vm_name, user)
+    with tracing.span('vm.destroy_vms', user=user) as span:
+        with tracing.span('vm.get_vm_details', user=user):
+            user_folder = vcenter.get_by_name(name=user, vimtype=vim.Folder)
+            user_vms = [x for x in get_vm_details(vcenter, user_folder) if not x.name == 'defaultGateway']
+        victims = _pick_victims(user, user_vms, len(user_vms) - const.VLAB_QUOTA_LIMIT, const.QUOTA_VICTIM_POLICY)
+        deferred = []
+        if tracker is None:
+            slots = [None] * len(victims)
         else:
-            _delete_portmap_rules(user, vm_name)
-            log.info("Delete portmapping rules for VM %s owned by %s", vm_name, user)
-            _delete_vm(user, vm_name, vm_info['meta']['component'].lower())
-            deleted_vms.append(vm_name)
-            log.info("Deleted VM %s, owned by %s", vm_name, user)
-            # Removing the VM from the set *only* if we delete it avoids an
-            # edge case where a user is over by 1 VM, and the one we randomly
-            # choose to delete is either deploying or a failed deployment.
-            # While this could potentially create an infinite loop, if it did
-            # we'd probably have "bigger problems" going on, and fixing those
-            # "bigger problems" would resolve the infinite loop.
-            user_vms.discard(unlucky_vm)
-    return deleted_vms
+            # Reserved before touching the portmap rules, so a VM never loses
+            # its rules without also being deleted.
+            slots = _reserve_slots(len(victims))
+            if len(slots) < len(victims):
+                log.info("Too many VM deletions in flight; deleting %s of %s VMs owned by %s now",
+                         len(slots), len(victims), user)
+                victims, deferred = victims[:len(slots)], victims[len(slots):]
+        span.tag(vms=','.join(x for x, _ in victims))
+        if not victims:
+            return []
+        started = False
+        try:
+            with tracing.span('vm.get_portmap_index', user=user):
+                portmap_index = _get_portmap_index(user)
+            conn_ports = [x for vm_name, _ in victims for x in portmap_index.get(vm_name, [])]
+            with tracing.span('vm.delete_portmap_rules', user=user, rules=len(conn_ports)):
+                _delete_portmap_rules(user, conn_ports)
+            started = True
+        finally:
+            if not started:
+                for slot in slots:
+                    if slot is not None:
+                        slot.release()
+        # Reported as failed once the started deletions finish, so the user's
+        # violation is kept and the rest are deleted in a later loop.
+        for vm_name, _ in deferred:
+            tracker.defer(user, vm_name)
+        log.info("Deleted portmapping rules for VMs %s owned by %s", ','.join(x for x, _ in victims), user)
+        with ThreadPoolExecutor(max_workers=const.QUOTA_USER_DELETE_WORKERS) as pool:
+            jobs = [pool.submit(tracing.propagate(_destroy_vm), user, vm_name, vm_type, tracker, slot)
+                    for (vm_name, vm_type), slot in zip(victims, slots)]
+        # Don't lose track of the VMs that were deleted just because another one failed
+        deleted_vms = [x.result() for x in jobs if x.exception() is None]
+        errors = [x.exception() for x in jobs if x.exception() is not None]
+        if errors:
+            raise DestroyError('Failed to delete {} of {} VMs owned by {}'.format(len(errors), len(jobs), user),
+                               deleted_vms, errors[0])
+        return deleted_vms
@@ -2,30 +2,69 @@
 """Enforces the vLab quota soft-limit policy"""
 import time
 import atexit
+import socket
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
 
 import ldap3
+import requests
+from pyVmomi import vmodl
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
 from vlab_inf_common.vmware import vCenter, vim
 from vlab_api_common.std_logger import get_logger
 
-from vlab_quota.libs.vm import destroy_vms
-from vlab_quota.libs import const, Database, notify
+from vlab_quota.libs.vm import destroy_vms, check_victim_policy, DestroyError
+from vlab_quota.libs.inventory import get_vm_counts, InventoryTracker
+from vlab_quota.libs.tasks import TaskTracker
+from vlab_quota.libs.cache import TTLCache
+from vlab_quota.libs.ldap_pool import LdapPool
+from vlab_quota.libs.outbox import Outbox, OutboxSender
+from vlab_quota.libs.scheduler import Scheduler
+from vlab_quota.libs.sharding import ShardCoordinator
+from vlab_quota.libs.events import EventLog
+from vlab_quota.libs.database import DatabaseError
+from vlab_quota.libs import const, Database, notify, sessions, metrics, tracing, events
 
 LOOP_INTERVAL = 10 # seconds
+LDAP_BATCH_SIZE = 200 # users per LDAP search; keeps the OR-filter a sane size
+# Socket errors that pyVmomi and smtplib let through unwrapped. Not every
+# OSError; a missing file or bad permissions isn't going to fix itself.
+NETWORK_ERRORS = (ConnectionError, socket.timeout, socket.gaierror)
+# Errors that mean a backend is unhealthy; see ``_failed_backend``.
+BACKEND_ERRORS = (DatabaseError, LDAPException, notify.NotifyError, smtplib.SMTPException,
+                  requests.exceptions.RequestException, vmodl.MethodFault) + NETWORK_ERRORS
+# Failures that start a new vCenter session; a socket error might be from vCenter
+VCENTER_BACKENDS = ('vcenter', 'network')
 log = get_logger(name=__name__, loglevel=const.QUOTA_LOG_LEVEL)
+_EMAIL_CACHE = TTLCache(maxsize=const.QUOTA_EMAIL_CACHE_SIZE, ttl=const.QUOTA_EMAIL_CACHE_TTL)
+# Users LDAP has no email for; otherwise they're searched for every loop
+_NO_EMAIL_CACHE = TTLCache(maxsize=const.QUOTA_EMAIL_CACHE_SIZE, ttl=const.QUOTA_EMAIL_MISS_TTL)
 
 
-def _get_violators(vcenter):
+def _get_violators(vcenter, tracker=None, shards=None):
     """Obtain a list of users who have exceeded their VM quota limit
 
     :Returns: List
 
     :param vcenter: An object for interacting with the vCenter API.
     :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param tracker: Optional - Supply to use the incrementally tracked inventory
+                    instead of scanning vCenter.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+
+    :param shards: Optional - Only return the users in the shards this worker owns.
+    :type shards: vlab_quota.libs.sharding.ShardCoordinator
     """
-    users = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+    if tracker is None:
+        vm_counts = get_vm_counts(vcenter, path=const.INF_VCENTER_TOP_LVL_DIR)
+    else:
+        vm_counts = tracker.vm_counts()
     vm_quota_limit = const.VLAB_QUOTA_LIMIT + 1 # +1 to account for the defaultGateway
-    # len(x.childEntity) -1 to account for the defaultGateway "down/up the stack"
-    return {x.name: len(x.childEntity) -1 for x in users.childEntity if len(x.childEntity) > vm_quota_limit}
+    # vm_count -1 to account for the defaultGateway "down/up the stack"
+    return {user: vm_count -1 for user, vm_count in vm_counts.items()
+            if vm_count > vm_quota_limit and (shards is None or shards.owns(user))}
 
 
 def _grace_period_exceeded(violation_date):
@@ -41,28 +80,51 @@ def _grace_period_exceeded(violation_date):
     return int(time.time()) > (violation_date + const.QUOTA_GRACE_PERIOD)
 
 
-def _get_user_email(user, ldap_conn):
-    """Lookup a user's email so we can notify them.
+def _get_user_emails(users, ldap_pool):
+    """Lookup the emails of many users so we can notify them.
 
-    :Returns: Boolean
+    Emails are cached, and any cache misses are looked up with a single LDAP
+    search (per batch of ``LDAP_BATCH_SIZE`` users). Users not found in the
+    LDAP server are not in the returned mapping, and aren't searched for again
+    until ``QUOTA_EMAIL_MISS_TTL`` passes.
 
-    :Raises: RuntimeError - If user not found in LDAP server
+    :Returns: Dictionary - samAccountName to email
 
-    :param user: The samAccountName of the vLab user
-    :type user: String
+    :param users: The samAccountNames of the vLab users
+    :type users: Iterable
 
-    :param ldap_conn: An authenicated, bound connection to an LDAP server
-    :type ldap_conn: ldap3.Connection
+    :param ldap_pool: The pool of connections to the LDAP server
+    :type ldap_pool: vlab_quota.libs.ldap_pool.LdapPool
     """
-    search_filter = '(&(objectclass=User)(sAMAccountName=%s))' % user
-    ldap_conn.search(search_base=const.AUTH_SEARCH_BASE,
-                     search_filter=search_filter,
-                     attributes=['mail'])
-    if ldap_conn.entries:
-        user_email = ldap_conn.entries[0]['mail'].value
-        return user_email
-    else:
-        raise RuntimeError('Unable to lookup email for %s', user)
+    emails = {}
+    missing = {}
+    for user in users:
+        user_email = _EMAIL_CACHE.get(user)
+        if user_email:
+            emails[user] = user_email
+        elif _NO_EMAIL_CACHE.get(user):
+            continue
+        else:
+            # sAMAccountName is case-insensitive in AD
+            missing[user.lower()] = user
+    names = list(missing.keys())
+    for idx in range(0, len(names), LDAP_BATCH_SIZE):
+        batch = names[idx:idx + LDAP_BATCH_SIZE]
+        user_filter = ''.join('(sAMAccountName=%s)' % escape_filter_chars(missing[x]) for x in batch)
+        search_filter = '(&(objectclass=User)(|%s))' % user_filter
+        entries = ldap_pool.search(search_base=const.AUTH_SEARCH_BASE,
+                                   search_filter=search_filter,
+                                   attributes=['sAMAccountName', 'mail'])
+        for entry in entries:
+            user = missing.get(str(entry['sAMAccountName'].value).lower())
+            user_email = entry['mail'].value
+            if user and user_email:
+                emails[user] = user_email
+                _EMAIL_CACHE.set(user, user_email)
+    for user in set(missing.values()) - set(emails.keys()):
+        log.error('Unable to lookup email for %s', user)
+        _NO_EMAIL_CACHE.set(user, True)
+    return emails
 
 
 def _get_ldap_password(location=const.AUTH_BIND_PASSWORD_LOCATION):
@@ -87,18 +149,135 @@ def _get_ldap_conn():
 
     :Returns: ldap3.core.connection.Connection
     """
-    server = ldap3.Server(const.AUTH_LDAP_URL)
+    server = ldap3.Server(const.AUTH_LDAP_URL, connect_timeout=const.QUOTA_LDAP_TIMEOUT)
     password = _get_ldap_password()
-    conn = ldap3.Connection(server, const.AUTH_BIND_USER, password, auto_bind=True)
+    conn = ldap3.Connection(server, const.AUTH_BIND_USER, password, auto_bind=True,
+                            receive_timeout=const.QUOTA_LDAP_TIMEOUT)
     return conn
 
 
-def _enforce_quotas(vcenter, db, ldap_conn):
+def _enforce_quotas(vcenter, db, ldap_pool, tracker=None, task_tracker=None, mailer=None, shards=None, event_log=None):
     """Main business logic for enforcing soft-quotas
 
-    Returns a set of users with a quota violation
+    Returns a mapping of every user with a quota violation to their
+    (violation_date, last_time_notified).
+
+    :Returns: Dictionary
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param ldap_pool: The pool of connections to the LDAP server.
+    :type ldap_pool: vlab_quota.libs.ldap_pool.LdapPool
 
-    :Returns: Set
+    :param tracker: Optional - The incrementally tracked vCenter inventory.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+
+    :param task_tracker: Optional - Track VM deletions instead of blocking on them.
+    :type task_tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param mailer: Optional - Queue emails on this Mailer instead of sending each one on its own connection.
+    :type mailer: vlab_quota.libs.notify.Mailer
+
+    :param shards: Optional - Only enforce the quota of users in the shards this worker owns.
+    :type shards: vlab_quota.libs.sharding.ShardCoordinator
+
+    :param event_log: Optional - Record what was done in the quota history.
+    :type event_log: vlab_quota.libs.events.EventLog
+    """
+    with tracing.span('worker._enforce_quotas') as span:
+        with metrics.STAGE_SECONDS.time(stage='vcenter'), tracing.span('worker._get_violators'):
+            violators = _get_violators(vcenter, tracker, shards)
+        metrics.VIOLATORS.set(len(violators))
+        span.tag(violators=len(violators))
+        log.info('Users exceeding quota: {}'.format(','.join(violators)))
+        to_delete = []
+        to_warn = []
+        violators_info = db.users_info(violators.keys())
+        for violator, vm_count in violators.items():
+            if task_tracker is not None and task_tracker.busy(violator):
+                log.debug('VMs owned by %s are still being deleted', violator)
+                continue
+            violation_date, last_time_notified = violators_info[violator]
+            if _grace_period_exceeded(violation_date):
+                to_delete.append(violator)
+            elif notify.should_send_warning(violation_date, last_time_notified):
+                to_warn.append((violator, vm_count, violation_date))
+
+        # Only lookup the emails of users that will actually get an email
+        to_email = [x[0] for x in to_warn]
+        if task_tracker is None:
+            to_email += to_delete
+        with tracing.span('worker._get_user_emails', users=len(to_email)):
+            emails = _get_user_emails(to_email, ldap_pool) if to_email else {}
+
+        with ThreadPoolExecutor(max_workers=const.QUOTA_DELETE_WORKERS) as delete_pool, \
+             ThreadPoolExecutor(max_workers=const.QUOTA_NOTIFY_WORKERS) as notify_pool:
+            delete_jobs = []
+            warn_jobs = []
+            unreachable = []
+            for violator in to_delete:
+                delete_jobs.append(delete_pool.submit(tracing.propagate(_delete_violator), violator, emails.get(violator), vcenter, db, task_tracker, mailer, event_log))
+            for violator, vm_count, violation_date in to_warn:
+                if violator not in emails:
+                    if violation_date == 0:
+                        # Start the grace period anyway; otherwise it never expires
+                        log.warning('No email address found for %s; unable to warn them about exceeding their quota', violator)
+                        unreachable.append((violator, int(time.time()), 0))
+                    else:
+                        log.debug('No email address found for %s', violator)
+                    continue
+                warn_jobs.append(notify_pool.submit(tracing.propagate(_warn_violator), violator, emails[violator], vm_count, violation_date, mailer))
+        # Record every warning that was sent, even if some other violator hit an error
+        warned = [x.result() for x in warn_jobs if x.exception() is None]
+        if isinstance(mailer, Outbox):
+            # Queued and recorded together, so a crash in between can't send a warning twice
+            mailer.flush(users=warned + unreachable)
+        else:
+            # Only warnings that were actually sent should be recorded
+            failed = mailer.flush() if mailer is not None else {}
+            warned = [x for x in warned if emails[x[0]] not in failed]
+            db.upsert_users(warned + unreachable)
+        if event_log is not None:
+            for violator, _, _ in unreachable:
+                event_log.record(violator, events.FIRST_VIOLATION, vms=violators[violator])
+            for violator, _, _ in warned:
+                if violators_info[violator][0] == 0:
+                    event_log.record(violator, events.FIRST_VIOLATION, vms=violators[violator])
+                event_log.record(violator, events.WARNED, vms=violators[violator])
+        for violator, job in zip(to_delete, delete_jobs):
+            try:
+                # Re-raises any error hit while processing a violator
+                job.result()
+            except requests.exceptions.RequestException as doh:
+                # i.e. a single user's gateway is broken; that's no reason to
+                # back off enforcing everyone else's quota
+                log.error('Unable to delete the VMs of %s: %s', violator, doh)
+        for job in warn_jobs:
+            job.result()
+        # Include the grace periods that started during this loop
+        violators_info.update((x[0], (x[1], x[2])) for x in warned + unreachable)
+        return violators_info
+
+
+def _delete_violator(violator, user_email, vcenter, db, task_tracker=None, mailer=None, event_log=None):
+    """Delete enough VMs to resolve a user's quota violation, and let them know
+    which VMs were deleted.
+
+    When a ``task_tracker`` is supplied, this only starts deleting the VMs; the
+    user is notified by ``_resolve_deletions`` once the deletions finish.
+
+    :Returns: None
+
+    :param violator: The user whose grace period has expired.
+    :type violator: String
+
+    :param user_email: The email address of the user; None if it's unknown.
+                       Unused with a ``task_tracker``.
+    :type user_email: String
 
     :param vcenter: An object for interacting with the vCenter API.
     :type vcenter: vlab_inf_common.vmaware.vCenter
@@ -106,49 +285,352 @@ def _enforce_quotas(vcenter, db, ldap_conn):
     :param db: An established connection to the Quota database.
     :type db: vlab_quotas.libs.database.Database
 
-    :param ldap_conn: An authenticated connection to an LDAP server.
-    :type ldap_conn: ldap3.core.connection.Connection
-    """
-    violators = _get_violators(vcenter)
-    log.info('Users exceeding quota: {}'.format(','.join(violators)))
-    for violator, vm_count in violators.items():
-        violation_date, last_time_notified = db.user_info(violator)
-        user_email = _get_user_email(violator, ldap_conn)
-        now = time.time()
-        if _grace_period_exceeded(violation_date):
-            log.info("Soft quota grace period expired for user %s. Deleting VMs", violator)
-            vms_deleted = destroy_vms(violator, vcenter)
-            notify.send_follow_up(user_email, now, vms_deleted)
-            db.remove_user(violator)
-        elif notify.should_send_warning(violation_date, last_time_notified):
-            log.info("Sending user %s warning about soft quota violation", violator)
-            if violation_date == 0:
-                # the DB returns zero if the user does not exist; i.e. this
-                # is the first time we detected a violation for them.
-                violation_date = now
-            exp_date = int(violation_date + const.QUOTA_GRACE_PERIOD)
-            notify.send_warning(user_email, vm_count, exp_date)
-            last_time_notified = now
-            db.upsert_user(violator, violation_date, last_time_notified)
-    return set(violators.keys())
-
-
-def _cleanup_reconciled_users(current_users_in_violation, users_in_violation, db):
-    """Remove the quota violation record if a user deleted VMs and is no longer
-    violating the quota limit.
+    :param task_tracker: Optional - Track VM deletions instead of blocking on them.
+    :type task_tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param mailer: Optional - Queue emails on this Mailer instead of sending each one on its own connection.
+    :type mailer: vlab_quota.libs.notify.Mailer
+
+    :param event_log: Optional - Record the deletion in the quota history.
+                      Unused with a ``task_tracker``.
+    :type event_log: vlab_quota.libs.events.EventLog
+    """
+    log.info("Soft quota grace period expired for user %s. Deleting VMs", violator)
+    with tracing.span('worker._delete_violator', user=violator):
+        try:
+            vms_deleted = destroy_vms(violator, vcenter, task_tracker)
+        except DestroyError as doh:
+            if task_tracker is None and doh.deleted:
+                # Let the user know about the VMs that were deleted; the violation
+                # record is kept so the rest are deleted in a later loop.
+                _deleted_vms(violator, user_email, doh.deleted, mailer, event_log)
+            raise doh.error
+        if task_tracker is not None:
+            # ``_resolve_deletions`` handles the rest once the deletions finish
+            return
+        _deleted_vms(violator, user_email, vms_deleted, mailer, event_log)
+        db.remove_user(violator)
+
+
+def _deleted_vms(violator, user_email, vms_deleted, mailer=None, event_log=None):
+    """Record that some of a user's VMs were deleted, and let them know which.
+
+    :Returns: None
+
+    :param violator: The user whose VMs were deleted.
+    :type violator: String
+
+    :param user_email: The email address of the user; None if it's unknown.
+    :type user_email: String
+
+    :param vms_deleted: The names of the VMs that were deleted.
+    :type vms_deleted: List
+
+    :param mailer: Optional - Queue emails on this Mailer instead of sending each one on its own connection.
+    :type mailer: vlab_quota.libs.notify.Mailer
+
+    :param event_log: Optional - Record the deletion in the quota history.
+    :type event_log: vlab_quota.libs.events.EventLog
+    """
+    metrics.DELETIONS.inc(len(vms_deleted))
+    if user_email:
+        notify.send_follow_up(user_email, time.time(), vms_deleted, mailer=mailer)
+    if event_log is not None and vms_deleted:
+        event_log.record(violator, events.DELETED, vms=len(vms_deleted))
+
+
+def _resolve_deletions(task_tracker, db, ldap_pool, mailer=None, event_log=None):
+    """Notify users whose VM deletions have finished, and remove their quota
+    violation record.
+
+    If any deletion failed, or was deferred because too many were in flight,
+    the violation record is kept so the remaining VMs are deleted in a later loop.
+
+    :Returns: None
+
+    :param task_tracker: The outstanding VM deletions.
+    :type task_tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param ldap_pool: The pool of connections to the LDAP server.
+    :type ldap_pool: vlab_quota.libs.ldap_pool.LdapPool
+
+    :param mailer: Optional - Queue emails on this Mailer instead of sending each one on its own connection.
+    :type mailer: vlab_quota.libs.notify.Mailer
+
+    :param event_log: Optional - Record the deletions in the quota history.
+    :type event_log: vlab_quota.libs.events.EventLog
+    """
+    with tracing.span('worker.poll_tasks'):
+        finished = task_tracker.poll()
+    to_email = [user for user, (vms_deleted, _, _) in finished.items() if vms_deleted]
+    emails = _get_user_emails(to_email, ldap_pool) if to_email else {}
+    resolved = []
+    for user, (vms_deleted, vms_failed, vms_deferred) in finished.items():
+        if vms_deleted:
+            log.info("Deleted VMs %s, owned by %s", ','.join(vms_deleted), user)
+            metrics.DELETIONS.inc(len(vms_deleted))
+            if event_log is not None:
+                event_log.record(user, events.DELETED, vms=len(vms_deleted))
+            if user in emails:
+                notify.send_follow_up(emails[user], time.time(), vms_deleted, mailer=mailer)
+        if vms_failed:
+            log.error("Failed to delete VMs %s, owned by %s; trying again later", ','.join(vms_failed), user)
+        if vms_deferred:
+            log.info("Too many VM deletions in flight; deleting VMs %s, owned by %s, later",
+                     ','.join(vms_deferred), user)
+        if not (vms_failed or vms_deferred):
+            resolved.append(user)
+    db.remove_users(resolved)
+
+
+def _warn_violator(violator, user_email, vm_count, violation_date, mailer=None):
+    """Warn a user that they've exceeded their quota.
+
+    Returns the (username, violation_date, last_time_notified) to record in the
+    database for the user.
+
+    :Returns: Tuple
+
+    :param violator: The user exceeding their quota.
+    :type violator: String
+
+    :param user_email: The email address of the user.
+    :type user_email: String
+
+    :param vm_count: The number of VMs the user owns.
+    :type vm_count: Integer
+
+    :param violation_date: The EPOCH timestamp when the user exceeded their quota.
+                           Zero if this is the first time it's been detected.
+    :type violation_date: Integer
+
+    :param mailer: Optional - Queue emails on this Mailer instead of sending each one on its own connection.
+    :type mailer: vlab_quota.libs.notify.Mailer
+    """
+    log.info("Sending user %s warning about soft quota violation", violator)
+    now = time.time()
+    if violation_date == 0:
+        # the DB returns zero if the user does not exist; i.e. this
+        # is the first time we detected a violation for them.
+        violation_date = now
+    exp_date = int(violation_date + const.QUOTA_GRACE_PERIOD)
+    with tracing.span('worker._warn_violator', user=violator):
+        notify.send_warning(user_email, vm_count, exp_date, mailer=mailer)
+    return (violator, violation_date, now)
+
+
+def _cleanup_reconciled_users(current_users_in_violation, db, shards=None, event_log=None):
+    """Remove the quota violation record of every user that is no longer
+    violating the quota limit (i.e. they deleted VMs).
+
+    :Returns: None
 
     :param current_users_in_violation: The most recent group of users that exceeded the quota limit
     :type current_users_in_violation: Set
 
-    :param users_in_violation: The last group of users that exceeded the quota limit
-    :type users_in_violation: Set
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param shards: Optional - Only cleanup the users in the shards this worker owns;
+                   the other workers' violators aren't in ``current_users_in_violation``.
+    :type shards: vlab_quota.libs.sharding.ShardCoordinator
+
+    :param event_log: Optional - Record the users who got back under their quota in the quota history.
+    :type event_log: vlab_quota.libs.events.EventLog
+    """
+    if shards is None:
+        reconciled = db.reconcile_users(current_users_in_violation)
+    else:
+        stale = [username for username, _, _ in db.iter_violations()
+                 if shards.owns(username) and username not in current_users_in_violation]
+        reconciled = db.remove_users(stale)
+    if event_log is not None:
+        for username in reconciled:
+            event_log.record(username, events.RECONCILED)
+
+
+def _get_mailer(db):
+    """Obtain what a loop's emails are queued on; either the durable outbox
+    (sent by the OutboxSender), or a Mailer that sends them at the end of the loop.
+
+    :Returns: vlab_quota.libs.outbox.Outbox or vlab_quota.libs.notify.Mailer
 
     :param db: An established connection to the Quota database.
     :type db: vlab_quotas.libs.database.Database
     """
-    reconciled_users = [x for x in users_in_violation if x not in current_users_in_violation]
-    for user in reconciled_users:
-        db.remove_user(user)
+    if const.QUOTA_EMAIL_DELIVERY == 'outbox':
+        return Outbox(db)
+    return notify.Mailer()
+
+
+def _next_grace_expiry(violators_info):
+    """Find when the soonest (future) grace period of the violators expires.
+
+    :Returns: Integer or None - An EPOCH timestamp; None if no grace period will expire
+
+    :param violators_info: The (violation_date, last_time_notified) of each user exceeding their quota.
+    :type violators_info: Dictionary
+    """
+    now = time.time()
+    expiries = [violation_date + const.QUOTA_GRACE_PERIOD for violation_date, _ in violators_info.values()]
+    return min((x for x in expiries if x >= now), default=None)
+
+
+def _failed_backend(error):
+    """Determine which backend an error came from.
+
+    :Returns: String
+
+    :param error: An error from ``BACKEND_ERRORS``
+    :type error: Exception
+    """
+    # The order matters; SMTP and requests errors are also OSErrors
+    if isinstance(error, DatabaseError):
+        return 'db'
+    elif isinstance(error, LDAPException):
+        return 'ldap'
+    elif isinstance(error, (notify.NotifyError, smtplib.SMTPException)):
+        return 'smtp'
+    elif isinstance(error, requests.exceptions.RequestException):
+        return 'vlab_api'
+    elif isinstance(error, vmodl.MethodFault):
+        return 'vcenter'
+    # A bare socket error could be from vCenter or the SMTP server
+    return 'network'
+
+
+def _run_cycle(vcenter, db, ldap_pool, tracker, task_tracker, shards=None):
+    """A single pass of quota enforcement; the body of the loop in ``main``.
+
+    Returns the users exceeding their quota, and when the soonest grace
+    period expires (see ``_next_grace_expiry``).
+
+    :Returns: Tuple
+
+    :param vcenter: An object for interacting with the vCenter API.
+    :type vcenter: vlab_inf_common.vmaware.vCenter
+
+    :param db: An established connection to the Quota database.
+    :type db: vlab_quotas.libs.database.Database
+
+    :param ldap_pool: The pool of connections to the LDAP server.
+    :type ldap_pool: vlab_quota.libs.ldap_pool.LdapPool
+
+    :param tracker: The incrementally tracked vCenter inventory; None to scan vCenter.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+
+    :param task_tracker: The outstanding VM deletions.
+    :type task_tracker: vlab_quota.libs.tasks.TaskTracker
+
+    :param shards: Optional - Split the users between many workers.
+    :type shards: vlab_quota.libs.sharding.ShardCoordinator
+    """
+    with tracing.span('worker.cycle'):
+        if shards is not None:
+            # Hold onto users whose VMs are being deleted, so no other
+            # worker starts deleting them too.
+            shards.rebalance(keep=task_tracker.groups())
+        event_log = EventLog(db) if const.QUOTA_EVENT_HISTORY == 'on' else None
+        try:
+            with _get_mailer(db) as mailer:
+                _resolve_deletions(task_tracker, db, ldap_pool, mailer, event_log)
+                violators_info = _enforce_quotas(vcenter, db, ldap_pool, tracker, task_tracker,
+                                                 mailer, shards, event_log)
+            current_users_in_violation = set(violators_info)
+            _cleanup_reconciled_users(current_users_in_violation, db, shards, event_log)
+        finally:
+            if event_log is not None:
+                # All of the cycle's history is written with a single statement
+                event_log.flush()
+        return current_users_in_violation, _next_grace_expiry(violators_info)
+
+
+def _pause(seconds, tracker=None):
+    """Wait until it's time for the next enforcement loop.
+
+    When tracking the inventory incrementally, the wait ends early if vCenter
+    reports a change, so new VMs are noticed within seconds.
+
+    :Returns: None
+
+    :param seconds: The max amount of time to wait.
+    :type seconds: Float
+
+    :param tracker: Optional - The incrementally tracked vCenter inventory.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+    """
+    if tracker is None:
+        time.sleep(seconds)
+    else:
+        tracker.update(max_wait=seconds)
+
+
+def _connect_vcenter():
+    """Log into vCenter, and start tracking the inventory if QUOTA_INVENTORY_MODE
+    is ``incremental``.
+
+    :Returns: Tuple - (vCenter, InventoryTracker or None)
+    """
+    vcenter = vCenter(host=const.INF_VCENTER_SERVER,
+                      user=const.INF_VCENTER_USER,
+                      password=const.INF_VCENTER_PASSWORD)
+    if const.QUOTA_INVENTORY_MODE != 'incremental':
+        return vcenter, None
+    tracker = InventoryTracker(vcenter, path=const.INF_VCENTER_TOP_LVL_DIR)
+    try:
+        tracker.update()
+    except BACKEND_ERRORS:
+        vcenter.close()
+        raise
+    return vcenter, tracker
+
+
+def _disconnect_vcenter(vcenter, tracker):
+    """End the vCenter session, and stop tracking the inventory. Errors are only
+    logged; the session is likely already dead.
+
+    :Returns: None
+
+    :param vcenter: The session to end.
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param tracker: The (optional) tracker using the session.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+    """
+    try:
+        if tracker is not None:
+            tracker.close()
+        vcenter.close()
+    except BACKEND_ERRORS as doh:
+        log.warning('Error closing vCenter session: %s', doh)
+
+
+def _reconnect_vcenter(vcenter, tracker):
+    """Replace a vCenter session that stopped working (i.e. vCenter restarted or
+    the session expired). pyVmomi never logs back in on its own, so retrying with
+    the old session fails forever, and an old tracker would keep reporting the
+    inventory from before the failure.
+
+    Returns the new session and tracker, or the old ones if vCenter is still
+    unreachable; the next vCenter error tries again.
+
+    :Returns: Tuple - (vCenter, InventoryTracker or None)
+
+    :param vcenter: The session to replace.
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param tracker: The (optional) tracker using the session.
+    :type tracker: vlab_quota.libs.inventory.InventoryTracker
+    """
+    _disconnect_vcenter(vcenter, tracker)
+    try:
+        return _connect_vcenter()
+    except BACKEND_ERRORS as doh:
+        log.error('Unable to reconnect to vCenter: %s', doh)
+        return vcenter, tracker
 
 
 def main():
@@ -159,24 +641,72 @@ def main():
     log.info('LDAP Server: %s', const.AUTH_LDAP_URL)
     log.info('LDAP User: %s', const.AUTH_BIND_USER)
     log.info('SMTP Server: %s', const.QUOTA_EMAIL_SERVER)
-    log.info('Loop interval: %s', LOOP_INTERVAL)
-    vcenter = vCenter(host=const.INF_VCENTER_SERVER,
-                      user=const.INF_VCENTER_USER,
-                      password=const.INF_VCENTER_PASSWORD)
-    atexit.register(vcenter.close)
+    log.info('Loop interval: %s (min %s, max %s)', LOOP_INTERVAL, const.QUOTA_LOOP_MIN_INTERVAL, const.QUOTA_LOOP_MAX_INTERVAL)
+    log.info('Inventory mode: %s', const.QUOTA_INVENTORY_MODE)
+    log.info('Delete workers: %s', const.QUOTA_DELETE_WORKERS)
+    log.info('Notify workers: %s', const.QUOTA_NOTIFY_WORKERS)
+    log.info('LDAP pool size: %s', const.QUOTA_LDAP_POOL_SIZE)
+    log.info('Email delivery: %s', const.QUOTA_EMAIL_DELIVERY)
+    log.info('Event history: %s', const.QUOTA_EVENT_HISTORY)
+    log.info('Metrics port: %s', const.QUOTA_METRICS_PORT)
+    log.info('Trace file: %s', const.QUOTA_TRACE_FILE)
+    log.info('Worker mode: %s', const.QUOTA_WORKER_MODE)
+    log.info('Victim policy: %s', const.QUOTA_VICTIM_POLICY)
+    check_victim_policy(const.QUOTA_VICTIM_POLICY)
+    if const.QUOTA_TRACE_FILE:
+        tracing.configure(const.QUOTA_TRACE_FILE)
+        atexit.register(tracing.close)
+    if const.QUOTA_METRICS_PORT:
+        metrics_server = metrics.serve(const.QUOTA_METRICS_PORT)
+        atexit.register(metrics_server.shutdown)
+    vcenter, tracker = _connect_vcenter()
+    # A lambda, so whichever session is current at exit gets closed
+    atexit.register(lambda: _disconnect_vcenter(vcenter, tracker))
     db = Database()
     atexit.register(db.close)
-    ldap_conn = _get_ldap_conn()
-    atexit.register(ldap_conn.unbind)
-    users_in_violation = set()
+    if const.QUOTA_EMAIL_DELIVERY == 'outbox':
+        # separate connection, so sending email never waits on the enforcement loop
+        sender = OutboxSender(Database())
+        sender.start()
+        atexit.register(sender.stop)
+    ldap_pool = LdapPool(_get_ldap_conn)
+    atexit.register(ldap_pool.close)
+    atexit.register(sessions.close)
+    if const.QUOTA_WORKER_MODE == 'sharded':
+        shards = ShardCoordinator()
+        atexit.register(shards.close)
+    else:
+        shards = None
+    task_tracker = TaskTracker()
+    scheduler = Scheduler(LOOP_INTERVAL)
     while True:
-        start_loop = int(time.time())
-        current_users_in_violation = _enforce_quotas(vcenter, db, ldap_conn)
-        _cleanup_reconciled_users(current_users_in_violation, users_in_violation, db)
-        users_in_violation = current_users_in_violation
-        loop_ran_for = max(0, int(time.time()) - start_loop)
-        sleep_delta = max(0, (LOOP_INTERVAL - loop_ran_for))
-        time.sleep(sleep_delta)
+        scheduler.start_cycle()
+        try:
+            violators, next_expiry = _run_cycle(vcenter, db, ldap_pool, tracker, task_tracker, shards)
+        except BACKEND_ERRORS as doh:
+            backend = _failed_backend(doh)
+            log.exception('Enforcement cycle failed; backend %s error: %s', backend, doh)
+            scheduler.failed(backend)
+            if backend in VCENTER_BACKENDS:
+                vcenter, tracker = _reconnect_vcenter(vcenter, tracker)
+        else:
+            scheduler.succeeded(idle=not (violators or len(task_tracker)), next_expiry=next_expiry)
+        delay = scheduler.finish_cycle()
+        try:
+            # Don't cut a backoff short just because the inventory changed
+            _pause(delay, tracker if scheduler.healthy() else None)
+        except BACKEND_ERRORS as doh:
+            # i.e. the vCenter session expired while waiting on changes
+            backend = _failed_backend(doh)
+            log.exception('Waiting for the next enforcement cycle failed; backend %s error: %s', backend, doh)
+            scheduler.failed(backend)
+            if backend in VCENTER_BACKENDS:
+                vcenter, tracker = _reconnect_vcenter(vcenter, tracker)
+            _pause(scheduler.delay())
+        else:
+            # An inventory change can end the wait early, but not so early
+            # that cycles run closer together than QUOTA_LOOP_MIN_INTERVAL
+            _pause(scheduler.min_delay())
 
 
 if __name__ == '__main__':